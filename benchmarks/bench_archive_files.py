@@ -0,0 +1,104 @@
+# Copyright 2018 Iguazio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compare packing many small files into a function archive
+
+Runs the plain ZipFile.write loop (how archives used to be built), then
+build_zip with a single worker and with a pool of workers, and the archive
+manifest (parallel stat/hash of the files) cold and with a warm hash index.
+
+    python benchmarks/bench_archive_files.py [-n files] [-s size] [-j workers]
+"""
+import zipfile
+from argparse import ArgumentParser
+from os import path, makedirs, urandom, environ
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import monotonic
+
+from nuclio.archive import (build_zip, default_pack_workers, archive_members,
+                            archive_manifest)
+from nuclio.utils import env_keys
+
+
+def make_files(root, count, size):
+    files = []
+    for i in range(count):
+        dir_path = path.join(root, 'data', str(i % 100))
+        makedirs(dir_path, exist_ok=True)
+        file_path = path.join(dir_path, 'file-{}.txt'.format(i))
+        with open(file_path, 'wb') as fp:
+            # compressible, like vocabularies or templates
+            fp.write(urandom(size // 4).hex().encode() * 2)
+        files.append(file_path)
+    return files
+
+
+def zip_write_loop(zip_path, files):
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr('handler.py', 'print(1)')
+        for f in files:
+            if not path.isfile(f):
+                raise Exception('file name {} not found'.format(f))
+            z.write(f)
+
+
+def config():
+    return {'metadata': {'name': 'bench'}, 'spec': {'build': {}}}
+
+
+def timed(func, *args, **kw):
+    start = monotonic()
+    func(*args, **kw)
+    return monotonic() - start
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--files', type=int, default=10000)
+    parser.add_argument('-s', '--size', type=int, default=2048)
+    parser.add_argument('-j', '--workers', type=int,
+                        default=default_pack_workers)
+    args = parser.parse_args()
+
+    root = mkdtemp(prefix='nuclio-bench-')
+    try:
+        files = make_files(root, args.files, args.size)
+        data_dir = path.join(root, 'data')
+        zip_path = path.join(root, 'out.zip')
+        print('{} files of {} bytes'.format(args.files, args.size))
+
+        duration = timed(zip_write_loop, zip_path, files)
+        print('{:<24} {:.3f}s'.format('ZipFile.write loop', duration))
+        duration = timed(build_zip, zip_path, config(), '', [data_dir],
+                         workers=1)
+        print('{:<24} {:.3f}s'.format('build_zip 1 worker', duration))
+        duration = timed(build_zip, zip_path, config(), '', [data_dir],
+                         workers=args.workers)
+        print('{:<24} {:.3f}s'.format(
+            'build_zip {} workers'.format(args.workers), duration))
+
+        members = archive_members(config(), '', [data_dir])
+        # empty hash index, without touching the user cache
+        environ[env_keys.cache_dir] = path.join(root, 'cache')
+        for label in ('cold', 'warm'):
+            duration = timed(archive_manifest, members, zipfile.ZIP_DEFLATED,
+                             None, args.workers)
+            print('{:<24} {:.3f}s'.format(
+                'archive_manifest ' + label, duration))
+    finally:
+        rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+# Copyright 2018 Iguazio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compare cold cost of in-process and subprocess (isolated) notebook builds
+
+Each run starts a fresh interpreter so import time is included, the same way
+a CI job that builds a single function pays for it.
+
+    python benchmarks/bench_build_notebook.py [notebook] [-n runs]
+"""
+from argparse import ArgumentParser
+from os import path
+from subprocess import run
+from sys import executable
+from time import monotonic
+
+here = path.dirname(path.abspath(__file__))
+default_nb = path.join(path.dirname(here), 'tests', 'handler.ipynb')
+
+code_template = '''
+from nuclio.build import build_notebook
+build_notebook({nb!r}, isolated={isolated})
+'''
+
+
+def cold_run(nb_file, isolated):
+    code = code_template.format(nb=nb_file, isolated=isolated)
+    start = monotonic()
+    run([executable, '-c', code], check=True)
+    return monotonic() - start
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('notebook', nargs='?', default=default_nb)
+    parser.add_argument('-n', '--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    for isolated in (False, True):
+        mode = 'subprocess' if isolated else 'in-process'
+        times = [cold_run(args.notebook, isolated) for _ in range(args.runs)]
+        print('{:<12} min {:.3f}s  avg {:.3f}s'.format(
+            mode, min(times), sum(times) / len(times)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+# Copyright 2018 Iguazio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compare setting many env vars in a function config
+
+Runs the old per-variable linear scan against config.set_env_dict, first
+adding N new vars and then updating all of them.
+
+    python benchmarks/bench_config_env.py [-n vars]
+"""
+from argparse import ArgumentParser
+from time import monotonic
+
+from nuclio.config import new_config, set_env_dict
+
+
+def scan_update_env_var(config, key, value):
+    # update_env_var before the name -> index map
+    i = 0
+    found = False
+    for v in config['spec']['env']:
+        if v['name'] == key:
+            found = True
+            break
+        i += 1
+
+    item = {'name': key, 'value': value}
+    if found:
+        config['spec']['env'][i] = item
+    else:
+        config['spec']['env'].append(item)
+
+
+def scan_set_env_dict(config, env):
+    for k, v in env.items():
+        scan_update_env_var(config, k, str(v))
+
+
+def timed(func, env):
+    config = new_config()
+    start = monotonic()
+    func(config, env)  # add
+    func(config, env)  # update
+    return monotonic() - start
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--vars', type=int, default=10000)
+    args = parser.parse_args()
+
+    env = {'VAR_{}'.format(i): i for i in range(args.vars)}
+    print('{} env vars'.format(args.vars))
+    for name, func in [('linear scan', scan_set_env_dict),
+                       ('set_env_dict', set_env_dict)]:
+        print('{:<16} {:.3f}s'.format(name, timed(func, env)))
+
+
+if __name__ == '__main__':
+    main()
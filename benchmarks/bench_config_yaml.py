@@ -0,0 +1,58 @@
+# Copyright 2018 Iguazio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compare function config YAML round-trips
+
+Runs the pure python yaml.dump/yaml.safe_load against utils.yaml_dump and
+utils.yaml_load (libyaml when installed) on a config with N env vars.
+
+    python benchmarks/bench_config_yaml.py [-n round-trips] [-e vars]
+"""
+from argparse import ArgumentParser
+from time import monotonic
+
+import yaml
+
+from nuclio.config import new_config, set_env_dict
+from nuclio.utils import yaml_dump, yaml_load
+
+
+def py_dump(obj):
+    return yaml.dump(obj, default_flow_style=False)
+
+
+def timed(dump, load, config, count):
+    start = monotonic()
+    for _ in range(count):
+        load(dump(config))
+    return monotonic() - start
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--count', type=int, default=100)
+    parser.add_argument('-e', '--vars', type=int, default=100)
+    args = parser.parse_args()
+
+    config = new_config()
+    set_env_dict(config, {'VAR_{}'.format(i): i for i in range(args.vars)})
+    print('{} round-trips, {} env vars, libyaml={}'.format(
+        args.count, args.vars, yaml.__with_libyaml__))
+    for name, dump, load in [('pure python', py_dump, yaml.safe_load),
+                             ('yaml_dump/load', yaml_dump, yaml_load)]:
+        print('{:<16} {:.3f}s'.format(
+            name, timed(dump, load, config, args.count)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+# Copyright 2018 Iguazio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Measure notebook export throughput on notebooks with many cells
+
+Generates a notebook with N code cells (plain code, comments, magics, shell
+escapes and function annotations) and times NuclioExporter.export_notebook
+and export_functions, cold (empty cell memo) and re-exports after editing
+one cell.
+
+    python benchmarks/bench_export_cells.py [-n cells] [-r runs]
+"""
+from argparse import ArgumentParser
+from time import monotonic
+
+from nuclio.export import NuclioExporter, convert_cell, parse_cell
+
+cell_templates = [
+    'import os\nx{i} = os.environ.get("X", {i})\n',
+    '# compute\ndef f{i}(a, b):\n    # sum\n    return a + b * {i}\n',
+    '%nuclio env VAR_{i}=value\ny{i} = [v for v in range({i})]\n',
+    '!pip install package{i}\nfiles = !ls\nz{i} = len(files)\n',
+    'class C{i}:\n    """doc"""\n    value = {i}\n\n    def get(self):\n'
+    '        return self.value\n',
+    '%%timeit\nsum(range({i}))\n',
+    'df{i} = load({i})\ndf{i}.describe()\n',
+]
+
+
+def gen_notebook(ncells, nfuncs=10):
+    cells = []
+    for i in range(ncells):
+        source = cell_templates[i % len(cell_templates)].format(i=i)
+        func = i * nfuncs // ncells
+        if i % (ncells // nfuncs) == 0:
+            source = '# nuclio: start-code func{}\n'.format(func) + source
+        cells.append({'cell_type': 'code', 'source': source})
+    return {'cells': cells, 'metadata': {}, 'nbformat': 4}
+
+
+def timed(func, nb, runs, cold):
+    times = []
+    for run in range(runs):
+        if cold:
+            parse_cell.cache_clear()
+            convert_cell.cache_clear()
+        else:
+            nb['cells'][0]['source'] = 'edit = {}\n'.format(run)
+        start = monotonic()
+        func(nb, {'metadata': {'name': 'bench'}})
+        times.append(monotonic() - start)
+    return min(times)
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--cells', type=int, default=5000)
+    parser.add_argument('-r', '--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    nb = gen_notebook(args.cells)
+    exporter = NuclioExporter()
+    print('{} cells'.format(args.cells))
+    for name, func in [('export_notebook', exporter.export_notebook),
+                       ('export_functions', exporter.export_functions)]:
+        for cold in (True, False):
+            duration = timed(func, nb, args.runs, cold)
+            print('{:<18} {:<9} {:.3f}s  {:8.0f} cells/s'.format(
+                name, 'cold' if cold else 're-export', duration,
+                args.cells / duration))
+
+
+if __name__ == '__main__':
+    main()
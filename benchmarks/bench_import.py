@@ -0,0 +1,67 @@
+# Copyright 2018 Iguazio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Measure nuclio import time with python -X importtime
+
+Each statement runs in a fresh interpreter, prints the best total import time
+(without interpreter startup) and the slowest packages.
+
+    python benchmarks/bench_import.py [-n runs] [-t top]
+"""
+from argparse import ArgumentParser
+from subprocess import PIPE, run
+from sys import executable
+
+statements = [
+    'import nuclio',
+    'import nuclio.__main__',
+    'from nuclio import deploy_code',
+]
+
+
+def import_times(code):
+    """package -> import time (us, self time of all its modules)"""
+    out = run([executable, '-X', 'importtime', '-c', code],
+              stderr=PIPE, check=True)
+    times = {}
+    for line in out.stderr.decode('utf-8').splitlines():
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        package = fields[2].strip().split('.')[0]
+        times[package] = times.get(package, 0) + int(fields[0])
+    return times
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--runs', type=int, default=5)
+    parser.add_argument('-t', '--top', type=int, default=5)
+    args = parser.parse_args()
+
+    startup = set(import_times('pass'))
+    for code in statements:
+        runs = []
+        for _ in range(args.runs):
+            times = import_times(code)
+            runs.append({name: usec for name, usec in times.items()
+                         if name not in startup})
+        best = min(runs, key=lambda times: sum(times.values()))
+        print('{:<32} {:8.1f}ms'.format(code, sum(best.values()) / 1000))
+        top = sorted(best.items(), key=lambda item: -item[1])[:args.top]
+        for name, usec in top:
+            print('    {:<28} {:8.1f}ms'.format(name, usec / 1000))
+
+
+if __name__ == '__main__':
+    main()
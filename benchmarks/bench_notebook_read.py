@@ -0,0 +1,87 @@
+# Copyright 2018 Iguazio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compare reading a notebook with large outputs, nbformat vs read_notebook
+
+Generates a notebook with SIZE MB of embedded image outputs, then measures
+the read time and the peak memory (tracemalloc) of each reader.
+
+    python benchmarks/bench_notebook_read.py [-s size-mb] [-c cells]
+"""
+import json
+import tracemalloc
+from argparse import ArgumentParser
+from os import path, remove
+from tempfile import mkdtemp
+from time import monotonic
+
+import nbformat
+
+from nuclio.nbreader import read_notebook
+
+
+def nbformat_read(nb_file):
+    return nbformat.read(nb_file, as_version=4)
+
+
+def gen_notebook(nb_file, size_mb, ncells):
+    image = 'iVBORw0KGgo' * (size_mb * 1024 ** 2 // ncells // 11)
+    cells = []
+    for i in range(ncells):
+        cells.append({
+            'cell_type': 'code', 'execution_count': i, 'metadata': {},
+            'source': ['import numpy as np\n', 'plot({})'.format(i)],
+            'outputs': [{'output_type': 'display_data', 'metadata': {},
+                         'data': {'image/png': image,
+                                  'text/plain': ['<Figure>']}}],
+        })
+    nb = {'cells': cells, 'metadata': {}, 'nbformat': 4, 'nbformat_minor': 2}
+    with open(nb_file, 'w') as fp:
+        json.dump(nb, fp)
+
+
+def measure(read, nb_file):
+    start = monotonic()
+    read(nb_file)
+    duration = monotonic() - start
+
+    tracemalloc.start()
+    read(nb_file)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return duration, peak
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('-s', '--size', type=int, default=500,
+                        help='outputs size (MB)')
+    parser.add_argument('-c', '--cells', type=int, default=200)
+    args = parser.parse_args()
+
+    nb_file = path.join(mkdtemp(prefix='nuclio-bench-'), 'big.ipynb')
+    gen_notebook(nb_file, args.size, args.cells)
+    print('{} ({:.0f}MB, {} cells)'.format(
+        nb_file, path.getsize(nb_file) / 1024 ** 2, args.cells))
+    try:
+        for name, read in [('nbformat.read', nbformat_read),
+                           ('read_notebook', read_notebook)]:
+            duration, peak = measure(read, nb_file)
+            print('{:<14} {:7.3f}s  peak {:8.1f}MB'.format(
+                name, duration, peak / 1024 ** 2))
+    finally:
+        remove(nb_file)
+
+
+if __name__ == '__main__':
+    main()
@@ -12,20 +12,61 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import sys
+from importlib import import_module
+
 from .request import Context, Event, inject_context as _inject_context  # noqa
-from . import magic  # noqa
-from .deploy import deploy_code, deploy_file, delete_func, deploy_model  # noqa
-from .config import Volume, ConfigSpec  # noqa
-from .build import build_file  # noqa
 from .triggers import HttpTrigger, CronTrigger, KafkaTrigger  # noqa
 
 __version__ = '0.8.12'
 
+# Functions only need Context/Event, the deploy/build API (and IPython,
+# nbconvert, boto3 ...) is imported on first access: name -> module
+_lazy_names = {
+    'deploy_code': 'deploy',
+    'deploy_file': 'deploy',
+    'delete_func': 'deploy',
+    'deploy_model': 'deploy',
+    'Volume': 'config',
+    'ConfigSpec': 'config',
+    'build_file': 'build',
+}
+_lazy_modules = {
+    'archive', 'async_deploy', 'build', 'cache', 'client', 'config',
+    'deploy', 'export', 'magic', 'utils',
+}
+
+
+def __getattr__(name):
+    if name in _lazy_modules:
+        return import_module('.' + name, __name__)
+    if name in _lazy_names:
+        value = getattr(import_module('.' + _lazy_names[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(
+        'module {!r} has no attribute {!r}'.format(__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy_names) | _lazy_modules)
+
+
 _inject_context()
 del _inject_context
 
 
+def _in_ipython():
+    ipython = sys.modules.get('IPython')
+    return ipython is not None and ipython.get_ipython() is not None
+
+
+# Register %nuclio when imported in a notebook/IPython session
+if _in_ipython():
+    from . import magic  # noqa
+
+
 # Allow %load_ext nuclio
 def load_ipython_extension(ipython):
-    # Nothing to do, nuclio/magic.py does the registration
-    pass
+    # nuclio/magic.py does the registration
+    import_module('.magic', __name__)
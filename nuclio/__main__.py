@@ -15,10 +15,14 @@
 import sys
 from argparse import ArgumentParser
 from os import path
+from time import monotonic
 
-from nuclio.utils import DeployError
+from nuclio.utils import DeployError, list2dict
+from nuclio.config import ConfigSpec
+from nuclio.build import build_many, populate_parser as populate_build_parser
 from nuclio.deploy import (deploy_from_args, delete_func, delete_parser,
-                           populate_parser as populate_deploy_parser)
+                           populate_parser as populate_deploy_parser,
+                           deploy_many_from_args, deploy_many_parser)
 
 
 def do_deploy(args):
@@ -28,6 +32,27 @@ def do_deploy(args):
         raise SystemExit('error: {}'.format(err))
 
 
+def do_deploy_many(args):
+    start = monotonic()
+    try:
+        results = deploy_many_from_args(args)
+    except (DeployError, ValueError) as err:
+        raise SystemExit('error: {}'.format(err))
+
+    row = '{:<30} {:<8} {:<25} {:>9}  {}'
+    print(row.format('NAME', 'STATE', 'ADDRESS', 'DURATION', 'ERROR'))
+    for result in results:
+        print(row.format(result.name, result.state, result.address,
+                         '{:.1f}s'.format(result.duration),
+                         result.error or ''))
+
+    failed = sum(1 for result in results if result.state != 'ready')
+    print('deployed {} functions, {} failed, in {:.1f}s'.format(
+        len(results) - failed, failed, monotonic() - start))
+    if failed:
+        raise SystemExit(1)
+
+
 def do_delete(args):
     try:
         delete_func(args.name, args.dashboard_url, args.namespace)
@@ -35,6 +60,38 @@ def do_delete(args):
         raise SystemExit('error: {}'.format(err))
 
 
+def do_build(args):
+    try:
+        spec = ConfigSpec(env=list2dict(args.env))
+    except ValueError as err:
+        raise SystemExit('error: {}'.format(err))
+
+    start = monotonic()
+    built = failed = cached = 0
+    results = build_many(args.files, args.output_dir, args.workers,
+                         archive=args.archive, project=args.project,
+                         tag=args.tag, spec=spec, kind=args.kind,
+                         cache=not args.no_cache,
+                         all_functions=args.all_functions)
+    for result in results:
+        if result.error:
+            failed += 1
+            print('failed {} ({:.2f}s): {}'.format(
+                result.source, result.duration, result.error),
+                file=sys.stderr)
+        else:
+            built += len(result.name.split(','))
+            cached += result.cached
+            print('built {} -> {} ({:.2f}s{})'.format(
+                result.source, result.name, result.duration,
+                ', cached' if result.cached else ''))
+
+    print('built {} functions ({} cached), {} failed, in {:.2f}s'.format(
+        built, cached, failed, monotonic() - start))
+    if failed:
+        raise SystemExit(1)
+
+
 def main():
     parser = ArgumentParser(prog='nuclio', description=__doc__)
     sub = parser.add_subparsers()
@@ -43,6 +100,14 @@ def main():
     populate_deploy_parser(dp)
     dp.set_defaults(func=do_deploy)
 
+    dmp = sub.add_parser('deploy-many')
+    deploy_many_parser(dmp)
+    dmp.set_defaults(func=do_deploy_many)
+
+    bp = sub.add_parser('build')
+    populate_build_parser(bp)
+    bp.set_defaults(func=do_build)
+
     delp = sub.add_parser('del')
     delete_parser(delp)
     delp.set_defaults(func=do_delete)
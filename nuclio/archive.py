@@ -13,29 +13,546 @@
 # limitations under the License.
 
 import io
+import json
+import mmap
+import os
+import struct
+import sys
 import zipfile
+import zlib
 from base64 import b64encode
-import yaml
-import requests
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256
 from os import path, remove, environ
 import shlex
 from argparse import ArgumentParser
-import boto3
+from glob import iglob
 from urllib.parse import urlparse, ParseResult
-from shutil import copyfile
+from shutil import copyfile, copyfileobj
+from tempfile import mkstemp
+from threading import Thread, Lock
+from time import monotonic
+
+from .cache import FileCache
+from .client import get_client, get_stream_client
+from .utils import env_keys, logger, yaml_dump, yaml_load
+
+compression_types = {
+    'store': zipfile.ZIP_STORED,
+    'deflate': zipfile.ZIP_DEFLATED,
+    'bzip2': zipfile.ZIP_BZIP2,
+    'lzma': zipfile.ZIP_LZMA,
+}
+default_compression = 'deflate'
+# zip epoch, used for reproducible archives
+fixed_date_time = (1980, 1, 1, 0, 0, 0)
+chunk_size = 1024 * 1024
+manifest_suffix = '.manifest.json'
+# files up to this size are compressed in memory by the pack workers
+pack_size_limit = 4 * 1024 ** 2
+default_pack_workers = os.cpu_count() or 1
+# file hash indexes (path -> size, mtime, hash), one per set of files
+hash_cache = FileCache('hashes', max_size=16 * 1024 ** 2)
+
+
+def parse_compression(compression=None, compresslevel=None):
+    """Return zipfile compression type and level
+
+    compression is one of store/deflate/bzip2/lzma (default from the
+    NUCLIO_ARCHIVE_COMPRESSION env var or deflate), optionally with a level
+    (e.g. "deflate:9")
+    """
+    compression = compression or environ.get(env_keys.archive_compression) \
+        or default_compression
+    if isinstance(compression, int):
+        return compression, compresslevel
+
+    name, _, level = compression.partition(':')
+    if name.lower() not in compression_types:
+        raise ValueError('unknown compression {!r}, use one of {}'.format(
+            name, ', '.join(compression_types)))
+    if level and compresslevel is None:
+        compresslevel = int(level)
+    return compression_types[name.lower()], compresslevel
+
+
+def zip_info(name, compress_type, compresslevel, date_time=None,
+             src_path=None):
+    if src_path:
+        info = zipfile.ZipInfo.from_file(src_path, name)
+        if date_time:
+            info.date_time = date_time
+    else:
+        info = zipfile.ZipInfo(name, date_time or fixed_date_time)
+        info.external_attr = 0o644 << 16
+    info.compress_type = compress_type
+    # ZipFile.open(.., 'w') doesn't accept a level, it reads it from info
+    info._compresslevel = compresslevel
+    return info
+
+
+def archive_members(config, code, files=[], ext='.py', handler='handler',
+                    deterministic=False):
+    """Return archive members, list of (name, data, file path)
 
+    data is bytes (code/config) or None for files. removes the function
+    name and inline source code from config (they are set on deploy)
+    """
+    files = expand_files(files)
+    if deterministic:
+        files = sorted(files)
 
-def build_zip(zip_path, config, code, files=[], ext='.py', handler='handler'):
-    z = zipfile.ZipFile(zip_path, "w")
     config['spec']['build'].pop("functionSourceCode", None)
     config['metadata'].pop("name", None)
-    z.writestr(handler + ext, code)
-    z.writestr('function.yaml', yaml.dump(config, default_flow_style=False))
+    config_text = yaml_dump(config)
+    members = [
+        (handler + ext, code.encode('utf-8'), None),
+        ('function.yaml', config_text.encode('utf-8'), None),
+    ]
+    members.extend((arc_name(f), None, f) for f in files)
+    return members
+
+
+def expand_files(files):
+    """Expand directories (recursively) and glob patterns to file paths"""
+    out = []
     for f in files:
-        if not path.isfile(f):
+        if path.isdir(f):
+            for root, dirs, names in os.walk(f):
+                dirs.sort()
+                out.extend(path.join(root, name) for name in sorted(names))
+        elif any(c in f for c in '*?['):
+            matches = sorted(m for m in iglob(f, recursive=True)
+                             if path.isfile(m))
+            if not matches:
+                raise Exception('no files match {}'.format(f))
+            out.extend(matches)
+        elif path.isfile(f):
+            out.append(f)
+        else:
             raise Exception('file name {} not found'.format(f))
-        z.write(f)
-    z.close()
+    # drop duplicates, keep order
+    return list(dict.fromkeys(out))
+
+
+def arc_name(file_path):
+    """Archive member name of file (as in ZipInfo.from_file)"""
+    name = path.normpath(path.splitdrive(file_path)[1])
+    while name[0] in (os.sep, os.altsep):
+        name = name[1:]
+    return name.replace(os.sep, '/')
+
+
+def file_hash(file_path):
+    """Return sha256 of file content"""
+    hasher = sha256()
+    for chunk in file_chunks(file_path):
+        hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def archive_manifest(members, compress_type, compresslevel, workers=None):
+    """Archive manifest, compression and (name, sha256) of every member
+
+    files are stat-ed and hashed by a pool of workers threads, unchanged
+    files (same size and mtime) are not hashed again, see hash_cache
+    """
+    files = sorted({path.abspath(src_path)
+                    for _, _, src_path in members if src_path is not None})
+    index_key = sha256('\n'.join(files).encode('utf-8')).hexdigest()
+    index = (hash_cache.get_json(index_key) or {}) if files else {}
+    new_index = {}
+
+    def member_hash(member):
+        name, data, src_path = member
+        if src_path is None:
+            return [name, sha256(data).hexdigest()]
+        abs_path = path.abspath(src_path)
+        stat = os.stat(abs_path)
+        entry = [stat.st_size, stat.st_mtime_ns]
+        cached = index.get(abs_path)
+        if cached and cached[:2] == entry:
+            digest = cached[2]
+        else:
+            digest = file_hash(abs_path)
+        new_index[abs_path] = entry + [digest]
+        return [name, digest]
+
+    workers = workers or default_pack_workers
+    if workers > 1 and len(members) > 2:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            hashes = list(pool.map(member_hash, members))
+    else:
+        hashes = [member_hash(member) for member in members]
+    if new_index != index:
+        hash_cache.put_json(index_key, new_index)
+    return {
+        'compression': [compress_type, compresslevel],
+        'members': hashes,
+    }
+
+
+def s3_errors():
+    """botocore errors to catch, boto3 is only loaded by S3Repo"""
+    exceptions = sys.modules.get('botocore.exceptions')
+    return (exceptions.ClientError, ) if exceptions else ()
+
+
+def read_manifest(url, headers=None):
+    """Return archive manifest (or None)
+
+    http(s) urls (deployed archives) are read with headers (auth) and not
+    cached
+    """
+    try:
+        if urlparse(url).scheme in ('http', 'https'):
+            return json.loads(http_get(url, headers))
+        return json.loads(url2repo(url).get())
+    except (OSError, ValueError) + s3_errors():
+        return None
+
+
+def write_raw(dest, info, chunks):
+    """Write member with already compressed data to dest ZipFile
+
+    info must have CRC, file_size and compress_size set
+    """
+    # sizes are known, no data descriptor
+    info.flag_bits &= ~0x08
+    zip64 = max(info.file_size, info.compress_size) > zipfile.ZIP64_LIMIT
+    info.header_offset = dest.fp.tell()
+    dest.fp.write(info.FileHeader(zip64))
+    for chunk in chunks:
+        dest.fp.write(chunk)
+
+    dest.filelist.append(info)
+    dest.NameToInfo[info.filename] = info
+    dest.start_dir = dest.fp.tell()
+    dest._didModify = True
+
+
+def copy_member(src, dest, name):
+    """Copy compressed member from src to dest ZipFile (no recompression)"""
+    info = src.getinfo(name)
+    fp = src.fp
+    fp.seek(info.header_offset)
+    header = fp.read(zipfile.sizeFileHeader)
+    if header[:4] != zipfile.stringFileHeader:
+        raise zipfile.BadZipFile('bad local header for {}'.format(name))
+    name_size, extra_size = struct.unpack('<HH', header[26:30])
+    fp.seek(info.header_offset + zipfile.sizeFileHeader + name_size +
+            extra_size)
+
+    def chunks():
+        left = info.compress_size
+        while left > 0:
+            chunk = fp.read(min(chunk_size, left))
+            if not chunk:
+                raise zipfile.BadZipFile('truncated member {}'.format(name))
+            left -= len(chunk)
+            yield chunk
+
+    new = zipfile.ZipInfo(info.filename, info.date_time)
+    for attr in ('compress_type', 'external_attr', 'create_system', 'CRC',
+                 'compress_size', 'file_size', 'flag_bits'):
+        setattr(new, attr, getattr(info, attr))
+    write_raw(dest, new, chunks())
+
+
+def pack_file(name, src_path, compress_type, compresslevel, date_time=None):
+    """Compress a small file in memory, return (ZipInfo, data)
+
+    returns None for files bigger than pack_size_limit (streamed instead)
+    """
+    info = zip_info(name, compress_type, compresslevel, date_time, src_path)
+    if info.file_size > pack_size_limit:
+        return None
+    with open(src_path, 'rb') as fp:
+        data = fp.read()
+    info.file_size = len(data)
+    info.CRC = zlib.crc32(data)
+    if compress_type != zipfile.ZIP_STORED:
+        # same compressor (and lzma header) zipfile uses
+        compressor = zipfile._get_compressor(compress_type, compresslevel)
+        data = compressor.compress(data) + compressor.flush()
+    if compress_type == zipfile.ZIP_LZMA:
+        # compressed data includes an EOS marker (as set by zipfile)
+        info.flag_bits |= 0x02
+    info.compress_size = len(data)
+    return info, data
+
+
+def pack_ahead(members, pool, window, skip, *args):
+    """Yield (member, future) with up to window files compressed ahead"""
+    pending = deque()
+    for member in members:
+        name, _, src_path = member
+        future = None
+        if src_path is not None and name not in skip:
+            future = pool.submit(pack_file, name, src_path, *args)
+        pending.append((member, future))
+        if len(pending) > window:
+            yield pending.popleft()
+    while pending:
+        yield pending.popleft()
+
+
+def write_zip(target, members, compress_type, compresslevel, date_time=None,
+              reuse=None, workers=None):
+    """Write members to target (path or file object)
+
+    reuse is (ZipFile, names), members in names are copied from the ZipFile
+    as is (already compressed). small files are compressed in parallel by
+    a pool of workers threads (zlib/bz2/lzma release the GIL) and written
+    in order, big files are streamed
+    """
+    src_zip, reuse_names = reuse or (None, set())
+    workers = workers or default_pack_workers
+    with zipfile.ZipFile(target, 'w') as z, \
+            ThreadPoolExecutor(max_workers=workers) as pool:
+        if workers > 1:
+            packed = pack_ahead(members, pool, workers * 4, reuse_names,
+                                compress_type, compresslevel, date_time)
+        else:
+            packed = ((member, None) for member in members)
+
+        for (name, data, src_path), future in packed:
+            if name in reuse_names:
+                copy_member(src_zip, z, name)
+                continue
+            if future is not None and future.result() is not None:
+                info, data = future.result()
+                write_raw(z, info, [data])
+                continue
+            info = zip_info(name, compress_type, compresslevel, date_time,
+                            src_path)
+            if src_path is None:
+                z.writestr(info, data)
+                continue
+            with open(src_path, 'rb') as src, z.open(info, 'w') as dest:
+                copyfileobj(src, dest, chunk_size)
+
+
+def build_zip(zip_path, config, code, files=[], ext='.py', handler='handler',
+              compression=None, compresslevel=None, deterministic=False,
+              workers=None):
+    """Write function archive (code, function.yaml and files)
+
+    zip_path can be a file path or a writable (unseekable) file object.
+    files are streamed into the archive in chunks, compression is
+    store/deflate/bzip2/lzma (see parse_compression). with deterministic=True
+    files are sorted and have fixed timestamps so identical inputs produce
+    identical archives. files can be directories or glob patterns, workers
+    is the number of compression threads (1 for serial)
+    """
+    compress_type, compresslevel = parse_compression(
+        compression, compresslevel)
+    date_time = fixed_date_time if deterministic else None
+    members = archive_members(config, code, files, ext, handler,
+                              deterministic)
+    write_zip(zip_path, members, compress_type, compresslevel, date_time,
+              workers=workers)
+
+
+def upload_zip(url, config, code, files=[], ext='.py', handler='handler',
+               compression=None, compresslevel=None, deterministic=False,
+               manifest=True, workers=None):
+    """Build function archive and write/upload it to url
+
+    remote archives smaller than an upload part are streamed to the repo
+    (no temp file), larger ones are built into a local spool file and
+    uploaded in parts (see upload_archive).
+    with manifest=True a manifest (member hashes) is stored next to the
+    archive (<url>.manifest.json), the upload is skipped when the manifest
+    did not change and unchanged members of a local archive are copied
+    from the previous one without recompression.
+    returns False if the upload was skipped
+    """
+    compress_type, compresslevel = parse_compression(
+        compression, compresslevel)
+    date_time = fixed_date_time if deterministic else None
+    members = archive_members(config, code, files, ext, handler,
+                              deterministic)
+
+    new_manifest = old_manifest = None
+    if manifest:
+        new_manifest = archive_manifest(members, compress_type,
+                                        compresslevel, workers)
+        old_manifest = read_manifest(url + manifest_suffix)
+
+    repo = url2repo(url)
+    is_file = isinstance(repo, FileRepo)
+    exists = path.isfile(repo.path) if is_file else True
+    if old_manifest and old_manifest == new_manifest and exists:
+        logger.info('archive %s did not change, skipping upload', url)
+        return False
+
+    if is_file:
+        repo.makedirs()
+        write_local_zip(repo.path, members, compress_type, compresslevel,
+                        date_time, old_manifest, new_manifest, workers)
+    else:
+        if old_manifest:
+            # a failed upload must not leave a valid manifest behind
+            url2repo(url + manifest_suffix).put('{}')
+        if members_size(members) < get_part_size():
+            stream_zip(repo, members, compress_type, compresslevel,
+                       date_time, workers)
+        else:
+            upload_archive(repo, url, members, compress_type,
+                           compresslevel, date_time, new_manifest, workers)
+
+    # only written after the upload succeeded (and its size was checked)
+    if new_manifest:
+        url2repo(url + manifest_suffix).put(json.dumps(new_manifest))
+    return True
+
+
+def members_size(members):
+    """Uncompressed size of archive members (upper bound of the zip data)"""
+    return sum(len(data) if src_path is None else path.getsize(src_path)
+               for _, data, src_path in members)
+
+
+def write_local_zip(zip_path, members, compress_type, compresslevel,
+                    date_time=None, old_manifest=None, new_manifest=None,
+                    workers=None):
+    """Write zip (atomic), reuse unchanged members of an existing zip"""
+    reuse_names = set()
+    if old_manifest and new_manifest and path.isfile(zip_path) and \
+            old_manifest['compression'] == new_manifest['compression']:
+        old_hashes = dict(old_manifest['members'])
+        reuse_names = {name for name, digest in new_manifest['members']
+                       if old_hashes.get(name) == digest}
+
+    dir_path = path.dirname(path.abspath(zip_path))
+    fd, tmp_path = mkstemp(dir=dir_path, prefix='.tmp-', suffix='.zip')
+    os.close(fd)
+    try:
+        if reuse_names:
+            with zipfile.ZipFile(zip_path) as src_zip:
+                reuse_names &= set(src_zip.namelist())
+                write_zip(tmp_path, members, compress_type, compresslevel,
+                          date_time, (src_zip, reuse_names), workers)
+            logger.debug('reused %d unchanged members of %s',
+                         len(reuse_names), zip_path)
+        else:
+            write_zip(tmp_path, members, compress_type, compresslevel,
+                      date_time, workers=workers)
+        os.replace(tmp_path, zip_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def upload_archive(repo, url, members, compress_type, compresslevel,
+                   date_time=None, manifest=None, workers=None):
+    """Build zip into a spool file and upload it with repo.upload
+
+    the spool file of a failed upload is kept (see archive_spool) when the
+    archive has a manifest, so uploading the same archive again resumes the
+    (multipart) upload of the same file. only the newest spool file of a
+    target url is kept
+    """
+    key = None
+    if manifest:
+        url_key = sha256(url.encode('utf-8')).hexdigest()
+        key = '{}-{}'.format(url_key, sha256(json.dumps(
+            manifest, sort_keys=True).encode('utf-8')).hexdigest())
+    spool_path = archive_spool.path(key) if key else None
+    # not get_path, it updates mtime which is part of the resume state key
+    if spool_path and path.isfile(spool_path):
+        logger.info('using archive of a previous upload to %s', url)
+    else:
+        os.makedirs(archive_spool.root, exist_ok=True)
+        fd, tmp_path = mkstemp(dir=archive_spool.root, prefix='.tmp-',
+                               suffix='.zip')
+        os.close(fd)
+        try:
+            write_zip(tmp_path, members, compress_type, compresslevel,
+                      date_time, workers=workers)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        if key:
+            for entry in os.scandir(archive_spool.root):
+                if entry.name.startswith(url_key + '-'):
+                    archive_spool.remove(entry.name)
+            os.replace(tmp_path, spool_path)
+            archive_spool.evict(keep=key)
+        else:
+            spool_path = tmp_path
+
+    try:
+        repo.upload(spool_path)
+        check_upload(repo, path.getsize(spool_path))
+    except BaseException:
+        if not key:
+            os.remove(spool_path)
+        raise
+    os.remove(spool_path)
+
+
+def stream_zip(repo, members, compress_type, compresslevel, date_time=None,
+               workers=None):
+    """Write zip into a pipe, uploaded with repo.upload_stream"""
+    rfd, wfd = os.pipe()
+    reader, writer = os.fdopen(rfd, 'rb'), os.fdopen(wfd, 'wb')
+    errors = []
+
+    def write():
+        try:
+            write_zip(writer, members, compress_type, compresslevel,
+                      date_time, workers=workers)
+        except Exception as err:
+            errors.append(err)
+        finally:
+            try:
+                writer.close()
+            except OSError:
+                pass  # reader closed on upload error
+
+    counter = CountingReader(reader)
+    thread = Thread(target=write, daemon=True)
+    thread.start()
+    try:
+        repo.upload_stream(counter)
+    finally:
+        # unblocks the writer if the upload failed before reading it all
+        reader.close()
+        thread.join()
+    if errors:
+        raise errors[0]
+    check_upload(repo, counter.count)
+
+
+class CountingReader(io.RawIOBase):
+    """Read-only file wrapper counting the bytes read"""
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.count = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        size = self.fp.readinto(buf)
+        self.count += size or 0
+        return size
+
+
+def check_upload(repo, size):
+    """Raise OSError if the uploaded object size isn't size"""
+    try:
+        uploaded = repo.object_size()
+    except ValueError:  # repo can't tell
+        return
+    if uploaded != size:
+        raise OSError('incomplete {} upload ({} of {} bytes)'.format(
+            repo.kind, uploaded, size))
 
 
 def load_zip_config(zip_path):
@@ -44,16 +561,145 @@ def load_zip_config(zip_path):
 
 
 def get_from_zip(zip_path, files=[]):
-    files_data = {}
-    with zipfile.ZipFile(zip_path) as myzip:
-        for f in files:
-            with io.TextIOWrapper(myzip.open(f)) as zipped:
-                files_data[f] = zipped.read()
-    return files_data
-
-
-def upload_file(file_path, url, del_file=False):
-    url2repo(url).upload(file_path)
+    """Return {name: text} of archive members, zip_path can be a URL"""
+    with ArchiveReader(zip_path) as reader:
+        return {f: reader.read_text(f) for f in files}
+
+
+class RangedFile(io.RawIOBase):
+    """Read-only, seekable file over read_range(offset, size) calls
+
+    e.g. RangedFile(repo.read_range, repo.object_size())
+    """
+
+    def __init__(self, read_range, size):
+        self.read_range = read_range
+        self.size = size
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError('negative seek position {}'.format(offset))
+        self.pos = offset
+        return self.pos
+
+    def readinto(self, buf):
+        size = min(len(buf), self.size - self.pos)
+        if size <= 0:
+            return 0
+        data = self.read_range(self.pos, size)
+        buf[:len(data)] = data
+        self.pos += len(data)
+        return len(data)
+
+
+class ArchiveReader:
+    """Lazy, random access reader of function archives (zip)
+
+    source is a local path (memory mapped) or a repo URL, remote archives
+    are read with ranged reads of the zip directory and the selected
+    members only (not downloaded), e.g.
+
+        with ArchiveReader('s3://bucket/proj/func.zip') as reader:
+            config = reader.config()
+    """
+
+    # remote read-ahead, small members are usually read in one request
+    buffer_size = 256 * 1024
+
+    def __init__(self, source):
+        self.source = source
+        self._file = self._mmap = None
+        if '://' not in source:
+            self._file = fp = open(source, 'rb')
+            try:
+                self._mmap = mmap.mmap(
+                    self._file.fileno(), 0, access=mmap.ACCESS_READ)
+                mapped = self._mmap
+                fp = RangedFile(
+                    lambda offset, size: mapped[offset:offset + size],
+                    len(mapped))
+            except ValueError:  # empty file can't be mapped
+                pass
+        else:
+            repo = url2repo(source)
+            fp = io.BufferedReader(
+                RangedFile(repo.read_range, repo.object_size()),
+                self.buffer_size)
+            self._file = fp
+        try:
+            self.zip = zipfile.ZipFile(fp)
+        except BaseException:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        if getattr(self, 'zip', None) is not None:
+            self.zip.close()
+        if self._mmap is not None:
+            self._mmap.close()
+        if self._file is not None:
+            self._file.close()
+        self.zip = self._mmap = self._file = None
+
+    def namelist(self):
+        return self.zip.namelist()
+
+    def infolist(self):
+        return self.zip.infolist()
+
+    def open(self, name):
+        """Return binary file object of member (read on demand)"""
+        return self.zip.open(name)
+
+    def read(self, name):
+        return self.zip.read(name)
+
+    def read_text(self, name, encoding='utf-8'):
+        return self.read(name).decode(encoding)
+
+    def config(self):
+        """Return function config (function.yaml) as dict"""
+        return yaml_load(self.read('function.yaml'))
+
+
+# S3 parts must be at least 5MB (except the last)
+min_part_size = 5 * 1024 ** 2
+default_part_size = 64 * 1024 ** 2
+default_upload_workers = 4
+# state of interrupted multipart uploads, for resume
+upload_state = FileCache('uploads', max_age=7 * 24 * 3600)
+# archives built for upload, kept after a failed upload for resume
+archive_spool = FileCache('archives', max_size=2 * 1024 ** 3,
+                          max_age=7 * 24 * 3600)
+# remote sources (notebooks, code, yaml), validated with ETag/Last-Modified
+source_cache = FileCache('sources', max_size=int(
+    environ.get(env_keys.source_cache_size) or 512 * 1024 ** 2),
+    max_age=7 * 24 * 3600)
+
+
+def upload_file(file_path, url, del_file=False, **kw):
+    """Upload file to url, kw (part_size, workers) used by S3/v3io"""
+    url2repo(url).upload(file_path, **kw)
     if del_file:
         remove(file_path)
 
@@ -114,24 +760,160 @@ def is_archive(url):
     return val
 
 
+# scheme -> repo factory (called with the parsed URL), see register_repo
+repo_types = {}
+repo_entry_point = 'nuclio.repos'
+_plugins_loaded = False
+
+
+def load_repo_plugins():
+    """Register repos from installed packages "nuclio.repos" entry points
+
+    entry point name is the URL scheme, value is the repo class (or factory)
+    e.g. in setup.py entry_points={'nuclio.repos': ['gs = mypkg:GSRepo']}
+    """
+    global _plugins_loaded
+    if _plugins_loaded:
+        return
+    _plugins_loaded = True
+
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:  # python < 3.8
+        return
+
+    eps = entry_points()
+    if hasattr(eps, 'select'):
+        eps = eps.select(group=repo_entry_point)
+    else:
+        eps = eps.get(repo_entry_point, [])
+    for ep in eps:
+        try:
+            repo_types[ep.name.lower()] = ep.load()
+        except Exception as err:
+            logger.warning('failed to load repo plugin %s, %s', ep.name, err)
+
+
+def register_repo(scheme, factory):
+    """Register repo factory (e.g. ExternalRepo subclass) for URL scheme"""
+    load_repo_plugins()
+    repo_types[scheme.lower()] = factory
+
+
 def url2repo(url=''):
     if '://' not in url:
         return FileRepo(url)
+    load_repo_plugins()
     p = urlparse(url)
     scheme = p.scheme.lower()
-    if scheme == 's3':
-        return S3Repo(p)
-    elif scheme == 'git':
-        return GitRepo(p)
-    elif scheme == 'http' or scheme == 'https':
-        return HttpRepo(p)
-    elif scheme == 'v3io' or scheme == 'v3ios':
-        return V3ioRepo(p)
-    else:
+    factory = repo_types.get(scheme)
+    if factory is None:
         raise ValueError('unsupported repo scheme ({})'.format(scheme))
+    return factory(p)
+
+
+def get_part_size(part_size=None):
+    part_size = part_size or int(
+        environ.get(env_keys.upload_part_size, default_part_size))
+    return max(part_size, min_part_size)
+
+
+class UploadNotFound(Exception):
+    """The (resumed) multipart upload no longer exists"""
+
+
+def upload_parts(src_path, target, begin, upload_part, finish,
+                 part_size=None, workers=None):
+    """Upload file in parts using a thread pool, resume interrupted uploads
+
+    begin() starts an upload and returns its id, upload_part(upload_id, num,
+    offset, data) uploads one part (numbered from 1) and returns its etag,
+    finish(upload_id, parts) gets a sorted list of (num, etag).
+    completed parts are saved (see upload_state) so an upload of the same
+    file to the same target resumes from the parts not uploaded yet, if
+    upload_part/finish raise UploadNotFound the upload is started over
+    """
+    part_size = get_part_size(part_size)
+    workers = workers or int(
+        environ.get(env_keys.upload_workers, default_upload_workers))
+
+    stat = os.stat(src_path)
+    key = sha256('{}|{}|{}|{}|{}'.format(
+        target, path.abspath(src_path), stat.st_size, stat.st_mtime,
+        part_size).encode('utf-8')).hexdigest()
+    state = upload_state.get_json(key)
+    if state:
+        logger.info('resuming upload to %s (%d parts done)',
+                    target, len(state['parts']))
+        try:
+            return send_parts(src_path, target, state, key, stat.st_size,
+                              upload_part, finish, part_size, workers)
+        except UploadNotFound:
+            logger.info('upload to %s expired, starting over', target)
+            upload_state.remove(key)
+
+    state = {'upload_id': begin(), 'parts': {}}
+    upload_state.put_json(key, state)
+    send_parts(src_path, target, state, key, stat.st_size, upload_part,
+               finish, part_size, workers)
+
+
+def send_parts(src_path, target, state, key, size, upload_part, finish,
+               part_size, workers):
+    """Upload the parts not in state (saved as they complete), finish"""
+    offsets = range(0, size or 1, part_size)
+    todo = [(num, offset) for num, offset in enumerate(offsets, 1)
+            if str(num) not in state['parts']]
+    lock = Lock()
+    start = monotonic()
+
+    def upload(num, offset):
+        with open(src_path, 'rb') as fp:
+            fp.seek(offset)
+            data = fp.read(part_size)
+        etag = upload_part(state['upload_id'], num, offset, data)
+        with lock:
+            state['parts'][str(num)] = etag
+            upload_state.put_json(key, state)
+        return len(data)
+
+    # upload all the parts we can even if some fail, so resume sends less
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(upload, *part) for part in todo]
+    errors = [f.exception() for f in futures if f.exception()]
+    if errors:
+        expired = [e for e in errors if isinstance(e, UploadNotFound)]
+        raise (expired or errors)[0]
+    sent = sum(f.result() for f in futures)
+
+    parts = sorted((int(num), etag) for num, etag in state['parts'].items())
+    finish(state['upload_id'], parts)
+    upload_state.remove(key)
+
+    duration = monotonic() - start
+    logger.info('uploaded %s to %s, %.1fMB in %.1fs (%.1fMB/s)', src_path,
+                target, sent / 1024 ** 2, duration,
+                sent / 1024 ** 2 / max(duration, 1e-6))
+
+
+def file_chunks(file_path, offset=0, size=chunk_size):
+    with open(file_path, 'rb') as fp:
+        fp.seek(offset)
+        yield from iter_chunks(fp, size)
+
+
+def range_size(content_range):
+    # bytes 100-199/1000
+    if not content_range or '/' not in content_range:
+        return None
+    size = content_range.rsplit('/', 1)[1]
+    return int(size) if size.isdigit() else None
 
 
 class ExternalRepo:
+    # repos with a cache_url are cached in source_cache
+    cache_url = None
+
     def __init__(self, urlobj: ParseResult):
         self.urlobj = urlobj
         self.kind = ''
@@ -142,15 +924,96 @@ class ExternalRepo:
     def put(self, data):
         pass
 
-    def download(self, target_path):
-        text = self.get()
-        with open(target_path, 'w') as fp:
-            fp.write(text)
-            fp.close()
+    def stream(self, offset=0):
+        """Return (start, size, chunks) for reading the object from offset
+
+        start is the offset the chunks (bytes iterator) start at (0 if the
+        repo ignored the offset), size is the object size (None if unknown)
+        """
+        raise ValueError('unimplemented')
+
+    def download(self, target_path, resume=False, progress=None):
+        """Download the object to target_path in chunks (binary)
+
+        with resume=True an existing (partial) target_path is continued
+        using a ranged read. progress(done, size) is called after every
+        chunk, size is None if unknown
+        """
+        if not resume and self.is_cached():
+            copyfile(self.cached_path(), target_path)
+            if progress:
+                size = path.getsize(target_path)
+                progress(size, size)
+            return
+
+        offset = 0
+        if resume and path.isfile(target_path):
+            offset = path.getsize(target_path)
+
+        start_time = monotonic()
+        start, size, chunks = self.stream(offset)
+        done = start
+        with open(target_path, 'ab' if start else 'wb') as fp:
+            if start:
+                fp.truncate(start)
+            for chunk in chunks:
+                fp.write(chunk)
+                done += len(chunk)
+                if progress:
+                    progress(done, size)
+
+        logger.debug('downloaded %s, %.1fMB in %.1fs', target_path,
+                     (done - start) / 1024 ** 2, monotonic() - start_time)
+
+    def fetch(self, validators):
+        """Conditional read, validators are from a previous fetch
+
+        return None if the object did not change, or (validators, chunks)
+        where validators is a dict (etag and/or last_modified)
+        """
+        raise ValueError('unimplemented')
 
-    def upload(self, src_path):
+    def is_cached(self):
+        return bool(self.cache_url and source_cache.max_size)
+
+    def cached_path(self):
+        """Return path of object in source cache, fetch only if changed"""
+        key = sha256(self.cache_url.encode('utf-8')).hexdigest()
+        meta_key = key + '.meta'
+        validators = source_cache.get_json(meta_key) or {}
+        data_path = source_cache.get_path(key) if validators else None
+        result = self.fetch(validators if data_path else {})
+        if result is None:
+            return data_path
+
+        validators, chunks = result
+        data_path = source_cache.put_chunks(key, chunks)
+        if validators:
+            source_cache.put_json(meta_key, validators)
+        else:
+            source_cache.remove(meta_key)
+        return data_path
+
+    def read_cached(self):
+        """Return object bytes via source cache, None if not cached"""
+        if not self.is_cached():
+            return None
+        with open(self.cached_path(), 'rb') as fp:
+            return fp.read()
+
+    def object_size(self):
+        raise ValueError('unimplemented')
+
+    def read_range(self, offset, size):
+        """Return size bytes of the object starting at offset"""
+        raise ValueError('unimplemented')
+
+    def upload(self, src_path, **kw):
         pass
 
+    def upload_stream(self, fp):
+        raise ValueError('unimplemented')
+
     def archive_cfg(self):
         # return (path, headers {}, workdir)
         raise Exception('unimplemented (nuclio cant load zip from this repo)')
@@ -160,22 +1023,121 @@ class FileRepo(ExternalRepo):
     def __init__(self, path=''):
         self.path = path
         self.kind = 'file'
+        self.url = None
+        self.workdir = None
+
+    @classmethod
+    def from_url(cls, urlobj: ParseResult):
+        """file:///path/to/file[#workdir]"""
+        repo = cls(urlobj.path)
+        repo.url = 'file://' + urlobj.path
+        repo.workdir = urlobj.fragment or None
+        return repo
+
+    def makedirs(self):
+        dir_path = path.dirname(self.path)
+        if dir_path:
+            os.makedirs(dir_path, exist_ok=True)
 
     def get(self):
         with open(self.path, 'r') as fp:
             return fp.read()
 
     def put(self, data):
+        self.makedirs()
         with open(self.path, 'w') as fp:
             fp.write(data)
             fp.close()
 
-    def download(self, target_path):
-        copyfile(self.path, target_path)
+    def stream(self, offset=0):
+        size = path.getsize(self.path)
+        return min(offset, size), size, file_chunks(self.path, offset)
+
+    def object_size(self):
+        return path.getsize(self.path)
 
-    def upload(self, src_path):
+    def read_range(self, offset, size):
+        with open(self.path, 'rb') as fp:
+            fp.seek(offset)
+            return fp.read(size)
+
+    def upload(self, src_path, **kw):
+        self.makedirs()
         copyfile(src_path, self.path)
 
+    def upload_stream(self, fp):
+        self.makedirs()
+        with open(self.path, 'wb') as out:
+            copyfileobj(fp, out, chunk_size)
+
+    def archive_cfg(self):
+        if not self.url:
+            return super().archive_cfg()
+        return self.url, None, self.workdir
+
+
+class MemoryRepo(ExternalRepo):
+    """In-memory object store (memory://bucket/key), for tests/benchmarks
+
+    objects are kept in the (process wide) MemoryRepo.objects dict
+    """
+    objects = {}
+
+    def __init__(self, urlobj: ParseResult):
+        self.kind = 'memory'
+        self.key = urlobj.netloc + urlobj.path
+        self.url = 'memory://' + self.key
+        self.workdir = urlobj.fragment or None
+
+    def data(self):
+        try:
+            return self.objects[self.key]
+        except KeyError:
+            raise OSError('{} not found'.format(self.url))
+
+    def get(self):
+        return self.data().decode('utf-8')
+
+    def put(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.objects[self.key] = bytes(data)
+
+    def stream(self, offset=0):
+        data = self.data()
+        offset = min(offset, len(data))
+        chunks = (data[i:i + chunk_size]
+                  for i in range(offset, len(data), chunk_size))
+        return offset, len(data), chunks
+
+    def object_size(self):
+        return len(self.data())
+
+    def read_range(self, offset, size):
+        return self.data()[offset:offset + size]
+
+    def upload(self, src_path, **kw):
+        with open(src_path, 'rb') as fp:
+            self.put(fp.read())
+
+    def upload_stream(self, fp):
+        self.put(b''.join(iter_chunks(fp)))
+
+    def archive_cfg(self):
+        return self.url, None, self.workdir
+
+
+@contextmanager
+def s3_upload_errors(upload_id):
+    """Raise UploadNotFound if the S3 multipart upload doesn't exist"""
+    try:
+        yield
+    except s3_errors() as err:
+        error = getattr(err, 'response', {}).get('Error', {})
+        if error.get('Code') in ('NoSuchUpload', '404'):
+            raise UploadNotFound(upload_id) from err
+        raise
+
 
 class S3Repo(ExternalRepo):
     def __init__(self, urlobj: ParseResult):
@@ -183,6 +1145,7 @@ class S3Repo(ExternalRepo):
         self.bucket = urlobj.hostname
         self.key = urlobj.path[1:]
         region = None
+        import boto3
         if urlobj.username or urlobj.password:
             self.s3 = boto3.resource('s3', region_name=region,
                                      aws_access_key_id=urlobj.username,
@@ -190,13 +1153,94 @@ class S3Repo(ExternalRepo):
         else:
             self.s3 = boto3.resource('s3', region_name=region)
 
-    def upload(self, src_path):
-        self.s3.Object(self.bucket, self.key).put(Body=open(src_path, 'rb'))
+    def upload(self, src_path, part_size=None, workers=None):
+        client = self.s3.meta.client
+        target = 's3://{}/{}'.format(self.bucket, self.key)
+        if path.getsize(src_path) <= get_part_size(part_size):
+            with open(src_path, 'rb') as fp:
+                client.put_object(Bucket=self.bucket, Key=self.key, Body=fp)
+            return
+
+        def begin():
+            resp = client.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key)
+            return resp['UploadId']
+
+        def upload_part(upload_id, num, offset, data):
+            with s3_upload_errors(upload_id):
+                resp = client.upload_part(
+                    Bucket=self.bucket, Key=self.key, UploadId=upload_id,
+                    PartNumber=num, Body=data)
+            return resp['ETag']
+
+        def finish(upload_id, parts):
+            with s3_upload_errors(upload_id):
+                client.complete_multipart_upload(
+                    Bucket=self.bucket, Key=self.key, UploadId=upload_id,
+                    MultipartUpload={'Parts': [
+                        {'PartNumber': num, 'ETag': etag}
+                        for num, etag in parts]})
+
+        upload_parts(src_path, target, begin, upload_part, finish,
+                     part_size, workers)
+
+    def upload_stream(self, fp):
+        # multipart upload, fp doesn't need to be seekable
+        self.s3.Object(self.bucket, self.key).upload_fileobj(fp)
 
     def get(self):
+        data = self.read_cached()
+        if data is not None:
+            return data
         obj = self.s3.Object(self.bucket, self.key)
         return obj.get()['Body'].read()
 
+    @property
+    def cache_url(self):
+        return 's3://{}/{}'.format(self.bucket, self.key)
+
+    def fetch(self, validators):
+        obj = self.s3.Object(self.bucket, self.key)
+        kw = {}
+        if validators.get('etag'):
+            kw['IfNoneMatch'] = validators['etag']
+        try:
+            resp = obj.get(**kw)
+        except s3_errors() as err:
+            if err.response.get('Error', {}).get('Code') in \
+                    ('304', 'NotModified'):
+                return None
+            raise
+        validators = {'etag': resp['ETag']} if resp.get('ETag') else {}
+        return validators, resp['Body'].iter_chunks(chunk_size)
+
+    def object_size(self):
+        return self.s3.Object(self.bucket, self.key).content_length
+
+    def read_range(self, offset, size):
+        obj = self.s3.Object(self.bucket, self.key)
+        resp = obj.get(Range='bytes={}-{}'.format(offset, offset + size - 1))
+        return resp['Body'].read()
+
+    def stream(self, offset=0):
+        obj = self.s3.Object(self.bucket, self.key)
+        if offset:
+            try:
+                resp = obj.get(Range='bytes={}-'.format(offset))
+            except s3_errors() as err:
+                # offset is at (or past) the end, nothing left to read
+                if err.response.get('Error', {}).get('Code') != \
+                        'InvalidRange':
+                    raise
+                return offset, offset, iter([])
+            size = range_size(resp.get('ContentRange'))
+            if 'ContentRange' not in resp:
+                offset = 0
+        else:
+            resp = obj.get()
+            size = resp.get('ContentLength')
+        return offset, size, resp['Body'].iter_chunks(chunk_size)
+
     def put(self, data):
         self.s3.Object(self.bucket, self.key).put(Body=data)
 
@@ -214,7 +1258,7 @@ def basic_auth_header(user, password):
 
 def http_get(url, headers=None, auth=None):
     try:
-        resp = requests.get(url, headers=headers, auth=auth)
+        resp = get_client().get(url, headers=headers, auth=auth)
     except OSError:
         raise OSError('error: cannot connect to {}'.format(url))
 
@@ -223,9 +1267,98 @@ def http_get(url, headers=None, auth=None):
     return resp.text
 
 
-def http_put(url, data, headers=None, auth=None):
+def http_stream(url, headers=None, auth=None, offset=0):
+    """Streamed (ranged) GET, return (start, size, chunks)"""
+    headers = dict(headers or {})
+    if offset:
+        headers['Range'] = 'bytes={}-'.format(offset)
+    try:
+        resp = get_client().get(url, headers=headers, auth=auth, stream=True)
+    except OSError:
+        raise OSError('error: cannot connect to {}'.format(url))
+
+    if offset and resp.status_code == 416:
+        # range not satisfiable, already have all of it
+        resp.close()
+        return offset, range_size(resp.headers.get('Content-Range')), []
+    if not resp.ok:
+        resp.close()
+        raise OSError('failed to read file in {}'.format(url))
+
+    if resp.status_code == 206:
+        size = range_size(resp.headers.get('Content-Range'))
+    else:
+        offset = 0  # range ignored, full content
+        length = resp.headers.get('Content-Length')
+        size = int(length) if length else None
+
+    def chunks():
+        with resp:
+            yield from resp.iter_content(chunk_size)
+
+    return offset, size, chunks()
+
+
+def http_fetch(url, headers=None, auth=None, validators=None):
+    """Conditional streamed GET, see ExternalRepo.fetch"""
+    headers = dict(headers or {})
+    validators = validators or {}
+    if validators.get('etag'):
+        headers['If-None-Match'] = validators['etag']
+    if validators.get('last_modified'):
+        headers['If-Modified-Since'] = validators['last_modified']
+    try:
+        resp = get_client().get(url, headers=headers, auth=auth, stream=True)
+    except OSError:
+        raise OSError('error: cannot connect to {}'.format(url))
+
+    if resp.status_code == 304:
+        resp.close()
+        return None
+    if not resp.ok:
+        resp.close()
+        raise OSError('failed to read file in {}'.format(url))
+
+    validators = {}
+    if resp.headers.get('ETag'):
+        validators['etag'] = resp.headers['ETag']
+    if resp.headers.get('Last-Modified'):
+        validators['last_modified'] = resp.headers['Last-Modified']
+
+    def chunks():
+        with resp:
+            yield from resp.iter_content(chunk_size)
+
+    return validators, chunks()
+
+
+def http_size(url, headers=None, auth=None):
     try:
-        resp = requests.put(url, data=data, headers=headers, auth=auth)
+        resp = get_client().head(url, headers=headers, auth=auth)
+    except OSError:
+        raise OSError('error: cannot connect to {}'.format(url))
+    if not resp.ok or 'Content-Length' not in resp.headers:
+        raise OSError('failed to get size of {}'.format(url))
+    return int(resp.headers['Content-Length'])
+
+
+def http_read_range(url, headers=None, auth=None, offset=0, size=0):
+    headers = dict(headers or {})
+    headers['Range'] = 'bytes={}-{}'.format(offset, offset + size - 1)
+    try:
+        resp = get_client().get(url, headers=headers, auth=auth)
+    except OSError:
+        raise OSError('error: cannot connect to {}'.format(url))
+    if resp.status_code != 206:
+        raise OSError('failed ranged read of {} ({})'.format(
+            url, resp.status_code))
+    return resp.content
+
+
+def http_put(url, data, headers=None, auth=None, client=None):
+    try:
+        resp = (client or get_client()).put(url, data=data, headers=headers,
+                                            auth=auth)
     except OSError:
         raise OSError('error: cannot connect to {}'.format(url))
     if not resp.ok:
@@ -238,6 +1371,10 @@ def http_upload(url, file_path, headers=None, auth=None):
         http_put(url, data, headers, auth)
 
 
+def iter_chunks(fp, size=chunk_size):
+    return iter(lambda: fp.read(size), b'')
+
+
 class HttpRepo(ExternalRepo):
     def __init__(self, urlobj: ParseResult):
         self.kind = 'http'
@@ -256,15 +1393,34 @@ class HttpRepo(ExternalRepo):
         self.path = urlobj.path
         self.workdir = urlobj.fragment
 
-    def upload(self, src_path):
+    def upload(self, src_path, **kw):
         raise ValueError('unimplemented')
 
     def put(self, data):
         raise ValueError('unimplemented')
 
+    @property
+    def cache_url(self):
+        return self.url
+
     def get(self):
+        data = self.read_cached()
+        if data is not None:
+            return data.decode('utf-8')
         return http_get(self.url, None, self.auth)
 
+    def fetch(self, validators):
+        return http_fetch(self.url, None, self.auth, validators)
+
+    def object_size(self):
+        return http_size(self.url, None, self.auth)
+
+    def read_range(self, offset, size):
+        return http_read_range(self.url, None, self.auth, offset, size)
+
+    def stream(self, offset=0):
+        return http_stream(self.url, None, self.auth, offset)
+
     def archive_cfg(self):
         # return path, headers {}, workdir
         return self.url, self.nuclio_header, self.workdir
@@ -294,12 +1450,56 @@ class V3ioRepo(ExternalRepo):
         self.path = urlobj.path
         self.workdir = urlobj.fragment
 
-    def upload(self, src_path):
-        http_upload(self.url, src_path, self.headers, None)
+    def upload(self, src_path, part_size=None, workers=None):
+        if path.getsize(src_path) <= get_part_size(part_size):
+            http_upload(self.url, src_path, self.headers, None)
+            return
+
+        def begin():
+            # create (or truncate) the object, parts are written into it
+            http_put(self.url, b'', self.headers, None)
+            return ''
+
+        def upload_part(upload_id, num, offset, data):
+            headers = dict(self.headers or {})
+            headers['Range'] = 'bytes={}-{}'.format(
+                offset, offset + len(data) - 1)
+            http_put(self.url, data, headers, None)
+            return ''
+
+        def finish(upload_id, parts):
+            pass
+
+        upload_parts(src_path, self.url, begin, upload_part, finish,
+                     part_size, workers)
+
+    def upload_stream(self, fp):
+        # chunked transfer encoding, the body can't be re-sent on retry
+        http_put(self.url, iter_chunks(fp), self.headers, None,
+                 get_stream_client())
+
+    @property
+    def cache_url(self):
+        return self.url
 
     def get(self):
+        data = self.read_cached()
+        if data is not None:
+            return data.decode('utf-8')
         return http_get(self.url, self.headers, None)
 
+    def fetch(self, validators):
+        return http_fetch(self.url, self.headers, None, validators)
+
+    def object_size(self):
+        return http_size(self.url, self.headers, None)
+
+    def read_range(self, offset, size):
+        return http_read_range(self.url, self.headers, None, offset, size)
+
+    def stream(self, offset=0):
+        return http_stream(self.url, self.headers, None, offset)
+
     def put(self, data):
         http_put(self.url, data, self.headers, None)
 
@@ -331,7 +1531,7 @@ class GitRepo(ExternalRepo):
             if len(parts) > 1:
                 self.workdir = parts[1]
 
-    def upload(self, src_path):
+    def upload(self, src_path, **kw):
         raise ValueError('unimplemented, use git push instead')
 
     def get(self):
@@ -343,3 +1543,15 @@ class GitRepo(ExternalRepo):
     def archive_cfg(self):
         # return path, headers {}, workdir
         return self.path, self.headers, self.workdir
+
+
+repo_types.update({
+    's3': S3Repo,
+    'git': GitRepo,
+    'http': HttpRepo,
+    'https': HttpRepo,
+    'v3io': V3ioRepo,
+    'v3ios': V3ioRepo,
+    'file': FileRepo.from_url,
+    'memory': MemoryRepo,
+})
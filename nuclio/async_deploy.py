@@ -0,0 +1,262 @@
+# Copyright 2018 Iguazio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""asyncio client for the nuclio dashboard API (requires aiohttp)"""
+import asyncio
+from time import time, monotonic
+
+from .config import update_in, meta_keys
+from .deploy import (VERIFY_CERT, Backoff, config_hash, code_digest,
+                     find_dashboard_url, match_project, process_resp)
+from .utils import DeployError, logger
+
+
+def import_aiohttp():
+    try:
+        import aiohttp
+    except ImportError:
+        raise ImportError(
+            'AsyncDashboardClient requires aiohttp, pip install aiohttp')
+    return aiohttp
+
+
+def new_session(timeout, pool_size):
+    aiohttp = import_aiohttp()
+    connector = aiohttp.TCPConnector(limit=pool_size)
+    if not isinstance(timeout, aiohttp.ClientTimeout):
+        timeout = aiohttp.ClientTimeout(total=timeout)
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+
+class AsyncDashboardClient:
+    """asyncio nuclio dashboard client
+
+    async equivalents of deploy_config, get_deploy_status,
+    find_or_create_project, list_functions and delete_func. status waits use
+    asyncio.sleep so a single event loop can drive many deployments, e.g.
+
+        async with AsyncDashboardClient(url) as client:
+            addresses = await asyncio.gather(*[
+                client.deploy_config(cfg, project='p1') for cfg in configs])
+
+    timeout is the (total) timeout in seconds per API call, pool_size the max
+    number of open connections to the dashboard
+    """
+
+    def __init__(self, dashboard_url='', timeout=120, pool_size=100):
+        self.api_address = find_dashboard_url(dashboard_url)
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._session = None
+        self._ip = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def request(self, method, path, **kw):
+        """Call the dashboard API, return (ok, data)"""
+        if self._session is None:
+            self._session = new_session(self.timeout, self.pool_size)
+        url = '{}/{}'.format(self.api_address, path)
+        kw.setdefault('ssl', None if VERIFY_CERT else False)
+        try:
+            async with self._session.request(method, url, **kw) as resp:
+                text = await resp.text()
+                ok = resp.status < 400
+                if not ok or not text:
+                    return ok, text
+                return ok, await resp.json(content_type=None)
+        except (OSError, asyncio.TimeoutError,
+                import_aiohttp().ClientError) as err:
+            raise DeployError(
+                'error: cannot {} {} ({})'.format(method, url, err))
+
+    async def get_function(self, name):
+        return await self.request('GET', 'functions/{}'.format(name))
+
+    async def get_address(self):
+        if self._ip is None:
+            ok, data = await self.request('GET', 'external_ip_addresses')
+            if not ok:
+                logger.warning(
+                    'failed to obtain external IP address, returned local')
+                return 'localhost'
+            self._ip = data['externalIPAddresses']['addresses'][0]
+        return self._ip
+
+    async def find_or_create_project(self, project, create_new=False):
+        ok, data = await self.request('GET', 'projects')
+        if not ok:
+            raise DeployError('nuclio API call failed')
+
+        project = project.strip()
+        key = match_project(data, project)
+        if key is not None:
+            return key
+
+        if not create_new:
+            raise DeployError('project name {} not found'.format(project))
+
+        config = {'metadata': {'name': project}, 'spec': {}}
+        ok, data = await self.request('POST', 'projects', json=config)
+        if not ok:
+            raise DeployError('failed to create project {}'.format(project))
+
+        logger.info('project name not found created new (%s)', project)
+        return data['metadata']['name']
+
+    async def list_functions(self, namespace=''):
+        headers = {}
+        if namespace:
+            headers = {'x-nuclio-function-namespace': namespace}
+        ok, data = await self.request('GET', 'functions', headers=headers)
+        if not ok:
+            logger.warning('failed to list functions, %s', data)
+            return None
+        return data
+
+    async def delete_func(self, name, namespace=''):
+        body = {'metadata': {'name': name}}
+        if namespace:
+            body['metadata']['namespace'] = namespace
+        ok, data = await self.request('DELETE', 'functions', json=body)
+        if not ok:
+            logger.error('ERROR: %s', data)
+            raise DeployError('failed to delete {}'.format(name))
+
+    async def get_deploy_status(self, name, last_time=None, verbose=False):
+        """Return state, address, last_time and log outputs of function"""
+        last_time = last_time or (time() * 1000.0)
+        address = ''
+
+        ok, data = await self.get_function(name)
+        if not ok:
+            raise DeployError('error: cannot poll {} status'.format(name))
+
+        state, last_time, outputs = process_resp(data, last_time,
+                                                 verbose, log_message=False)
+        if state == 'ready':
+            address = '{}:{}'.format(await self.get_address(),
+                                     data['status'].get('httpPort', 0))
+
+        return state, address, last_time, outputs
+
+    async def deploy_progress(self, name, verbose=False, timeout=None):
+        """Wait for function deploy to end, return state and address"""
+        last_time = time() * 1000.0
+        backoff = Backoff()
+        deadline = monotonic() + timeout if timeout else None
+
+        while True:
+            ok, data = await self.get_function(name)
+            if not ok:
+                raise DeployError('error: cannot poll {} status'.format(name))
+
+            state, last_time, _ = process_resp(data, last_time,
+                                               verbose, log_message=True)
+            if state in {'ready', 'error'}:
+                address = ''
+                if state == 'ready':
+                    address = '{}:{}'.format(
+                        await self.get_address(),
+                        data['status'].get('httpPort', 0))
+                return state, address
+
+            delay = backoff.next_delay()
+            if deadline:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    raise DeployError(
+                        'timeout waiting for {} to deploy ({})'.format(
+                            name, state))
+                delay = min(delay, remaining)
+            await asyncio.sleep(delay)
+
+    async def deploy_config(self, config, name='', project='', verbose=False,
+                            create_new=False, watch=True, if_changed=False,
+                            timeout=None):
+        """Deploy function config to nuclio, see deploy.deploy_config"""
+        log = logger.info if verbose else logger.debug
+        name = name or config['metadata']['name']
+
+        if not project:
+            raise DeployError('project name must be specified')
+
+        project = await self.find_or_create_project(project, create_new)
+        ok, current = await self.get_function(name)
+
+        verb = 'updating' if ok else 'creating'
+        log('%s %s', verb, name)
+        if ok:
+            func_project = current['metadata']['labels'].get(
+                meta_keys.project, '')
+            if func_project != project:
+                raise DeployError(
+                    'error: function name already exists under a '
+                    + 'different project ({})'.format(func_project))
+
+        update_in(config, ['metadata', 'labels', meta_keys.project], project)
+        # code_digest may read the archive manifest (blocking I/O)
+        code = ''
+        if if_changed:
+            loop = asyncio.get_running_loop()
+            code = await loop.run_in_executor(None, code_digest, config)
+        digest = config_hash(config, code)
+        update_in(config, ['metadata', 'annotations', meta_keys.spec_hash],
+                  digest)
+
+        if if_changed and code is None:
+            log('cannot hash %s code, deploying', name)
+        elif if_changed and ok:
+            annotations = current['metadata'].get('annotations') or {}
+            state = current.get('status', {}).get('state')
+            if annotations.get(meta_keys.spec_hash) == digest \
+                    and state == 'ready':
+                address = '{}:{}'.format(
+                    await self.get_address(),
+                    current['status'].get('httpPort', 0))
+                logger.info('function %s did not change, skipping deploy, '
+                            'function address: %s', name, address)
+                return address
+
+        headers = {'x-nuclio-project-name': project}
+        if ok:
+            resp_ok, data = await self.request(
+                'PUT', 'functions/{}'.format(name), json=config,
+                headers=headers)
+        else:
+            resp_ok, data = await self.request(
+                'POST', 'functions', json=config, headers=headers)
+
+        if not resp_ok:
+            log('ERROR: %s', data)
+            raise DeployError('failed {} {}'.format(verb, name))
+
+        log('deploying ...')
+        if not watch:
+            return None
+
+        state, address = await self.deploy_progress(name, verbose, timeout)
+        if state != 'ready':
+            raise DeployError('cannot deploy {} ({})'.format(name, state))
+
+        logger.info('done %s %s, function address: %s', verb, name, address)
+        return address
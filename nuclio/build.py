@@ -12,39 +12,148 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
 import os
+import re
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from os import path, environ
 from tempfile import mktemp
+from time import monotonic
 from sys import executable, stderr
 from subprocess import run, PIPE
 from base64 import b64encode, b64decode
-
-import yaml
-from IPython import get_ipython
+from hashlib import sha256
 
 from .utils import (env_keys, notebook_file_name, logger, normalize_name,
-                    BuildError)
-from .archive import (build_zip, get_archive_config, url2repo, upload_file,
-                      put_data)
+                    BuildError, LazyYaml, yaml_dump, yaml_load)
+from .archive import get_archive_config, url2repo, upload_zip, put_data
 from .config import (update_in, new_config, ConfigSpec, load_config,
                      meta_keys, extend_config, set_handler)
+from .cache import FileCache
+from .nbreader import read_notebook
+
+build_cache = FileCache('build', max_size=int(
+    environ.get(env_keys.build_cache_size, 256 * 1024 ** 2)))
+env_file_magic = re.compile(r'^\s*%nuclio\s+env_file\s+(.*)$', re.M).finditer
+env_var_ref = re.compile(r'\$\{?(\w+)').findall
 
 
 def build_file(filename='', name='', handler='', archive=False, project='',
                tag="", spec: ConfigSpec = None, files=[], output_dir='',
-               verbose=False, kind=None):
+               verbose=False, kind=None, cache=True):
 
     dont_embed = (len(files) > 0) or output_dir != '' or archive
 
     if not filename:
+        from IPython import get_ipython
         kernel = get_ipython()
         if kernel:
             filename = notebook_file_name(kernel)
         else:
             raise ValueError('please specify file name/path/url')
 
+    key = ''
+    if cache:
+        key = build_cache_key(filename, name, handler, tag, spec, kind,
+                              dont_embed)
+
+    entry = build_cache.get_json(key) if key else None
+    if entry is None:
+        entry = convert_file(filename, name, handler, tag, spec, kind,
+                             dont_embed)
+        if key:
+            try:
+                build_cache.put_json(key, entry)
+            except (TypeError, ValueError, OSError) as err:
+                logger.warning('failed to cache build of %s, %s',
+                               filename, err)
+
+    name, config, code = entry['name'], entry['config'], entry['code']
+    ext, is_source = entry['ext'], entry['is_source']
+    if entry['files']:
+        files = files + entry['files']
+
+    log = logger.info if verbose else logger.debug
+    log('Code:\n%s', code)
+    log('Config:\n%s', LazyYaml(config))
+    config = save_function(filename, name, config, code, ext, is_source,
+                           files, archive, project, tag, output_dir, log)
+    return name, config, code
+
+
+def save_function(filename, name, config, code, ext, is_source, files=[],
+                  archive=False, project='', tag='', output_dir='',
+                  log=logger.debug):
+    """Write function archive or output dir files, return the config"""
+    filebase, _ = path.splitext(path.basename(filename))
+    if archive or files:
+        output, url_target = archive_path(output_dir, project, name, tag)
+        log('Build/upload archive in: {}'.format(output))
+        if url_target:
+            upload_zip(output, config, code, files, ext, filebase)
+            config = get_archive_config(name, output)
+            config = extend_config(config, None, tag, filename)
+            log('Archive Config:\n%s', LazyYaml(config))
+        else:
+            zip_path = path.abspath(output)
+            upload_zip(zip_path, config, code, files, ext, filebase)
+
+    elif output_dir:
+        if '://' not in output_dir:
+            output_dir = path.abspath(output_dir)
+            os.makedirs(output_dir, exist_ok=True)
+
+        config['metadata'].pop("name", None)
+        put_data('{}/function.yaml'.format(output_dir), yaml_dump(config))
+        update_in(config, 'metadata.name', name)
+
+        # make sure we dont overwrite the source code
+        output_path = '{}/{}{}'.format(output_dir, filebase, ext)
+        if not is_source or (output_path != path.abspath(filename)):
+            put_data(output_path, code)
+
+    return config
+
+
+def build_functions(filename, handler='', archive=False, project='', tag='',
+                    spec: ConfigSpec = None, files=[], output_dir='',
+                    verbose=False, kind=None):
+    """Build all the functions in an annotated notebook
+
+    The notebook is converted once (see NuclioExporter.export_functions),
+    every "start-code <name>" function and the nameless one (named after
+    the notebook) are built. Output is written to <output_dir>/<name>/ or
+    to the archive path. Returns a list of (name, config, code).
+    """
+    dont_embed = (len(files) > 0) or output_dir != '' or archive
+    log = logger.info if verbose else logger.debug
+    results = []
+    for entry in convert_functions(filename, handler, tag, spec, kind,
+                                   dont_embed):
+        name, config, code = entry['name'], entry['config'], entry['code']
+        log('Function %s code:\n%s', name, code)
+        log('Function %s config:\n%s', name, LazyYaml(config))
+        func_dir = output_dir
+        if output_dir and not archive:
+            func_dir = '{}/{}'.format(output_dir.rstrip('/'), name)
+        config = save_function(filename, name, config, code, entry['ext'],
+                               False, files + entry['files'], archive,
+                               project, tag, func_dir, log)
+        results.append((name, config, code))
+    return results
+
+
+def convert_file(filename, name='', handler='', tag='', spec=None, kind=None,
+                 dont_embed=False):
+    """Convert notebook/code/yaml to function config and code
+
+    returns a dict with the function name, config, code, lang ext, extra
+    files and if the code is the source file (is_source)
+    """
     filebase, ext = path.splitext(path.basename(filename))
     is_source = False
+    files = []
     if ext == '.ipynb':
         from_url = '://' in filename
         if from_url:
@@ -53,11 +162,8 @@ def build_file(filename='', name='', handler='', archive=False, project='',
             filename = tmpfile
 
         config, code = build_notebook(filename, dont_embed, tag, name)
-        nb_files = config['metadata']['annotations'].get(meta_keys.extra_files)
+        files = pop_extra_files(config)
         ext = '.py'
-        if nb_files:
-            files += nb_files.split(',')
-            config['metadata']['annotations'].pop(meta_keys.extra_files, None)
 
         if from_url:
             os.remove(tmpfile)
@@ -74,6 +180,44 @@ def build_file(filename='', name='', handler='', archive=False, project='',
     else:
         raise BuildError('illegal filename or extension: '+filename)
 
+    return function_entry(config, code, name or filebase, filebase, ext,
+                          filename, handler, tag, spec, kind, is_source,
+                          files)
+
+
+def convert_functions(filename, handler='', tag='', spec=None, kind=None,
+                      dont_embed=False):
+    """Convert all the functions in a notebook, return function entries
+
+    entries are the same as convert_file ones, the nameless function is
+    named after the notebook
+    """
+    filebase, ext = path.splitext(path.basename(filename))
+    if ext != '.ipynb':
+        raise BuildError('not a notebook: ' + filename)
+
+    nb_file = filename
+    if '://' in filename:
+        nb_file = mktemp('.ipynb')
+        url2repo(filename).download(nb_file)
+    try:
+        functions = build_notebook_functions(nb_file, dont_embed)
+    finally:
+        if nb_file != filename:
+            os.remove(nb_file)
+
+    entries = []
+    for name, (config, code) in functions.items():
+        files = pop_extra_files(config)
+        entries.append(function_entry(config, code, name or filebase,
+                                      filebase, '.py', filename, handler,
+                                      tag, spec, kind, False, files))
+    return entries
+
+
+def function_entry(config, code, name, filebase, ext, source, handler='',
+                   tag='', spec=None, kind=None, is_source=False, files=[]):
+    """Finalize converted function config/code, return entry dict"""
     if not code:
         code_buf = config['spec']['build'].get('functionSourceCode')
         code = b64decode(code_buf).decode('utf-8')
@@ -81,48 +225,190 @@ def build_file(filename='', name='', handler='', archive=False, project='',
     if kind:
         code = add_kind_footer(kind, config, code)
 
-    name = normalize_name(name or filebase)
+    name = normalize_name(name)
     update_in(config, 'metadata.name', name)
-    config = extend_config(config, spec, tag, filename)
+    config = extend_config(config, spec, tag, source)
     set_handler(config, filebase, '' if kind else handler, ext)
 
-    log = logger.info if verbose else logger.debug
-    log('Code:\n{}'.format(code))
-    log('Config:\n{}'.format(yaml.dump(config, default_flow_style=False)))
-
-    if archive or files:
-        output, url_target = archive_path(output_dir, project, name, tag)
-        if url_target:
-            zip_path = mktemp('.zip')
-        else:
-            zip_path = path.abspath(output)
-            os.makedirs(path.dirname(zip_path), exist_ok=True)
-
-        log('Build/upload archive in: {}'.format(output))
-        build_zip(zip_path, config, code, files, ext, filebase)
-        if url_target:
-            upload_file(zip_path, output, True)
-            config = get_archive_config(name, output)
-            config = extend_config(config, None, tag, filename)
-            config_text = yaml.dump(config, default_flow_style=False)
-            log('Archive Config:\n{}'.format(config_text))
-
-    elif output_dir:
-        if '://' not in output_dir:
-            output_dir = path.abspath(output_dir)
-            os.makedirs(output_dir, exist_ok=True)
-
-        config['metadata'].pop("name", None)
-        put_data('{}/function.yaml'.format(output_dir),
-                 yaml.dump(config, default_flow_style=False))
-        update_in(config, 'metadata.name', name)
-
-        # make sure we dont overwrite the source code
-        output_path = '{}/{}{}'.format(output_dir, filebase, ext)
-        if not is_source or (output_path != path.abspath(filename)):
-            put_data(output_path, code)
-
-    return name, config, code
+    return {'name': name, 'config': config, 'code': code, 'ext': ext,
+            'is_source': is_source, 'files': files}
+
+
+def pop_extra_files(config):
+    """Remove extra files annotation (set by %nuclio add), return files"""
+    nb_files = config['metadata']['annotations'].pop(meta_keys.extra_files,
+                                                     None)
+    return nb_files.split(',') if nb_files else []
+
+
+def build_cache_key(filename, *args):
+    """Return cache key for a local notebook build (or '' if not cachable)
+
+    the key covers the notebook code cells (including magics), env files
+    and environment variables they reference and the build arguments,
+    changes to markdown cells or outputs don't change it
+    """
+    if not filename.endswith('.ipynb') or '://' in filename:
+        return ''
+    try:
+        nb = read_notebook(filename)
+    except (OSError, ValueError):
+        return ''
+
+    sources = [cell.get('source', '') for cell in nb['cells']
+               if cell.get('cell_type') == 'code']
+
+    env_files = json.loads(environ.get(env_keys.env_files, '[]'))
+    for match in env_file_magic(''.join(sources)):
+        env_files += match.group(1).split()
+    for line in cell_magic_lines(sources, 'env_file'):
+        env_files.append(line)
+
+    env_names = set(env_var_ref(''.join(sources)))
+    env_names.update(name for name in environ
+                     if name.startswith(('NUCLIO_', 'V3IO_')))
+
+    from . import __version__
+
+    hasher = sha256()
+    for item in [__version__, path.abspath(filename), sources, args,
+                 sorted((name, environ.get(name)) for name in env_names)]:
+        hasher.update(json.dumps(item, default=vars).encode('utf-8'))
+
+    for env_file in env_files:
+        hasher.update(env_file.encode('utf-8'))
+        if path.isfile(env_file):
+            with open(env_file, 'rb') as fp:
+                hasher.update(fp.read())
+
+    handler_path = environ.get(env_keys.handler_path)
+    if handler_path and path.isfile(handler_path):
+        with open(handler_path, 'rb') as fp:
+            hasher.update(fp.read())
+
+    return hasher.hexdigest()
+
+
+def cell_magic_lines(sources, command):
+    """Yield argument lines of %%nuclio <command> cell magics"""
+    prefix = '%%nuclio {}'.format(command)
+    for source in sources:
+        if not source.lstrip().startswith(prefix):
+            continue
+        for line in source.splitlines()[1:]:
+            line = line.strip()
+            if line and line[0] != '#':
+                yield line
+
+
+BuildResult = namedtuple('BuildResult',
+                         'source name duration error cached')
+
+
+def build_many(sources, output_dir='', workers=None, archive=False,
+               all_functions=False, **kw):
+    """Build many notebooks/files in parallel, yield results as they finish
+
+    each function is written to <output_dir>/<name>/ (function.yaml and
+    handler code), or to the archive path when archive=True. kw are passed
+    to build_file (tag, project, spec, kind, ..). workers is the number of
+    build processes (default is the number of CPUs), use 1 to build in the
+    current process. all_functions builds every function in the notebooks
+    (see build_functions).
+
+    yields BuildResult(source, name, duration, error, cached) tuples, error
+    is None for successful builds, cached is True on build cache hits. with
+    all_functions name is a comma separated list of the functions. sources
+    with the same name (e.g. a/handler.ipynb and b/handler.ipynb) would
+    overwrite each other's output, they are not built and fail with an error
+    """
+    args = (output_dir, archive, kw, all_functions)
+    if not all_functions:
+        by_name = {}
+        for source in sources:
+            by_name.setdefault(source_name(source), []).append(source)
+        sources = []
+        for name, named in by_name.items():
+            if len(named) == 1:
+                sources.extend(named)
+                continue
+            for source in named:
+                error = 'BuildError: {} have the same name ({})'.format(
+                    ', '.join(named), name)
+                yield BuildResult(source, name, 0.0, error, False)
+    if workers == 1:
+        for source in sources:
+            yield build_one(source, *args)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(build_one, source, *args):
+                   source for source in sources}
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except Exception as err:  # worker died
+                yield BuildResult(futures[future], '', 0.0, str(err), False)
+
+
+def source_name(source):
+    """Function name of a source file (used for its output dir)"""
+    return normalize_name(path.splitext(path.basename(source))[0])
+
+
+def build_one(source, output_dir='', archive=False, kw=None,
+              all_functions=False):
+    """Build a single function for build_many, errors are returned"""
+    start = monotonic()
+    name = source_name(source)
+    if all_functions:
+        kw = dict(kw or {})
+        kw.pop('cache', None)
+        try:
+            results = build_functions(source, output_dir=output_dir,
+                                      archive=archive, **kw)
+        except Exception as err:
+            return BuildResult(source, name, monotonic() - start,
+                               '{}: {}'.format(type(err).__name__, err),
+                               False)
+        names = ','.join(result[0] for result in results)
+        return BuildResult(source, names, monotonic() - start, None, False)
+
+    func_dir = output_dir
+    if output_dir and not archive:
+        func_dir = '{}/{}'.format(output_dir.rstrip('/'), name)
+
+    hits = build_cache.hits
+    try:
+        name, _, _ = build_file(source, output_dir=func_dir, archive=archive,
+                                **(kw or {}))
+    except Exception as err:
+        return BuildResult(source, name, monotonic() - start,
+                           '{}: {}'.format(type(err).__name__, err), False)
+    return BuildResult(source, name, monotonic() - start, None,
+                       build_cache.hits > hits)
+
+
+def populate_parser(parser):
+    parser.add_argument('files', help='notebook/code files or urls',
+                        nargs='+')
+    parser.add_argument('--output-dir', '-o', default='.',
+                        help='output dir (one sub dir per function)')
+    parser.add_argument('--workers', '-j', type=int, default=None,
+                        help='number of build processes (default: #cpus)')
+    parser.add_argument('--project', '-p', default='', help='project name')
+    parser.add_argument('--archive', '-a', action='store_true', default=False,
+                        help='build archives (zip) under output dir')
+    parser.add_argument('--tag', '-t', default='', help='version tag')
+    parser.add_argument('--env', '-e', default=[], action='append',
+                        help='override environment variable (key=value)')
+    parser.add_argument('--kind', default=None)
+    parser.add_argument('--no-cache', action='store_true', default=False,
+                        help='dont use the build cache')
+    parser.add_argument('--all-functions', action='store_true',
+                        default=False,
+                        help='build all the (start-code <name>) functions '
+                        'in the notebooks, in a single pass per notebook')
 
 
 def archive_path(archive, project, name, tag=''):
@@ -145,7 +431,77 @@ def archive_path(archive, project, name, tag=''):
     return archive, url_target
 
 
-def build_notebook(nb_file, no_embed=False, tag="", name=""):
+def build_notebook(nb_file, no_embed=False, tag="", name="", isolated=None):
+    """Convert notebook to nuclio function config and code
+
+    the conversion runs in-process by default, set isolated=True (or the
+    NUCLIO_ISOLATED_BUILD env var) to run nbconvert in a subprocess instead
+    """
+    if isolated is None:
+        isolated = bool(environ.get(env_keys.isolated_build))
+    if isolated:
+        return build_notebook_isolated(nb_file, no_embed, tag, name)
+
+    # imported here, export depends on magic which imports this module
+    from .export import NuclioExporter, ExportContext
+
+    nb_dir, basename = path.split(nb_file)
+    resources = {'metadata': {'name': path.splitext(basename)[0],
+                              'path': nb_dir}}
+    nb = read_notebook(nb_file)
+
+    ctx = ExportContext.from_env()
+    ctx.function_name = name
+    exporter = NuclioExporter()
+    try:
+        config, code = exporter.export_notebook(nb, resources, ctx)
+    except Exception as err:
+        raise BuildError('cannot convert notebook, {}'.format(err))
+
+    if ctx.handler_path:
+        with open(ctx.handler_path) as fp:
+            code = fp.read()
+
+    if not no_embed:
+        data = b64encode(code.encode('utf-8')).decode('utf-8')
+        update_in(config, 'spec.build.functionSourceCode', data)
+
+    return config, code
+
+
+def build_notebook_functions(nb_file, no_embed=False):
+    """Convert all the notebook functions in-process and a single pass
+
+    returns {name: (config, code)}, '' is the nameless function
+    """
+    from .export import NuclioExporter, ExportContext
+
+    nb_dir, basename = path.split(nb_file)
+    resources = {'metadata': {'name': path.splitext(basename)[0],
+                              'path': nb_dir}}
+    nb = read_notebook(nb_file)
+
+    ctx = ExportContext.from_env()
+    exporter = NuclioExporter()
+    try:
+        functions = exporter.export_functions(nb, resources, ctx)
+    except Exception as err:
+        raise BuildError('cannot convert notebook, {}'.format(err))
+
+    for name, (config, code) in functions.items():
+        if ctx.handler_path:
+            with open(ctx.handler_path) as fp:
+                code = fp.read()
+            functions[name] = (config, code)
+        if not no_embed:
+            data = b64encode(code.encode('utf-8')).decode('utf-8')
+            update_in(config, 'spec.build.functionSourceCode', data)
+
+    return functions
+
+
+def build_notebook_isolated(nb_file, no_embed=False, tag="", name=""):
+    """Convert notebook using nbconvert in a subprocess"""
     env = environ.copy()  # Pass argument to exporter via environment
     yaml_path = mktemp('.yaml')
     py_path = ''
@@ -173,7 +529,7 @@ def build_notebook(nb_file, no_embed=False, tag="", name=""):
 
     with open(yaml_path) as yp:
         config_data = yp.read()
-    config = yaml.safe_load(config_data)
+    config = yaml_load(config_data)
     os.remove(yaml_path)
 
     if py_path:
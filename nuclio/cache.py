@@ -0,0 +1,157 @@
+# Copyright 2018 Iguazio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Local on-disk caches (build results, remote sources)"""
+import json
+import os
+from os import path, environ
+from tempfile import mkstemp
+from time import time
+
+from .utils import env_keys
+
+default_cache_dir = '~/.nuclio/cache'
+
+
+def cache_dir():
+    return path.expanduser(environ.get(env_keys.cache_dir, default_cache_dir))
+
+
+class FileCache:
+    """On-disk key/value cache with LRU (size) and age based eviction
+
+    entries are files under <cache dir>/<name>/, a file modification time is
+    its last access time. max_size is in bytes, max_age in seconds.
+    when over max_size the cache is trimmed to low_water * max_size, so the
+    cache dir isn't scanned again on every following put.
+    """
+    low_water = 0.8
+
+    def __init__(self, name, max_size=256 * 1024 ** 2, max_age=None):
+        self.name = name
+        self.max_size = max_size
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        # estimated cache size, avoids scanning the cache dir on every put
+        self._size = None
+
+    @property
+    def root(self):
+        return path.join(cache_dir(), self.name)
+
+    def path(self, key):
+        return path.join(self.root, key)
+
+    def get(self, key):
+        """Return cached bytes or None"""
+        key_path = self.get_path(key)
+        if key_path is None:
+            return None
+        try:
+            with open(key_path, 'rb') as fp:
+                return fp.read()
+        except OSError:
+            return None
+
+    def get_path(self, key):
+        """Return path of cached entry (or None), marks it as accessed"""
+        key_path = self.path(key)
+        try:
+            if self.max_age and time() - path.getmtime(key_path) > \
+                    self.max_age:
+                os.remove(key_path)
+                raise FileNotFoundError(key_path)
+            os.utime(key_path)
+        except OSError:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return key_path
+
+    def put(self, key, data):
+        """Store bytes (atomic), evict old entries if cache is too big"""
+        self.put_chunks(key, [data])
+
+    def put_chunks(self, key, chunks):
+        """Store bytes from chunks iterator (atomic), return entry path"""
+        os.makedirs(self.root, exist_ok=True)
+        fd, tmp_path = mkstemp(dir=self.root, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                for chunk in chunks:
+                    fp.write(chunk)
+            os.replace(tmp_path, self.path(key))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+        if self._size is not None:
+            self._size += path.getsize(self.path(key))
+        if self._size is None or (
+                self.max_size is not None and self._size > self.max_size):
+            self.evict(keep=key)
+        return self.path(key)
+
+    def get_json(self, key):
+        data = self.get(key)
+        if data is None:
+            return None
+        return json.loads(data.decode('utf-8'))
+
+    def put_json(self, key, obj):
+        self.put(key, json.dumps(obj).encode('utf-8'))
+
+    def evict(self, keep=None):
+        """Remove expired entries and least recently used ones over size
+
+        the keep entry (e.g. just added) is not removed for size, entries
+        are removed until the size is at most low_water * max_size
+        """
+        entries, total = [], 0
+        now = time()
+        for entry in os.scandir(self.root):
+            if not entry.is_file() or entry.name.startswith('.tmp-'):
+                continue
+            stat = entry.stat()
+            if self.max_age and now - stat.st_mtime > self.max_age:
+                self.remove(entry.name)
+                continue
+            total += stat.st_size
+            if entry.name != keep:
+                entries.append((stat.st_mtime, stat.st_size, entry.name))
+
+        self._size = total
+        if self.max_size is None or total <= self.max_size:
+            return
+
+        target = self.max_size * self.low_water
+        for _, size, name in sorted(entries):
+            self.remove(name)
+            total -= size
+            if total <= target:
+                break
+        self._size = total
+
+    def remove(self, key):
+        try:
+            os.remove(self.path(key))
+        except OSError:
+            pass
+
+    def clear(self):
+        if not path.isdir(self.root):
+            return
+        for entry in os.scandir(self.root):
+            self.remove(entry.name)
@@ -0,0 +1,101 @@
+# Copyright 2018 Iguazio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Shared HTTP client for nuclio dashboard and repo (archive) calls"""
+from threading import Lock
+
+retry_statuses = (500, 502, 503, 504)
+
+
+class HTTPClient:
+    """HTTP client with keep-alive connection pooling, retries and timeouts
+
+    retries   - retries on connection errors and 5xx responses (idempotent
+                methods only for 5xx/read errors, so POSTs aren't repeated)
+    backoff   - retry backoff factor (seconds), delays grow exponentially
+    timeout   - default timeout per call, seconds or (connect, read) tuple
+    pool_size - max connections kept open per host
+    """
+
+    def __init__(self, retries=3, backoff=0.5, timeout=(10, 120),
+                 pool_size=20):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        self.timeout = timeout
+        self.session = requests.Session()
+        retry = Retry(total=retries, connect=retries, read=retries,
+                      status=retries, backoff_factor=backoff,
+                      status_forcelist=retry_statuses, raise_on_status=False)
+        adapter = HTTPAdapter(max_retries=retry, pool_connections=pool_size,
+                              pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def request(self, method, url, **kw):
+        kw.setdefault('timeout', self.timeout)
+        return self.session.request(method, url, **kw)
+
+    def get(self, url, **kw):
+        return self.request('GET', url, **kw)
+
+    def head(self, url, **kw):
+        return self.request('HEAD', url, **kw)
+
+    def post(self, url, **kw):
+        return self.request('POST', url, **kw)
+
+    def put(self, url, **kw):
+        return self.request('PUT', url, **kw)
+
+    def delete(self, url, **kw):
+        return self.request('DELETE', url, **kw)
+
+    def close(self):
+        self.session.close()
+
+
+_client = None
+_stream_client = None
+_lock = Lock()
+
+
+def get_client():
+    """Return the shared HTTPClient (created on first use)"""
+    global _client
+    with _lock:
+        if _client is None:
+            _client = HTTPClient()
+        return _client
+
+
+def get_stream_client():
+    """Return the shared client for one-shot (streamed) request bodies
+
+    it doesn't retry, a retry would re-send the consumed body as empty
+    """
+    global _stream_client
+    with _lock:
+        if _stream_client is None:
+            _stream_client = HTTPClient(retries=0)
+        return _stream_client
+
+
+def set_client(client):
+    """Replace the shared client (e.g. with different retries/timeouts)"""
+    global _client
+    with _lock:
+        old, _client = _client, client
+    if old is not None and old is not client:
+        old.close()
@@ -13,12 +13,10 @@
 # limitations under the License.
 
 from base64 import b64decode
-from copy import deepcopy
+from functools import lru_cache
 from os import path, environ
-import yaml
-from IPython import get_ipython
 
-from .utils import parse_env
+from .utils import parse_env, yaml_load
 from .archive import url2repo
 from .triggers import HttpTrigger
 
@@ -32,6 +30,7 @@ class meta_keys:
     tag = 'nuclio.io/tag'
     extra_files = 'nuclio.io/extra_files'
     generated_by = 'nuclio.io/generated_by'
+    spec_hash = 'nuclio.io/spec-hash'
 
 
 _function_config = {
@@ -56,7 +55,22 @@ _function_config = {
 
 
 def new_config():
-    return deepcopy(_function_config)
+    return copy_tree(_function_config)
+
+
+def copy_tree(obj):
+    """Copy of plain dict/list/scalar tree (much faster than deepcopy)"""
+    if isinstance(obj, dict):
+        return {k: copy_tree(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [copy_tree(v) for v in obj]
+    return obj
+
+
+@lru_cache(maxsize=1024)
+def split_key(key):
+    """'a.b.c' -> ('a', 'b', 'c'), cached since keys repeat a lot"""
+    return tuple(key.split('.'))
 
 
 def get_in(obj, keys):
@@ -65,7 +79,7 @@ def get_in(obj, keys):
     1
     """
     if isinstance(keys, str):
-        keys = keys.split('.')
+        keys = split_key(keys)
 
     for key in keys:
         if not obj or key not in obj:
@@ -75,7 +89,7 @@ def get_in(obj, keys):
 
 
 def update_in(obj, key, value, append=False):
-    parts = key.split('.') if isinstance(key, str) else key
+    parts = split_key(key) if isinstance(key, str) else key
     for part in parts[:-1]:
         sub = obj.get(part, missing)
         if sub is missing:
@@ -104,7 +118,7 @@ def load_config(config_file):
 
 
 def load_config_data(config_data):
-    config = yaml.safe_load(config_data)
+    config = yaml_load(config_data)
     code = config['spec']['build'].get('functionSourceCode')
     if code:
         code = b64decode(code).decode('utf-8')
@@ -186,6 +200,11 @@ def set_commands(config, commands):
 
 
 def set_env(config, env):
+    update_env_vars(config, env_items(env))
+
+
+def env_items(env):
+    """Parse env lines (KEY=VALUE or %v3io) to (key, value) pairs"""
     for line in env:
         line = line.strip()
         if not line or line[0] == '#':
@@ -195,7 +214,7 @@ def set_env(config, env):
             for key in ['V3IO_FRAMESD', 'V3IO_USERNAME',
                         'V3IO_ACCESS_KEY', 'V3IO_API']:
                 if key in environ:
-                    update_env_var(config, key, environ[key])
+                    yield key, environ[key]
             continue
 
         key, value = parse_env(line)
@@ -203,28 +222,36 @@ def set_env(config, env):
             raise ValueError(
                 'cannot parse environment value from: {}'.format(line))
 
-        update_env_var(config, key, value)
+        yield key, value
 
 
 def set_env_dict(config, env={}):
-    for k, v in env.items():
-        update_env_var(config, k, str(v))
+    update_env_vars(config, ((k, str(v)) for k, v in env.items()))
 
 
 def update_env_var(config, key, value):
-    i = 0
-    found = False
-    for v in config['spec']['env']:
-        if v['name'] == key:
-            found = True
-            break
-        i += 1
-
-    item = {'name': key, 'value': value}
-    if found:
-        config['spec']['env'][i] = item
-    else:
-        config['spec']['env'].append(item)
+    update_env_vars(config, [(key, value)])
+
+
+def update_env_vars(config, items):
+    """Set (key, value) pairs in the config env list, keeps order
+
+    an existing var is replaced in place, new ones are appended. uses a
+    name -> index map so setting N vars is linear (not N * len(env))
+    """
+    env = config['spec']['env']
+    index = {}
+    for i, var in enumerate(env):
+        index.setdefault(var['name'], i)
+
+    for key, value in items:
+        item = {'name': key, 'value': value}
+        i = index.get(key)
+        if i is None:
+            index[key] = len(env)
+            env.append(item)
+        else:
+            env[i] = item
 
 
 def fill_config(config, extra_config={}, env={}, cmd=[], mount: Volume = None):
@@ -280,6 +307,7 @@ class ConfigSpec:
             environ[k] = v
 
         if not skipcmd:
+            from IPython import get_ipython
             ipy = get_ipython()
             for line in self.cmd:
                 ipy.system(path.expandvars(line))
@@ -13,26 +13,51 @@
 # limitations under the License.
 """Deploy notebook to nuclio"""
 import json
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from hashlib import sha256
 from os import environ
 from operator import itemgetter
-from tempfile import mktemp
-from time import sleep, time
+from random import uniform
+from time import sleep, time, monotonic
 from datetime import datetime
 
-import yaml
-import requests
-from .utils import DeployError, list2dict, str2nametag, logger, normalize_name
+from .client import get_client
+from .utils import (DeployError, list2dict, str2nametag, logger,
+                    normalize_name, LazyYaml)
 from .config import (update_in, meta_keys, ConfigSpec, extend_config, Volume,
                      set_handler, new_config)
-from .archive import get_archive_config, build_zip, upload_file, is_archive
+from .archive import (get_archive_config, upload_zip, is_archive,
+                      read_manifest, manifest_suffix)
 from .build import code2config, build_file, archive_path
 
 VERIFY_CERT = False
+# code entry types where the code isn't in the function config
+external_code_entries = ('archive', 'github', 's3')
+
+
+class Backoff:
+    """Polling delays, growing from start to limit with random jitter"""
+
+    def __init__(self, start=0.2, factor=1.5, limit=5.0, jitter=0.2):
+        self.start = start
+        self.factor = factor
+        self.limit = limit
+        self.jitter = jitter
+        self.delay = start
+
+    def next_delay(self):
+        delay = self.delay * uniform(1 - self.jitter, 1 + self.jitter)
+        self.delay = min(self.delay * self.factor, self.limit)
+        return delay
+
+    def reset(self):
+        self.delay = self.start
 
 
 def get_function(api_address, name):
     api_url = '{}/functions/{}'.format(api_address, name)
-    return requests.get(api_url, verify=VERIFY_CERT)
+    return get_client().get(api_url, verify=VERIFY_CERT)
 
 
 service_names = {
@@ -64,6 +89,47 @@ def find_dashboard_url(dashboard_url=''):
     return with_prefix('http://localhost:8070')
 
 
+def config_hash(config, code=''):
+    """Return hash of the function spec and code (normalized config)
+
+    code is the digest of code that isn't embedded in the config (see
+    code_digest)
+    """
+    annotations = dict(config['metadata'].get('annotations') or {})
+    annotations.pop(meta_keys.spec_hash, None)
+    annotations.pop(meta_keys.generated_by, None)
+    data = {
+        'labels': config['metadata'].get('labels') or {},
+        'annotations': annotations,
+        'spec': config.get('spec', {}),
+    }
+    if code:
+        data['code'] = code
+    text = json.dumps(data, sort_keys=True, default=str)
+    return sha256(text.encode('utf-8')).hexdigest()
+
+
+def code_digest(config):
+    """Return digest of the function code not embedded in the config
+
+    '' when the code is in the config (or not needed), the archive manifest
+    digest for archives uploaded by upload_zip and None when the code can't
+    be hashed (archive without manifest, git/s3 code entries). reads the
+    manifest of remote archives, only used with if_changed
+    """
+    build = config.get('spec', {}).get('build', {})
+    entry = build.get('codeEntryType')
+    if entry not in external_code_entries or build.get('functionSourceCode'):
+        return ''
+    if entry == 'archive' and build.get('path'):
+        headers = build.get('codeEntryAttributes', {}).get('headers')
+        manifest = read_manifest(build['path'] + manifest_suffix, headers)
+        if manifest:
+            text = json.dumps(manifest, sort_keys=True)
+            return sha256(text.encode('utf-8')).hexdigest()
+    return None
+
+
 def project_name(config):
     labels = config['metadata'].get('labels', {})
     return labels.get(meta_keys.project)
@@ -88,7 +154,8 @@ def deploy_from_args(args, name=''):
     addr = deploy_file(name or args.file, args.dashboard_url, name=args.name,
                        project=args.project, verbose=args.verbose,
                        create_project=args.create_project, spec=spec,
-                       archive=args.archive, tag=args.tag, kind=args.kind)
+                       archive=args.archive, tag=args.tag, kind=args.kind,
+                       if_changed=args.if_changed, timeout=args.timeout)
     with open('/tmp/output', 'w') as fp:
         fp.write(addr)
     return addr
@@ -132,13 +199,15 @@ def deploy_model(models: dict, source='', model_class='', protocol='',
 
 def deploy_file(source='', dashboard_url='', name='', project='', handler='',
                 tag='', verbose=False, create_project=True, archive=False,
-                spec: ConfigSpec = None, files=[], output_dir='', kind=None):
+                spec: ConfigSpec = None, files=[], output_dir='', kind=None,
+                if_changed=False, timeout=None):
 
     if source.startswith('$') or is_archive(source):
         return deploy_zip(source, name, project, tag,
                           dashboard_url=dashboard_url,
                           verbose=verbose, spec=spec,
-                          create_project=create_project)
+                          create_project=create_project,
+                          if_changed=if_changed, timeout=timeout)
 
     if archive or files:
         _, url_target = archive_path(output_dir, project, name, tag)
@@ -151,14 +220,15 @@ def deploy_file(source='', dashboard_url='', name='', project='', handler='',
                                     output_dir=output_dir, kind=kind)
 
     addr = deploy_config(config, dashboard_url, name=name, project=project,
-                         tag=tag, verbose=verbose, create_new=create_project)
+                         tag=tag, verbose=verbose, create_new=create_project,
+                         if_changed=if_changed, timeout=timeout)
 
     return addr
 
 
 def deploy_zip(source='', name='', project='', tag='', dashboard_url='',
                verbose=False, spec: ConfigSpec = None,
-               create_project=True):
+               create_project=True, if_changed=False, timeout=None):
 
     if source.startswith('$'):
         oproject, oname, otag = str2nametag(source[1:])
@@ -172,18 +242,19 @@ def deploy_zip(source='', name='', project='', tag='', dashboard_url='',
     config = extend_config(config, spec, tag, 'archive '+source)
 
     if verbose:
-        logger.info('Config:\n{}'.format(
-            yaml.dump(config, default_flow_style=False)))
+        logger.info('Config:\n%s', LazyYaml(config))
 
     addr = deploy_config(config, dashboard_url, name=name, project=project,
-                         tag=tag, verbose=verbose, create_new=create_project)
+                         tag=tag, verbose=verbose, create_new=create_project,
+                         if_changed=if_changed, timeout=timeout)
 
     return addr
 
 
 def deploy_code(code, dashboard_url='', name='', project='', handler='',
                 lang='.py', tag='', verbose=False, create_project=True,
-                archive='', spec: ConfigSpec = None, files=[], kind=None):
+                archive='', spec: ConfigSpec = None, files=[], kind=None,
+                if_changed=False, timeout=None):
 
     name = normalize_name(name)
     newconfig, code = code2config(code, lang, kind=kind)
@@ -191,9 +262,8 @@ def deploy_code(code, dashboard_url='', name='', project='', handler='',
     if spec:
         spec.merge(newconfig)
     if verbose:
-        logger.info('Code:\n{}'.format(code))
-        logger.info('Config:\n{}'.format(
-            yaml.dump(newconfig, default_flow_style=False)))
+        logger.info('Code:\n%s', code)
+        logger.info('Config:\n%s', LazyYaml(newconfig))
 
     if archive:
         archive, url_target = archive_path(archive, name=name,
@@ -202,25 +272,30 @@ def deploy_code(code, dashboard_url='', name='', project='', handler='',
         raise DeployError('archive URL must be specified when packing files')
 
     if files:
-        zip_path = archive
-        if url_target:
-            zip_path = mktemp('.zip')
-        build_zip(zip_path, newconfig, code, files, lang)
-        upload_file(zip_path, archive, True)
+        upload_zip(archive, newconfig, code, files, lang)
         newconfig = get_archive_config(name, archive)
         if verbose:
-            logger.info('Archive Config:\n{}'.format(
-                yaml.dump(newconfig, default_flow_style=False)))
+            logger.info('Archive Config:\n%s', LazyYaml(newconfig))
 
     newconfig = extend_config(newconfig, None, tag, 'code')
     update_in(newconfig, 'metadata.name', name)
 
     return deploy_config(newconfig, dashboard_url, name=name, project=project,
-                         tag=tag, verbose=verbose, create_new=create_project)
+                         tag=tag, verbose=verbose, create_new=create_project,
+                         if_changed=if_changed, timeout=timeout)
 
 
 def deploy_config(config, dashboard_url='', name='', project='', tag='',
-                  verbose=False, create_new=False, watch=True):
+                  verbose=False, create_new=False, watch=True,
+                  if_changed=False, timeout=None):
+    """Deploy function config to nuclio
+
+    with if_changed=True the deploy is skipped (and the current address is
+    returned) when the deployed function is ready and has the same spec and
+    code, see config_hash (with if_changed the manifest of archives is read
+    to hash their code). timeout is the max seconds to wait for the
+    function to be ready (when watch=True), default is no limit
+    """
     # logger level is INFO, debug won't emit
     log = logger.info if verbose else logger.debug
 
@@ -247,6 +322,25 @@ def deploy_config(config, dashboard_url='', name='', project='', tag='',
 
     key = ['metadata', 'labels', meta_keys.project]
     update_in(config, key, project)
+    # reading the archive manifest costs a request, only with if_changed
+    code = code_digest(config) if if_changed else ''
+    digest = config_hash(config, code)
+    update_in(config, ['metadata', 'annotations', meta_keys.spec_hash],
+              digest)
+
+    if if_changed and code is None:
+        log('cannot hash %s code, deploying', name)
+    elif if_changed and not is_new:
+        current = resp.json()
+        annotations = current['metadata'].get('annotations') or {}
+        state = current.get('status', {}).get('state')
+        if annotations.get(meta_keys.spec_hash) == digest \
+                and state == 'ready':
+            address = '{}:{}'.format(get_address(api_address),
+                                     current['status'].get('httpPort', 0))
+            logger.info('function %s did not change, skipping deploy, '
+                        'function address: %s', name, address)
+            return address
 
     headers = {
         'Content-Type': 'application/json',
@@ -256,11 +350,11 @@ def deploy_config(config, dashboard_url='', name='', project='', tag='',
     api_url = '{}/functions'.format(api_address)
     try:
         if is_new:
-            resp = requests.post(api_url, json=config,
-                                 headers=headers, verify=VERIFY_CERT)
+            resp = get_client().post(api_url, json=config,
+                                     headers=headers, verify=VERIFY_CERT)
         else:
-            resp = requests.put(api_url+'/'+name, json=config,
-                                headers=headers, verify=VERIFY_CERT)
+            resp = get_client().put(api_url+'/'+name, json=config,
+                                    headers=headers, verify=VERIFY_CERT)
 
     except OSError as err:
         log('ERROR: %s', str(err))
@@ -273,7 +367,8 @@ def deploy_config(config, dashboard_url='', name='', project='', tag='',
     log('deploying ...')
 
     if watch:
-        state, address = deploy_progress(api_address, name, verbose)
+        state, address = deploy_progress(api_address, name, verbose,
+                                         timeout)
         if state != 'ready':
             log('ERROR: {}'.format(resp.text))
             raise DeployError('cannot deploy ' + resp.text)
@@ -284,6 +379,153 @@ def deploy_config(config, dashboard_url='', name='', project='', tag='',
     return None
 
 
+DeployResult = namedtuple('DeployResult', 'name state address duration error')
+# default max seconds deploy_many waits for each function
+deploy_many_timeout = 600
+
+
+def deploy_many(configs, dashboard_url='', project='', tag='', verbose=False,
+                create_new=True, workers=4, timeout=deploy_many_timeout,
+                if_changed=False):
+    """Deploy many function configs, return list of DeployResult
+
+    up to workers functions are deployed at the same time, the status of all
+    deploying functions is polled by a single loop (one list request per
+    round). timeout is the max seconds to wait for each function (None for
+    no limit), functions not ready by then are marked as failed.
+    results are (name, state, address, duration, error) in configs order
+    """
+    if not project:
+        raise DeployError('project name must be specified (using -p option)')
+
+    api_address = find_dashboard_url(dashboard_url)
+    # functions are listed by project key (which may differ from the name)
+    try:
+        project = find_or_create_project(api_address, project, create_new)
+    except OSError:
+        raise DeployError('error: cannot connect to {}'.format(api_address))
+
+    queue = deque(configs)
+    names = [config['metadata']['name'] for config in configs]
+    submitted, deploying, results, started = {}, set(), {}, {}
+    backoff = Backoff()
+    ip = None
+
+    def done(name, state, address='', error=None):
+        duration = monotonic() - started[name]
+        results[name] = DeployResult(name, state, address, duration, error)
+        logger.info('%s %s (%.1fs)%s', name, state, duration,
+                    ': ' + error if error else '')
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while queue or submitted or deploying:
+            while queue and len(submitted) + len(deploying) < workers:
+                config = queue.popleft()
+                name = config['metadata']['name']
+                started[name] = monotonic()
+                future = pool.submit(
+                    deploy_config, config, dashboard_url, name=name,
+                    project=project, tag=tag, verbose=verbose,
+                    create_new=create_new, watch=False,
+                    if_changed=if_changed)
+                submitted[future] = name
+
+            for future in [f for f in submitted if f.done()]:
+                name = submitted.pop(future)
+                try:
+                    address = future.result()
+                except Exception as err:
+                    done(name, 'error', error=str(err))
+                    continue
+                if address:  # unchanged (if_changed)
+                    done(name, 'ready', address)
+                else:
+                    deploying.add(name)
+                    backoff.reset()
+
+            if deploying:
+                list_error = ''
+                try:
+                    functions = get_functions(api_address, project)
+                except (OSError, DeployError) as err:
+                    functions, list_error = {}, str(err)
+                    logger.debug('list functions failed: %s', err)
+                for name in list(deploying):
+                    status = functions.get(name, {}).get('status', {})
+                    state = status.get('state')
+                    if state == 'ready':
+                        ip = ip or get_address(api_address)
+                        address = '{}:{}'.format(ip,
+                                                 status.get('httpPort', 0))
+                        done(name, state, address)
+                    elif state == 'error':
+                        done(name, state, error=status.get('message', ''))
+                    elif timeout and \
+                            monotonic() - started[name] > timeout:
+                        done(name, 'error', error='timeout ({})'.format(
+                            list_error or state))
+                    else:
+                        continue
+                    deploying.discard(name)
+
+            delay = backoff.next_delay()
+            if submitted:
+                wait(list(submitted), delay, return_when=FIRST_COMPLETED)
+            elif deploying:
+                sleep(delay)
+
+    return [results[name] for name in names]
+
+
+def get_functions(api_address, project=''):
+    """Return functions (name -> function) of a project"""
+    headers = {}
+    if project:
+        headers['x-nuclio-project-name'] = project
+    resp = get_client().get('{}/functions'.format(api_address),
+                            headers=headers, verify=VERIFY_CERT)
+    if not resp.ok:
+        raise DeployError('error: cannot list functions at {}'.format(
+            api_address))
+    return resp.json()
+
+
+def deploy_many_from_args(args):
+    envdict = list2dict(args.env)
+    configs = []
+    for source in args.files:
+        spec = ConfigSpec(env=dict(envdict))
+        _, config, _ = build_file(source, tag=args.tag, spec=spec,
+                                  kind=args.kind)
+        configs.append(config)
+
+    return deploy_many(configs, args.dashboard_url, project=args.project,
+                       tag=args.tag, verbose=args.verbose,
+                       workers=args.workers, timeout=args.timeout,
+                       if_changed=args.if_changed)
+
+
+def deploy_many_parser(parser):
+    parser.add_argument('files', help='notebook/code files or urls',
+                        nargs='+')
+    parser.add_argument('--dashboard-url', '-d', help='dashboard URL')
+    parser.add_argument('--project', '-p', help='project name')
+    parser.add_argument('--tag', '-t', default='', help='version tag')
+    parser.add_argument('--workers', '-j', type=int, default=4,
+                        help='max number of functions deployed at once')
+    parser.add_argument('--env', '-e', default=[], action='append',
+                        help='override environment variable (key=value)')
+    parser.add_argument('--timeout', type=float, default=deploy_many_timeout,
+                        help='max seconds to wait for each function')
+    parser.add_argument('--if-changed', action='store_true', default=False,
+                        help='skip deploy if function spec/code unchanged')
+    parser.add_argument(
+        '--verbose', '-v', action='store_true', default=False,
+        help='emit more logs',
+    )
+    parser.add_argument('--kind', default=None)
+
+
 def populate_parser(parser):
     parser.add_argument('file', help='notebook/code file',
                         nargs='?', default='')
@@ -315,30 +557,51 @@ def populate_parser(parser):
     parser.add_argument('--mount', default='',
                         help='volume mount, [vol-type:]<vol-url>:<dst>')
     parser.add_argument('--kind', default=None)
+    parser.add_argument('--if-changed', action='store_true', default=False,
+                        help='skip deploy if function spec/code unchanged')
+    parser.add_argument('--timeout', type=float, default=None,
+                        help='max seconds to wait for the deploy')
 
 
-def deploy_progress(api_address, name, verbose=False):
+def deploy_progress(api_address, name, verbose=False, timeout=None):
+    """Wait for function deploy to end, return state and address
+
+    the status is polled with growing (jittered) delays, a DeployError is
+    raised if the function is not ready/failed after timeout seconds
+    """
     url = '{}/functions/{}'.format(api_address, name)
     last_time = time() * 1000.0
     address = ''
+    backoff = Backoff()
+    deadline = monotonic() + timeout if timeout else None
 
+    client = get_client()
     while True:
-        resp = requests.get(url, verify=VERIFY_CERT)
+        resp = client.get(url, verify=VERIFY_CERT)
         if not resp.ok:
             raise DeployError('error: cannot poll {} status'.format(name))
 
-        state, last_time, _ = process_resp(resp.json(), last_time,
+        data = resp.json()
+        state, last_time, _ = process_resp(data, last_time,
                                            verbose, log_message=True)
         if state in {'ready', 'error'}:
 
             if state == 'ready':
                 ip = get_address(api_address)
-                address = '{}:{}'.format(ip, resp.json()['status']
-                                         .get('httpPort', 0))
+                address = '{}:{}'.format(
+                    ip, data['status'].get('httpPort', 0))
 
             return state, address
 
-        sleep(1)
+        delay = backoff.next_delay()
+        if deadline:
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                raise DeployError(
+                    'timeout waiting for {} to deploy ({})'.format(
+                        name, state))
+            delay = min(delay, remaining)
+        sleep(delay)
 
 
 def get_deploy_status(api_address, name, last_time=None, verbose=False):
@@ -346,7 +609,7 @@ def get_deploy_status(api_address, name, last_time=None, verbose=False):
     last_time = last_time or (time() * 1000.0)
     address = ''
 
-    resp = requests.get(url, verify=VERIFY_CERT)
+    resp = get_client().get(url, verify=VERIFY_CERT)
     if not resp.ok:
         raise DeployError('error: cannot poll {} status'.format(name))
 
@@ -363,8 +626,8 @@ def get_deploy_status(api_address, name, last_time=None, verbose=False):
 
 
 def get_address(api_url):
-    resp = requests.get('{}/external_ip_addresses'.format(api_url),
-                        verify=VERIFY_CERT)
+    resp = get_client().get('{}/external_ip_addresses'.format(api_url),
+                            verify=VERIFY_CERT)
     if not resp.ok:
         logger.warning('failed to obtain external IP address, returned local')
         return "localhost"
@@ -386,7 +649,8 @@ def process_resp(resp, last_time, verbose=False, log_message=False):
         return state, last_time, [message]
 
     outputs = []
-    for log in sorted(logs, key=itemgetter('time')):
+    new_logs = [log for log in logs if log['time'] > last_time]
+    for log in sorted(new_logs, key=itemgetter('time')):
         timestamp = log['time']
         if timestamp <= last_time:
             continue
@@ -405,14 +669,9 @@ def process_resp(resp, last_time, verbose=False, log_message=False):
     return state, last_time, outputs
 
 
-def find_or_create_project(api_url, project, create_new=False):
-    apipath = '{}/projects'.format(api_url)
-    resp = requests.get(apipath, verify=VERIFY_CERT)
-
-    project = project.strip()
-    if not resp.ok:
-        raise OSError('nuclio API call failed')
-    for k, v in resp.json().items():
+def match_project(projects, project):
+    """Return the key of project in dashboard projects listing (or None)"""
+    for k, v in projects.items():
         if v['metadata'].get('name') == project:
             return k
 
@@ -423,6 +682,19 @@ def find_or_create_project(api_url, project, create_new=False):
 
         elif k == project:
             return k
+    return None
+
+
+def find_or_create_project(api_url, project, create_new=False):
+    apipath = '{}/projects'.format(api_url)
+    resp = get_client().get(apipath, verify=VERIFY_CERT)
+
+    project = project.strip()
+    if not resp.ok:
+        raise OSError('nuclio API call failed')
+    key = match_project(resp.json(), project)
+    if key is not None:
+        return key
 
     if not create_new:
         raise DeployError('project name {} not found'.format(project))
@@ -432,8 +704,8 @@ def find_or_create_project(api_url, project, create_new=False):
     config = {"metadata": {"name": project}, "spec": {}}
 
     try:
-        resp = requests.post(apipath, json=config,
-                             headers=headers, verify=VERIFY_CERT)
+        resp = get_client().post(apipath, json=config,
+                                 headers=headers, verify=VERIFY_CERT)
     except OSError as err:
         logger.info('ERROR: %s', str(err))
         raise DeployError(
@@ -453,7 +725,7 @@ def list_functions(dashboard_url='', namespace=''):
     if namespace:
         headers = {'x-nuclio-function-namespace': namespace}
     try:
-        resp = requests.get(api_url, headers=headers, verify=VERIFY_CERT)
+        resp = get_client().get(api_url, headers=headers, verify=VERIFY_CERT)
 
     except OSError as err:
         logger.error('ERROR: %s', str(err))
@@ -475,8 +747,8 @@ def delete_func(name, dashboard_url='', namespace=''):
 
     api_url = '{}/functions'.format(api_address)
     try:
-        resp = requests.delete(api_url, json=body,
-                               headers=headers, verify=VERIFY_CERT)
+        resp = get_client().delete(api_url, json=body,
+                                   headers=headers, verify=VERIFY_CERT)
     except OSError as err:
         logger.error('ERROR: %s', str(err))
         raise DeployError('error: cannot del {} at {}'.format(name, api_url))
@@ -17,59 +17,149 @@ import logging
 import re
 from base64 import b64encode
 from collections import namedtuple
+from functools import lru_cache
 from io import StringIO
 from os import environ, path
 from textwrap import indent
 from sys import stdout
 
-import yaml
 from nbconvert.exporters import Exporter
-from nbconvert.filters import ipython2python
 
 from .utils import (env_keys, iter_env_lines, parse_config_line,
-                    parse_mount_line, normalize_name)
+                    parse_mount_line, normalize_name, yaml_dump)
 from .archive import parse_archive_line
 from .config import (new_config, update_in, get_in, set_env, set_commands,
-                     Volume, meta_keys)
+                     Volume, meta_keys, copy_tree)
 from . import magic as magic_module
 
 here = path.dirname(path.abspath(__file__))
 
 Magic = namedtuple('Magic', 'name args lines is_cell')
 magic_handlers = {}  # name -> function
-env_files = set()
-archive_settings = {}
 
 is_comment = re.compile(r'[ \t]*#.*').match
 # # nuclio: return
 is_return = re.compile(r'#[ \t]*(nuclio|mlrun):[ \t]*return').search
-# # nuclio: ignore
-has_ignore = re.compile(r'#[ \t]*(nuclio|mlrun):[ \t]*ignore').search
-has_start = re.compile(
-    r'#[ \t]*(nuclio|mlrun):[ \t]*start-code[ \t]*(?P<name>([\S]*))?'
-).search
-has_end = re.compile(
-    r'#[ \t]*(nuclio|mlrun):[ \t]*end-code[ \t]*(?P<name>([\S]*))?'
-).search
+# # nuclio: ignore, # nuclio: start-code [name], # nuclio: end-code [name]
+find_annotations = re.compile(
+    r'#[ \t]*(nuclio|mlrun):[ \t]*(?P<kind>ignore|start-code|end-code)'
+    r'(?=[ \t]*(?P<name>[\S]*))').finditer
+# cells without these have no comments, magics or shell escapes
+has_special = re.compile(r'[#!%]').search
+# comment or dropped (%nuclio, other magics and shell escapes) line
+match_line = re.compile(
+    r'(?P<comment>[ \t]*#)|(?P<drop>[!%]|.*%nuclio)').match
+# code the IPython token transformers may change (escapes, help, autocall)
+has_ipython_syntax = re.compile(r'[!%?]|^[ \t\f]*[,;/]', re.M).search
 handler_decl = 'def {}(context, event):'
+nameless_function = ''
 indent_prefix = '    '
 line_magic = '%nuclio'
 cell_magic = '%' + line_magic
-
-handlers = []
+# parsed/converted cells kept in memory (LRU), by cell source
+cell_cache_size = int(environ.get(env_keys.cell_cache_size, 16384))
+_transformer = None  # shared IPython TransformerManager
 
 
 class MagicError(Exception):
     pass
 
 
+class CodeBuffer:
+    """Code cells of a single (named or nameless) function
+
+    Collects all the cells until the function "start-code" annotation (where
+    they are discarded) and stops on "end-code", errors are kept so only the
+    exported functions fail on bad annotations.
+    """
+
+    def __init__(self, cells):
+        self.cells = list(cells)
+        self.started = False
+        self.ended = False
+        self.error = ''
+
+    def start(self):
+        if not self.started:
+            # discard code that doesn't belong to the function
+            self.cells = []
+        elif not self.ended:
+            self.set_error('Found multiple consecutive "start-code" '
+                           'annotations')
+        self.started = True
+        self.ended = False
+
+    def end(self):
+        if self.ended:
+            self.set_error('Found multiple consecutive "end-code" annotations')
+        # found code that belongs to the current function
+        self.started = True
+        self.ended = True
+
+    def append(self, code):
+        if not self.ended:
+            self.cells.append(code)
+
+    def set_error(self, error):
+        self.error = self.error or error
+
+
+class ExportContext:
+    """State of a single export
+
+    Holds the export options (normally passed by environment variables) and
+    the state collected by magic handlers, a new context is used for every
+    export so notebooks can be exported concurrently.
+    """
+
+    def __init__(self, function_name='', handler_name='', handler_path='',
+                 code_path='', drop_outputs=False, env_files=None):
+        self.function_name = function_name
+        self.handler_name = handler_name
+        self.handler_path = handler_path
+        self.code_path = code_path
+        self.drop_outputs = drop_outputs
+        self.env_files = list(env_files or [])
+        # %nuclio env lines not applied yet, see apply_env_lines
+        self.env_lines = []
+        self.archive_settings = {}
+        self.handlers = []
+
+    @classmethod
+    def from_env(cls, env=None):
+        """Create context from environment variables (see env_keys)"""
+        env = environ if env is None else env
+        return cls(
+            function_name=env.get(env_keys.function_name, ''),
+            handler_name=env.get(env_keys.handler_name, ''),
+            handler_path=env.get(env_keys.handler_path, ''),
+            code_path=env.get(env_keys.code_target_path, ''),
+            drop_outputs=env_keys.drop_nb_outputs in env,
+            env_files=json.loads(env.get(env_keys.env_files, '[]')),
+        )
+
+    def add_env_file(self, file_name):
+        if file_name not in self.env_files:
+            self.env_files.append(file_name)
+
+    def next_handler_name(self):
+        if self.handlers:
+            name = 'handler_{}'.format(len(self.handlers))
+        else:
+            name = 'handler'
+        self.handlers.append(name)
+        return name
+
+
 def create_logger():
     handler = logging.StreamHandler(stdout)
     handler.setFormatter(
         logging.Formatter('[%(name)s] %(asctime)s %(message)s'))
     logger = logging.getLogger('nuclio.export')
-    logger.addHandler(handler)
+    if not len(logger.handlers):
+        logger.addHandler(handler)
     logger.setLevel(logging.INFO)
+    logger.propagate = False
     return logger
 
 
@@ -84,7 +174,7 @@ class NuclioExporter(Exporter):
 
     @property
     def output_mimetype(self):
-        if archive_settings:
+        if getattr(self, '_has_archive', False):
             return 'application/zip'
         else:
             return 'application/yaml'
@@ -93,103 +183,21 @@ class NuclioExporter(Exporter):
         """Return default file extension"""
         return '.yaml'
 
-    def from_notebook_node(self, nb, resources=None, **kw):
-        config = new_config()
-        nbname = name = get_in(resources, 'metadata.name')  # notebook name
-        if name:
-            config['metadata']['name'] = normalize_name(name)
-        config['spec']['handler'] = handler_name()
-
-        ended = 'ended'
-        started = 'started'
-        code_cells = 'code_cells'
-        nameless_annotation = ''
-        target_function_name = environ.get(env_keys.function_name)
-        seen_function_name = nameless_annotation
-
-        function_buffers = {
-            nameless_annotation: {
-                ended: False,
-                started: False,
-                code_cells: [],
-            },
-        }
-        if target_function_name:
-            function_buffers[target_function_name] = {
-                ended: False,
-                started: False,
-                code_cells: [],
-            }
-        else:
-            # to avoid accidental KeyError
-            target_function_name = nameless_annotation
-
-        for cell in filter(is_code_cell, nb['cells']):
-            code = cell['source']
-            if has_ignore(code):
-                continue
-
-            match = has_end(code)
-            if match:
-                current_name = match.group('name')
-                if current_name in [target_function_name, nameless_annotation]:
-                    if function_buffers[current_name][ended]:
-                        raise MagicError('Found multiple consecutive '
-                                         + '"end-code" annotations')
-                    # found code that belongs to the current function
-                    function_buffers[current_name][started] = True
-                    function_buffers[current_name][ended] = True
-                    seen_function_name = seen_function_name or current_name
-
-            match = has_start(code)
-            if match:
-                current_name = match.group('name')
-                if current_name in [target_function_name, nameless_annotation]:
-                    if not function_buffers[current_name][started]:
-                        # discard code that doesn't belong to the function
-                        function_buffers[current_name][code_cells] = []
-                    if function_buffers[current_name][started]\
-                            and not function_buffers[current_name][ended]:
-                        raise MagicError('Found multiple consecutive '
-                                         + '"start-code" annotations')
-                    function_buffers[current_name][started] = True
-                    function_buffers[current_name][ended] = False
-                    seen_function_name = seen_function_name or current_name
-
-            lines = code.splitlines()
-            if cell_magic in code:
-                code = self.handle_cell_magic(config, lines)
-
-            # must be else (cell_magic token contains line_magic)
-            elif line_magic in code:
-                code = self.handle_line_magic(config, lines)
-
-            for function_buffer in function_buffers.values():
-                if not function_buffer[ended]:
-                    function_buffer[code_cells].append(code)
-
-        io = self.write_code_cells(
-            function_buffers[seen_function_name][code_cells])
-        process_env_files(env_files, config)
-        py_code = io.getvalue()
-        handler_path = environ.get(env_keys.handler_path)
-        if handler_path:
-            with open(handler_path) as fp:
+    def from_notebook_node(self, nb, resources=None, context=None, **kw):
+        resources = {} if resources is None else resources
+        ctx = context or ExportContext.from_env()
+        config, py_code = self.export_notebook(nb, resources, ctx)
+        if ctx.handler_path:
+            with open(ctx.handler_path) as fp:
                 py_code = fp.read()
 
-        efiles = []
-        if archive_settings:
-            if archive_settings['notebook'] and nbname:
-                archive_settings['files'] += [nbname + '.ipynb']
-            efiles = ','.join(archive_settings['files'])
-            config['metadata']['annotations'][meta_keys.extra_files] = efiles
-
-        if env_keys.code_target_path in environ:
-            code_path = environ.get(env_keys.code_target_path)
-            with open(code_path, 'w') as fp:
+        efiles = ctx.archive_settings.get('files', [])
+        self._has_archive = bool(ctx.archive_settings)
+        if ctx.code_path:
+            with open(ctx.code_path, 'w') as fp:
                 fp.write(py_code)
                 fp.close()
-        elif efiles and env_keys.drop_nb_outputs not in environ:
+        elif efiles and not ctx.drop_outputs:
             outputs = {'handler.py': py_code,
                        'function.yaml': gen_config(config)}
             for filename in efiles:
@@ -206,33 +214,104 @@ class NuclioExporter(Exporter):
 
         return config, resources
 
+    def export_notebook(self, nb, resources=None, context=None):
+        """Convert notebook node, return config (dict) and handler code
+
+        Unlike from_notebook_node, nothing is written to disk and the code is
+        not embedded in the config, this is used by in-process builds.
+        """
+        ctx = context or ExportContext.from_env()
+        config, buffers = self.scan_notebook(nb, resources, ctx)
+        name = ctx.function_name
+        if name not in buffers:
+            name = nameless_function
+        check_buffers(buffers, {name, nameless_function})
+        return config, self.write_code_cells(buffers[name].cells).getvalue()
+
+    def export_functions(self, nb, resources=None, context=None):
+        """Convert all the functions in a notebook node in a single pass
+
+        Returns {name: (config, code)} for every function marked with
+        "start-code <name>"/"end-code <name>" and for the nameless ('')
+        function, same as export_notebook with each function name. Configs
+        of named functions are named after the function.
+        """
+        ctx = context or ExportContext.from_env()
+        config, buffers = self.scan_notebook(nb, resources, ctx)
+        check_buffers(buffers, buffers)
+        functions = {}
+        for name, buf in buffers.items():
+            func_config = copy_tree(config)
+            if name:
+                func_config['metadata']['name'] = normalize_name(name)
+            code = self.write_code_cells(buf.cells).getvalue()
+            functions[name] = (func_config, code)
+        return functions
+
+    def scan_notebook(self, nb, resources, ctx):
+        """Process notebook cells, return config and name -> CodeBuffer
+
+        Magics are handled once (they update the config shared by all the
+        functions), each function collects the cells in its own annotations.
+        """
+        config = new_config()
+        nbname = name = get_in(resources, 'metadata.name')  # notebook name
+        if name:
+            config['metadata']['name'] = normalize_name(name)
+        config['spec']['handler'] = handler_name(ctx)
+
+        codes = []  # all the cells, a new function starts with these
+        buffers = {nameless_function: CodeBuffer(codes)}
+
+        def function_buffer(name):
+            if name not in buffers:
+                buffers[name] = CodeBuffer(codes)
+            return buffers[name]
+
+        for cell in filter(is_code_cell, nb['cells']):
+            code = cell['source']
+            info = parse_cell(code)
+            if info.ignore:
+                continue
+
+            if info.end is not None:
+                function_buffer(info.end).end()
+
+            if info.start is not None:
+                function_buffer(info.start).start()
+
+            # magics change the config (and context), applied every export
+            if info.magic:
+                code = self.handle_cell_magic(config, info.magic, ctx)
+            elif info.line_items is not None:
+                code = self.handle_line_magic(config, info.line_items, ctx)
+
+            codes.append(code)
+            for buf in buffers.values():
+                buf.append(code)
+
+        apply_env_lines(ctx, config)
+        process_env_files(ctx, config)
+
+        archive_settings = ctx.archive_settings
+        if archive_settings:
+            if archive_settings['notebook'] and nbname:
+                archive_settings['files'] += [nbname + '.ipynb']
+            efiles = ','.join(archive_settings['files'])
+            config['metadata']['annotations'][meta_keys.extra_files] = efiles
+
+        return config, buffers
+
     def write_code_cells(self, codes):
         io = StringIO()
         print(header(), file=io)
         for code in codes:
-            code = filter_comments(code)
-            if not code.strip():
-                continue
-
-            lines = code.splitlines()
-            self.handle_code_cell(lines, io)
+            py_code = convert_cell(code)
+            if py_code is not None:
+                print(py_code, file=io)
         return io
 
-    def find_cell_magic(self, lines):
-        """Return index of first line that has %%nuclio"""
-        for i, line in enumerate(lines):
-            if cell_magic in line:
-                return i
-        return -1
-
-    def handle_cell_magic(self, config, lines):
-        i = self.find_cell_magic(lines)
-        if i == -1:
-            raise MagicError('cannot find {}'.format(cell_magic))
-
-        lines = lines[i:]
-        name, args = parse_magic_line(lines[0])
-        magic = Magic(name, args, lines[1:], is_cell=True)
+    def handle_cell_magic(self, config, magic, ctx):
         handler = magic_handlers.get(magic.name)
         if not handler:
             if magic.name not in magic_module.commands:
@@ -242,52 +321,176 @@ class NuclioExporter(Exporter):
                 log.warning('skipping %s - not implemented', magic.name)
                 code = ''
         else:
-            code = handler(magic, config)
+            if handler is not env:
+                apply_env_lines(ctx, config)
+            code = handler(magic, config, ctx)
 
         return code
 
-    def handle_code_cell(self, lines, io):
+    def handle_line_magic(self, config, items, ctx):
+        """Apply line magics, items are code lines and Magic (parse_cell)"""
         buf = []
-        for line in lines:
-            if is_comment(line):
+        for item in items:
+            if not isinstance(item, Magic):
+                buf.append(item)
                 continue
 
-            if line_magic in line:
-                continue
+            handler = magic_handlers.get(item.name)
+            if not handler:
+                raise NameError(
+                    'unknown nuclio command: {}'.format(item.name))
 
-            # ignore commands or any magic commands (other than %nuclio)
-            if line.startswith('!') or line.startswith('%'):
-                continue
+            if handler is not env:
+                apply_env_lines(ctx, config)
+            out = handler(item, config, ctx)
+            if out:
+                buf.append(out)
 
-            buf.append(line)
+        return '\n'.join(buf)
 
-        if buf:
-            print(ipython2python('\n'.join(buf)), file=io)
 
-    def handle_line_magic(self, config, lines):
-        buf = []
-        for line in lines:
+CellInfo = namedtuple('CellInfo', 'ignore start end magic line_items')
+
+
+@lru_cache(maxsize=cell_cache_size)
+def parse_cell(code):
+    """Parse cell annotations and %nuclio magics, memoized by cell source
+
+    magic is the %%nuclio cell Magic, line_items the code lines and Magic
+    of %nuclio line magics (None if there are none)
+    """
+    ignore, start, end = cell_annotations(code)
+    if ignore:
+        return CellInfo(True, None, None, None, None)
+
+    magic = line_items = None
+    if cell_magic in code:
+        lines = code.splitlines()
+        i = find_cell_magic(lines)
+        name, args = parse_magic_line(lines[i])
+        magic = Magic(name, args, lines[i + 1:], is_cell=True)
+
+    # must be else (cell_magic token contains line_magic)
+    elif line_magic in code:
+        line_items = []
+        for line in code.splitlines():
             if is_comment(line):
                 continue
 
             if line_magic not in line:
                 # ignore commands or any magic commands (other than %nuclio)
                 if not (line.startswith('!') or line.startswith('%')):
-                    buf.append(line)
+                    line_items.append(line)
                 continue
 
             name, args = parse_magic_line(line)
-            magic = Magic(name, args, [], is_cell=False)
-            handler = magic_handlers.get(magic.name)
-            if not handler:
-                raise NameError(
-                    'unknown nuclio command: {}'.format(magic.name))
+            line_items.append(Magic(name, args, [], is_cell=False))
+        line_items = tuple(line_items)
 
-            out = handler(magic, config)
-            if out:
-                buf.append(out)
+    return CellInfo(False, start, end, magic, line_items)
 
-        return '\n'.join(buf)
+
+def find_cell_magic(lines):
+    """Return index of first line that has %%nuclio"""
+    for i, line in enumerate(lines):
+        if cell_magic in line:
+            return i
+    return -1
+
+
+def ipython_transformer():
+    global _transformer
+    if _transformer is None:
+        from IPython.core.inputtransformer2 import TransformerManager
+        _transformer = TransformerManager()
+    return _transformer
+
+
+@lru_cache(maxsize=cell_cache_size)
+def convert_cell(code):
+    """Return the python code of a cell (None if no code), memoized
+
+    Drops comments, magics and shell escapes and runs the IPython transforms
+    (like nbconvert ipython2python) with a shared TransformerManager, cells
+    without IPython syntax skip the (tokenizing) token transforms. Results
+    are memoized by cell source, so re-exports (and functions sharing cells)
+    only convert changed cells.
+    """
+    lines = code_lines(code)
+    if not lines:
+        return None
+
+    code = '\n'.join(lines)
+    manager = ipython_transformer()
+    if has_ipython_syntax(code):
+        return manager.transform_cell(code)
+
+    # TransformerManager.transform_cell without the token transforms
+    if not code.endswith('\n'):
+        code += '\n'
+    lines = code.splitlines(keepends=True)
+    for transform in manager.cleanup_transforms + manager.line_transforms:
+        lines = transform(lines)
+    return ''.join(lines)
+
+
+def cell_annotations(code):
+    """Return ignore, start and end (function names, None if missing)
+
+    first start-code/end-code annotations are used, single scan of the cell
+    """
+    start = end = None
+    for match in find_annotations(code):
+        kind = match.group('kind')
+        if kind == 'ignore':
+            return True, None, None
+        if kind == 'start-code':
+            if start is None:
+                start = match.group('name')
+        elif end is None:
+            end = match.group('name')
+    return False, start, end
+
+
+def code_lines(code):
+    """Return the cell lines to export, [] if there's no code
+
+    comments, %nuclio magics, other magics and shell escapes are dropped,
+    the lines are classified in one pass
+    """
+    if not has_special(code):
+        lines = code.splitlines() if code.strip() else []
+        if lines and not lines[-1]:
+            lines.pop()
+        return lines
+
+    lines = []
+    has_code = False
+    ends_empty = False  # last non comment line is empty
+    for line in code.splitlines():
+        match = match_line(line)
+        if match is None:
+            lines.append(line)
+            has_code = has_code or bool(line.strip())
+            ends_empty = not line
+        elif match.lastgroup == 'drop':
+            has_code = True
+            ends_empty = False
+
+    if not has_code:
+        return []
+    # same as joining the non comment lines and splitting them again
+    if ends_empty:
+        lines.pop()
+    return lines
+
+
+def check_buffers(buffers, names):
+    """Raise MagicError on bad annotations in one of the named functions"""
+    for name in names:
+        buf = buffers.get(name)
+        if buf and buf.error:
+            raise MagicError(buf.error)
 
 
 def header():
@@ -300,7 +503,7 @@ def exporter_name():
 
 
 def gen_config(config):
-    return header() + yaml.dump(config, default_flow_style=False)
+    return header() + yaml_dump(config)
 
 
 def parse_magic_line(line):
@@ -328,7 +531,7 @@ def magic_handler(fn):
 
 
 @magic_handler
-def env(magic, config):
+def env(magic, config, ctx):
     argline = magic.args.strip()
     if argline.startswith('--local-only') or argline.startswith('-l'):
         return ''
@@ -338,12 +541,21 @@ def env(magic, config):
     if argline.startswith('-c'):
         argline = argline.replace('-c', '').strip()
 
-    set_env(config, [argline] + magic.lines)
+    # applied in one batch (apply_env_lines), each call scans the env
+    ctx.env_lines.append(argline)
+    ctx.env_lines.extend(magic.lines)
     return ''
 
 
+def apply_env_lines(ctx, config):
+    """Set the pending %nuclio env lines in config"""
+    if ctx.env_lines:
+        set_env(config, ctx.env_lines)
+        ctx.env_lines = []
+
+
 @magic_handler
-def cmd(magic, config):
+def cmd(magic, config, ctx):
     argline = magic.args.strip()
     if argline.startswith('--config-only'):
         argline = argline.replace('--config-only', '').strip()
@@ -354,7 +566,7 @@ def cmd(magic, config):
 
 
 @magic_handler
-def env_file(magic, config):
+def env_file(magic, config, ctx):
     for line in [magic.args] + magic.lines:
         file_name = line.strip()
         if file_name[:1] in ('', '#'):
@@ -363,14 +575,13 @@ def env_file(magic, config):
         if not path.isfile(file_name):
             log.warning('skipping %s - not found', file_name)
             continue
-        env_files.add(file_name)
+        ctx.add_env_file(file_name)
     return ''
 
 
-def process_env_files(env_files, config):
-    # %nuclio env_file magic will populate this
-    from_env = json.loads(environ.get(env_keys.env_files, '[]'))
-    for fname in (env_files | set(from_env)):
+def process_env_files(ctx, config):
+    # %nuclio env_file magic (or NUCLIO_ENV_FILES) will populate this
+    for fname in ctx.env_files:
         with open(fname) as fp:
             set_env(config, iter_env_lines(fp))
 
@@ -395,9 +606,9 @@ def add_return(line):
 
 
 @magic_handler
-def handler(magic, config):
-    name = magic.args if magic.args else next_handler_name()
-    if env_keys.handler_name not in environ:
+def handler(magic, config, ctx):
+    name = magic.args if magic.args else ctx.next_handler_name()
+    if not ctx.handler_name:
         module, _ = config['spec']['handler'].split(':')
         config['spec']['handler'] = '{}:{}'.format(module, name)
 
@@ -426,27 +637,27 @@ def handler_code(name, code):
 
 
 @magic_handler
-def build(magic, config):
+def build(magic, config, ctx):
     return ''
 
 
 @magic_handler
-def deploy(magic, config):
+def deploy(magic, config, ctx):
     return ''
 
 
 @magic_handler
-def help(magic, config):
+def help(magic, config, ctx):
     return ''
 
 
 @magic_handler
-def show(magic, config):
+def show(magic, config, ctx):
     return ''
 
 
 @magic_handler
-def mount(magic, config):
+def mount(magic, config, ctx):
     args, rest = parse_mount_line(magic.args)
     if len(rest) != 2:
         raise MagicError(
@@ -459,8 +670,7 @@ def mount(magic, config):
 
 
 @magic_handler
-def add(magic, config):
-    global archive_settings
+def add(magic, config, ctx):
     args, rest = parse_archive_line(magic.args)
 
     files = args.file + magic.lines
@@ -469,12 +679,12 @@ def add(magic, config):
         if not path.isfile(filename):
             raise MagicError('file {} doesnt exist'.format(filename))
 
-    archive_settings = {'files': files, 'notebook': args.add_notebook}
+    ctx.archive_settings = {'files': files, 'notebook': args.add_notebook}
     return ''
 
 
 @magic_handler
-def config(magic, config):
+def config(magic, config, ctx):
     for line in [magic.args] + magic.lines:
         line = line.strip()
         if not line or line[0] == '#':
@@ -486,15 +696,6 @@ def config(magic, config):
     return ''
 
 
-def next_handler_name():
-    if handlers:
-        name = 'handler_{}'.format(len(handlers))
-    else:
-        name = 'handler'
-    handlers.append(name)
-    return name
-
-
 def module_name(py_file):
     """
     >>> module_name('/path/to/handler.py')
@@ -505,14 +706,14 @@ def module_name(py_file):
     return module
 
 
-def handler_name():
-    handler_path = environ.get(env_keys.handler_path)
-    if handler_path:
-        module = module_name(handler_path)
+def handler_name(ctx=None):
+    ctx = ctx or ExportContext.from_env()
+    if ctx.handler_path:
+        module = module_name(ctx.handler_path)
     else:
         module = 'handler'
 
-    name = environ.get(env_keys.handler_name, 'handler')
+    name = ctx.handler_name or 'handler'
     return '{}:{}'.format(module, name)
 
 
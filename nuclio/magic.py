@@ -27,7 +27,7 @@ from .config import ConfigSpec, v3ioenv_magic
 from .deploy import populate_parser as populate_deploy_parser, deploy_from_args
 from .utils import (env_keys, iter_env_lines, parse_config_line, DeployError,
                     parse_env, parse_export_line, parse_mount_line,
-                    notebook_file_name, list2dict, BuildError)
+                    notebook_file_name, list2dict, BuildError, yaml_dump)
 from .archive import parse_archive_line
 from .build import build_file
 
@@ -270,6 +270,10 @@ def deploy(line, cell):
         add/override environment variable, can be repeated
     -v, --verbose
         emit more logs
+    --if-changed
+        skip the deploy if the function is ready and its spec/code didnt change
+    --timeout seconds
+        max time to wait for the function to be ready (default no limit)
 
     when deploying a function which contains extra files or if we want to
     archive/version functions we specify output-dir with archiving option (-a)
@@ -370,6 +374,8 @@ def build(line, cell, return_dir=False):
         add/override environment variable, can be repeated
     -v, --verbose
         emit more logs
+    --no-cache
+        dont use the build cache (rebuild even if the code didnt change)
 
     supported output options:
         format:  [scheme://[username:secret@]path/to/dir/[name[.zip|yaml]]
@@ -408,7 +414,7 @@ def build(line, cell, return_dir=False):
                                     spec=spec, output_dir=output, tag=args.tag,
                                     archive=args.archive, project=args.project,
                                     verbose=args.verbose,
-                                    kind=args.kind)
+                                    kind=args.kind, cache=not args.no_cache)
 
     log('notebook {} exported'.format(name))
     return config, code
@@ -467,7 +473,7 @@ def print_handler_code(notebook_file=None):
 
     line = notebook_file = shlex.quote(notebook_file)
     config, code = build(line, None, return_dir=True)
-    config_yaml = yaml.dump(config, default_flow_style=False)
+    config_yaml = yaml_dump(config)
     print('Config:\n{}'.format(config_yaml))
     print('Code:\n{}'.format(code))
 
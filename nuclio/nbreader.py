@@ -0,0 +1,182 @@
+# Copyright 2018 Iguazio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Streaming notebook (.ipynb) reader that skips cell outputs
+
+Exports only need the cells source (and metadata), the reader scans the
+notebook JSON (mmap) and skips "outputs" and "attachments" values without
+decoding them, so embedded plots and dataframes are never materialized.
+"""
+import json
+import mmap
+import re
+
+skipped_keys = {'outputs', 'attachments'}
+backslash = ord('\\')
+
+whitespace = re.compile(rb'[ \t\n\r]*').match
+bracket = re.compile(rb'["\[\]{}]').search
+scalar_end = re.compile(rb'[^,\]}\s]*').match
+
+
+def read_notebook(nb_file):
+    """Read notebook, return dict with cells (without outputs) and metadata
+
+    code cells have empty "outputs", list sources are joined (like
+    nbformat). Notebooks older than v4 (or invalid JSON) are read with
+    nbformat.
+    """
+    nb = None
+    with open(nb_file, 'rb') as fp:
+        try:
+            buf = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file
+            buf = None
+        if buf is not None:
+            try:
+                nb = parse_notebook(buf)
+            except ValueError:
+                nb = None
+            finally:
+                buf.close()
+
+    if nb is None or nb.get('nbformat', 0) < 4 or 'cells' not in nb:
+        import nbformat
+        with open(nb_file, encoding='utf-8') as fp:
+            return nbformat.read(fp, as_version=4)
+    return nb
+
+
+def parse_notebook(buf):
+    nb = {}
+    key, pos = next_key(buf, open_object(buf, 0), first=True)
+    while key is not None:
+        if key == 'cells':
+            nb['cells'], pos = parse_cells(buf, pos)
+        else:
+            nb[key], pos = parse_value(buf, pos)
+        key, pos = next_key(buf, pos)
+    return nb
+
+
+def parse_cells(buf, pos):
+    pos = expect(buf, pos, b'[')
+    cells = []
+    while True:
+        pos = skip_ws(buf, pos)
+        if buf[pos:pos + 1] == b']':
+            return cells, pos + 1
+        cell, pos = parse_cell(buf, pos)
+        cells.append(cell)
+        pos = skip_ws(buf, pos)
+        if buf[pos:pos + 1] == b',':
+            pos += 1
+
+
+def parse_cell(buf, pos):
+    cell = {}
+    key, pos = next_key(buf, open_object(buf, pos), first=True)
+    while key is not None:
+        if key in skipped_keys:
+            pos = skip_value(buf, pos)
+        else:
+            value, pos = parse_value(buf, pos)
+            if key == 'source' and isinstance(value, list):
+                value = ''.join(value)
+            cell[key] = value
+        key, pos = next_key(buf, pos)
+
+    if cell.get('cell_type') == 'code':
+        cell['outputs'] = []
+    return cell, pos
+
+
+def open_object(buf, pos):
+    return expect(buf, skip_ws(buf, pos), b'{')
+
+
+def next_key(buf, pos, first=False):
+    """Return (key, value position) or (None, position after '}')
+
+    pos is after the previous value (or after '{' for the first key)
+    """
+    pos = skip_ws(buf, pos)
+    char = buf[pos:pos + 1]
+    if char == b'}':
+        return None, pos + 1
+    if not first:
+        pos = skip_ws(buf, expect(buf, pos, b','))
+    end = skip_string(buf, pos)
+    key = json.loads(buf[pos:end])
+    pos = expect(buf, skip_ws(buf, end), b':')
+    return key, skip_ws(buf, pos)
+
+
+def parse_value(buf, pos):
+    end = skip_value(buf, pos)
+    return json.loads(buf[pos:end]), end
+
+
+def skip_value(buf, pos):
+    """Return the end position of the JSON value at pos (not decoded)"""
+    pos = skip_ws(buf, pos)
+    char = buf[pos:pos + 1]
+    if char == b'"':
+        return skip_string(buf, pos)
+    if char not in (b'[', b'{'):
+        end = scalar_end(buf, pos).end()
+        if end == pos:
+            raise ValueError('bad JSON value at {}'.format(pos))
+        return end
+
+    depth = 0
+    while True:
+        match = bracket(buf, pos)
+        if not match:
+            raise ValueError('unterminated JSON value')
+        pos = match.end()
+        char = match.group()
+        if char == b'"':
+            pos = skip_string(buf, pos - 1)
+        elif char in (b'[', b'{'):
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                return pos
+
+
+def skip_string(buf, pos):
+    if buf[pos:pos + 1] != b'"':
+        raise ValueError('expected string at {}'.format(pos))
+    end = pos + 1
+    while True:
+        end = buf.find(b'"', end)  # memchr, much faster than a regex
+        if end == -1:
+            raise ValueError('unterminated string at {}'.format(pos))
+        escape = end
+        while buf[escape - 1] == backslash:
+            escape -= 1
+        if (end - escape) % 2 == 0:  # not an escaped quote
+            return end + 1
+        end += 1
+
+
+def skip_ws(buf, pos):
+    return whitespace(buf, pos).end()
+
+
+def expect(buf, pos, char):
+    if buf[pos:pos + 1] != char:
+        raise ValueError('expected {!r} at {}'.format(char, pos))
+    return pos + 1
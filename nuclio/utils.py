@@ -19,10 +19,16 @@ import shlex
 from argparse import ArgumentParser
 from sys import stdout
 
-import ipykernel
+import yaml
 from urllib.parse import urlencode, urljoin
 from urllib.request import urlopen
 
+# libyaml (C) dumper/loader when available, same output format
+try:
+    from yaml import CSafeDumper as SafeDumper, CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeDumper, SafeLoader
+
 
 def create_logger():
     handler = logging.StreamHandler(stdout)
@@ -39,6 +45,33 @@ def create_logger():
 logger = create_logger()
 
 
+def yaml_dump(obj):
+    """Dump config to YAML (block style), uses libyaml if installed"""
+    try:
+        return yaml.dump(obj, Dumper=SafeDumper, default_flow_style=False)
+    except yaml.representer.RepresenterError:
+        # not plain data (e.g. objects), use the full python dumper
+        return yaml.dump(obj, default_flow_style=False)
+
+
+def yaml_load(data):
+    """Safe load YAML, uses libyaml if installed"""
+    return yaml.load(data, Loader=SafeLoader)
+
+
+class LazyYaml:
+    """Render obj as YAML only when formatted, for log arguments e.g.
+
+    logger.debug('Config:\\n%s', LazyYaml(config))
+    """
+
+    def __init__(self, obj):
+        self.obj = obj
+
+    def __str__(self):
+        return yaml_dump(self.obj)
+
+
 class DeployError(Exception):
     pass
 
@@ -55,6 +88,14 @@ class env_keys:
     env_files = 'NUCLIO_ENV_FILES'
     default_archive = 'NUCLIO_ARCHIVE_PATH'
     function_name = 'NUCLIO_FUNCTION_NAME'
+    isolated_build = 'NUCLIO_ISOLATED_BUILD'
+    cache_dir = 'NUCLIO_CACHE_DIR'
+    build_cache_size = 'NUCLIO_BUILD_CACHE_SIZE'
+    cell_cache_size = 'NUCLIO_CELL_CACHE_SIZE'
+    source_cache_size = 'NUCLIO_SOURCE_CACHE_SIZE'
+    archive_compression = 'NUCLIO_ARCHIVE_COMPRESSION'
+    upload_part_size = 'NUCLIO_UPLOAD_PART_SIZE'
+    upload_workers = 'NUCLIO_UPLOAD_WORKERS'
 
 
 def list2dict(lines: list):
@@ -116,6 +157,7 @@ def parse_export_line(args):
     parser.add_argument('--archive', '-a', action='store_true', default=False)
     parser.add_argument('--verbose', '-v', action='store_true', default=False)
     parser.add_argument('--kind', default=None)
+    parser.add_argument('--no-cache', action='store_true', default=False)
 
     if isinstance(args, str):
         args = path.expandvars(args)
@@ -168,6 +210,7 @@ def notebook_file_name(ikernel):
     # the following code won't work when the notebook is being executed
     # through running `jupyter nbconvert --execute` this env var enables to
     # overcome it
+    import ipykernel
     from notebook.notebookapp import list_running_servers
 
     file_name = environ.get('JUPYTER_NOTEBOOK_FILE_NAME')
@@ -14,23 +14,20 @@
 
 
 from contextlib import contextmanager
+from http.server import ThreadingHTTPServer
 from os import environ
 from os.path import abspath, dirname
+from tempfile import mkdtemp
+from threading import Thread
 
-import pytest
-
-import nuclio
+import nuclio  # noqa
 
 here = dirname(abspath(__file__))
 environ['ENV_FILE'] = '{}/env.txt'.format(here)
+environ['NUCLIO_CACHE_DIR'] = mkdtemp(prefix='nuclio-jupyter-cache-')
 is_travis = 'TRAVIS' in environ
 
 
-@pytest.fixture
-def clean_handlers():
-    nuclio.export.handlers.clear()
-
-
 @contextmanager
 def patch(obj, **kw):
     old, new = {}, []
@@ -47,3 +44,16 @@ def patch(obj, **kw):
         obj.__dict__.update(old)
         for attr in new:
             delattr(obj, attr)
+
+
+@contextmanager
+def http_server(handler_class):
+    """Run a local HTTP server in a thread, yield its URL"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler_class)
+    thread = Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield 'http://127.0.0.1:{}'.format(server.server_address[1])
+    finally:
+        server.shutdown()
+        server.server_close()
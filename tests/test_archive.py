@@ -0,0 +1,611 @@
+# Copyright 2018 Iguazio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import zipfile
+from http.server import BaseHTTPRequestHandler
+from io import BytesIO
+from hashlib import sha256
+from types import SimpleNamespace
+from os import path, urandom
+from tempfile import mkdtemp
+
+import pytest
+
+from conftest import http_server, patch, here
+from nuclio import archive
+from nuclio.archive import (build_zip, upload_zip, upload_file, url2repo,
+                            source_cache, register_repo, MemoryRepo,
+                            ExternalRepo, get_archive_config, arc_name,
+                            ArchiveReader, load_zip_config)
+from nuclio.build import build_file
+
+
+def new_config():
+    return {'metadata': {'name': 'f1'}, 'spec': {'build': {}}}
+
+
+def data_files(count=3):
+    tmp_dir = mkdtemp(prefix='nuclio-jupyter-archive-')
+    files = []
+    for i in range(count):
+        file_path = path.join(tmp_dir, 'data-{}.txt'.format(i))
+        with open(file_path, 'wb') as fp:
+            fp.write(b'%d hello nuclio\n' % i * 1000)
+        files.append(file_path)
+    return files
+
+
+def zip_bytes(files, **kw):
+    out = BytesIO()
+    build_zip(out, new_config(), 'print(1)', files, **kw)
+    return out.getvalue()
+
+
+@pytest.mark.parametrize('compression', ['store', 'deflate', 'bzip2', 'lzma'])
+def test_build_zip_compression(compression):
+    files = data_files()
+    data = zip_bytes(files, compression=compression)
+    with zipfile.ZipFile(BytesIO(data)) as z:
+        infos = z.infolist()
+        names = [info.filename for info in infos]
+        assert names[:2] == ['handler.py', 'function.yaml'], 'bad members'
+        assert len(names) == len(files) + 2, 'missing files'
+        for info, file_path in zip(infos[2:], files):
+            with open(file_path, 'rb') as fp:
+                assert z.read(info) == fp.read(), 'bad file data'
+            if compression != 'store':
+                assert info.compress_size < info.file_size, 'not compressed'
+
+
+def test_build_zip_deterministic():
+    files = data_files()
+    data = zip_bytes(files, deterministic=True, compression='deflate:9')
+    assert data == zip_bytes(files[::-1], deterministic=True,
+                             compression='deflate:9'), 'not reproducible'
+    with zipfile.ZipFile(BytesIO(data)) as z:
+        assert {info.date_time[0] for info in z.infolist()} == {1980}
+
+    with pytest.raises(ValueError):
+        zip_bytes(files, compression='rar')
+
+
+class Store(BaseHTTPRequestHandler):
+    """Stand-in v3io object store (supports Range writes)"""
+    data = {}
+    puts = []
+    fail_offsets = set()
+    fail_status = None  # status of the next PUT (once)
+    truncate = False  # store only half of .zip bodies
+
+    def do_PUT(self):
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            body = b''
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                chunk = self.rfile.read(size + 2)  # data + \r\n
+                if size == 0:
+                    break
+                body += chunk[:-2]
+        else:
+            body = self.rfile.read(int(self.headers['Content-Length']))
+
+        offset = 0
+        if self.headers.get('Range'):
+            offset = int(self.headers['Range'][len('bytes='):].split('-')[0])
+        Store.puts.append(offset)
+        status, Store.fail_status = Store.fail_status, None
+        if offset in Store.fail_offsets or status:
+            self.send_response(status or 400)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if Store.truncate and self.path.endswith('.zip'):
+            body = body[:len(body) // 2]
+
+        if self.headers.get('Range'):
+            obj = Store.data.setdefault(self.path, bytearray())
+            if len(obj) < offset:
+                obj.extend(b'\0' * (offset - len(obj)))
+            obj[offset:offset + len(body)] = body
+        else:
+            Store.data[self.path] = bytearray(body)
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_HEAD(self, body=False):
+        obj = Store.data.get(self.path)
+        self.send_response(404 if obj is None else 200)
+        self.send_header('Content-Length', str(len(obj or b'')))
+        self.end_headers()
+        if body and obj:
+            self.wfile.write(obj)
+
+    def do_GET(self):
+        self.do_HEAD(body=True)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_upload_zip():
+    files = data_files()
+    with http_server(Store) as url:
+        target = url.replace('http://', 'v3io://') + '/proj/f1.zip'
+        upload_zip(target, new_config(), 'print(1)', files,
+                   deterministic=True)
+    with zipfile.ZipFile(BytesIO(Store.data['/proj/f1.zip'])) as z:
+        assert z.testzip() is None, 'bad archive'
+        assert len(z.namelist()) == len(files) + 2, 'missing files'
+        with open(files[0], 'rb') as fp:
+            assert z.read(files[0].lstrip('/')) == fp.read(), 'bad upload'
+
+    zip_path = path.join(mkdtemp(prefix='nuclio-jupyter-archive-'), 'f1.zip')
+    upload_zip(zip_path, new_config(), 'print(1)', files)
+    with zipfile.ZipFile(zip_path) as z:
+        assert len(z.namelist()) == len(files) + 2, 'bad archive'
+
+
+def test_upload_zip_failed():
+    files = data_files()
+    manifest = '/proj/f2.zip.manifest.json'
+    with http_server(Store) as url:
+        target = url.replace('http://', 'v3io://') + '/proj/f2.zip'
+        # a streamed body is not re-sent (as empty) on retry
+        Store.fail_status = 503
+        with pytest.raises(OSError):
+            url2repo(target).upload_stream(BytesIO(b'data'))
+        assert '/proj/f2.zip' not in Store.data, 'empty body sent'
+
+        # small archives are streamed, not spooled
+        with patch(archive, upload_archive=None):
+            assert upload_zip(target, new_config(), 'print(1)', files)
+        assert Store.data.get(manifest), 'no manifest'
+        Store.truncate = True
+        try:
+            with pytest.raises(OSError):
+                upload_zip(target, new_config(), 'print(2)', files)
+        finally:
+            Store.truncate = False
+        assert Store.data[manifest] == b'{}', 'manifest of failed upload'
+        # a failed upload is retried (even if the code was reverted)
+        assert upload_zip(target, new_config(), 'print(1)', files)
+
+
+part_size = 1000
+
+
+def big_file(size=part_size * 10 + 123):
+    file_path = path.join(mkdtemp(prefix='nuclio-jupyter-archive-'), 'model')
+    with open(file_path, 'wb') as fp:
+        fp.write(urandom(size))
+    return file_path
+
+
+def test_upload_v3io_resume():
+    file_path = big_file()
+    with open(file_path, 'rb') as fp:
+        data = fp.read()
+    Store.puts = []
+    Store.fail_offsets = {part_size * 3, part_size * 7}
+    with patch(archive, min_part_size=part_size), http_server(Store) as url:
+        target = url.replace('http://', 'v3io://') + '/proj/model'
+        with pytest.raises(OSError):
+            upload_file(file_path, target, part_size=part_size, workers=3)
+        assert len(Store.puts) == 12, 'not all parts sent'
+
+        Store.puts = []
+        Store.fail_offsets = set()
+        upload_file(file_path, target, part_size=part_size, workers=3)
+
+    assert sorted(Store.puts) == [part_size * 3, part_size * 7], \
+        'upload not resumed'
+    assert bytes(Store.data['/proj/model']) == data, 'bad upload'
+
+
+class FakeS3:
+    """Stand-in S3 client (multipart API)"""
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+        self.fail_parts = set()
+        self.calls = []
+
+    def put_object(self, Bucket, Key, Body):
+        self.calls.append('put')
+        self.objects[(Bucket, Key)] = Body.read()
+
+    def create_multipart_upload(self, Bucket, Key):
+        upload_id = 'upload-{}'.format(len(self.uploads))
+        self.uploads[upload_id] = {}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.calls.append(PartNumber)
+        if UploadId not in self.uploads:
+            from botocore.exceptions import ClientError
+            raise ClientError({'Error': {'Code': 'NoSuchUpload'}},
+                              'UploadPart')
+        if PartNumber in self.fail_parts:
+            raise OSError('connection reset')
+        self.uploads[UploadId][PartNumber] = Body
+        return {'ETag': 'etag-{}'.format(PartNumber)}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId,
+                                  MultipartUpload):
+        parts = MultipartUpload['Parts']
+        assert [part['PartNumber'] for part in parts] == \
+            list(range(1, len(parts) + 1)), 'bad parts'
+        data = self.uploads.pop(UploadId)
+        self.objects[(Bucket, Key)] = b''.join(
+            data[part['PartNumber']] for part in parts)
+
+
+def test_upload_s3_resume():
+    file_path = big_file()
+    with open(file_path, 'rb') as fp:
+        data = fp.read()
+    fake = FakeS3()
+    fake.fail_parts = {2, 5}
+    repo = url2repo('s3://bucket/proj/model')
+    repo.s3 = SimpleNamespace(meta=SimpleNamespace(client=fake))
+
+    with patch(archive, min_part_size=part_size):
+        with pytest.raises(OSError):
+            repo.upload(file_path, part_size=part_size, workers=3)
+        fake.fail_parts, fake.calls = set(), []
+        repo.upload(file_path, part_size=part_size, workers=3)
+
+    assert sorted(fake.calls) == [2, 5], 'upload not resumed'
+    assert len(fake.uploads) == 0, 'upload not completed'
+    assert fake.objects[('bucket', 'proj/model')] == data, 'bad upload'
+
+    small_file = big_file(100)
+    repo.upload(small_file)
+    assert fake.calls[-1] == 'put', 'small file not uploaded in one put'
+
+
+def test_upload_s3_expired():
+    pytest.importorskip('botocore')
+    file_path = big_file()
+    fake = FakeS3()
+    fake.fail_parts = {2}
+    repo = url2repo('s3://bucket/proj/expired')
+    repo.s3 = SimpleNamespace(meta=SimpleNamespace(client=fake))
+
+    with patch(archive, min_part_size=part_size):
+        with pytest.raises(OSError):
+            repo.upload(file_path, part_size=part_size, workers=3)
+        # the saved upload id was aborted/expired on the server
+        fake.uploads.clear()
+        fake.fail_parts, fake.calls = set(), []
+        repo.upload(file_path, part_size=part_size, workers=3)
+
+    assert len(fake.calls) > 11, 'expired upload not restarted'
+    with open(file_path, 'rb') as fp:
+        assert fake.objects[('bucket', 'proj/expired')] == fp.read(), \
+            'bad upload'
+
+
+def test_upload_zip_parts():
+    files = [big_file(part_size * 3), big_file(part_size * 2)]
+    with patch(archive, min_part_size=part_size,
+               default_part_size=part_size), http_server(Store) as url:
+        target = url.replace('http://', 'v3io://') + '/proj/f3.zip'
+        Store.fail_offsets = {part_size * 2}
+        # only the spool file of the newest archive of a target is kept
+        for code in ('print(0)', 'print(1)'):
+            Store.puts = []
+            with pytest.raises(OSError):
+                upload_zip(target, new_config(), code, files)
+        assert '/proj/f3.zip.manifest.json' not in Store.data, \
+            'manifest of failed upload'
+        assert len(Store.puts) > 3, 'not uploaded in parts'
+        url_key = sha256(target.encode('utf-8')).hexdigest()
+        spools = [name for name in os.listdir(archive.archive_spool.root)
+                  if name.startswith(url_key)]
+        assert len(spools) == 1, 'old spool files kept'
+
+        Store.puts = []
+        Store.fail_offsets = set()
+        assert upload_zip(target, new_config(), 'print(1)', files)
+    # the failed part and the manifest
+    assert Store.puts == [part_size * 2, 0], 'upload not resumed'
+    with zipfile.ZipFile(BytesIO(Store.data['/proj/f3.zip'])) as z:
+        assert z.testzip() is None, 'bad archive'
+
+
+class Source(BaseHTTPRequestHandler):
+    """HTTP server with Range support"""
+    protocol_version = 'HTTP/1.1'
+    data = b''
+    ranges = []
+    sent = 0
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(self.data)))
+        self.end_headers()
+
+    def do_GET(self):
+        start, end = 0, len(self.data) - 1
+        header = self.headers.get('Range')
+        Source.ranges.append(header)
+        if header:
+            start, end = header[len('bytes='):].split('-')
+            start, end = int(start), int(end or len(self.data) - 1)
+            if start >= len(self.data):
+                self.send_response(416)
+                self.send_header('Content-Range',
+                                 'bytes */{}'.format(len(self.data)))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                start, end, len(self.data)))
+        else:
+            self.send_response(200)
+        body = self.data[start:end + 1]
+        Source.sent += len(body)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_download():
+    Source.data = urandom(3 * 1024 ** 2 + 17)
+    target = path.join(mkdtemp(prefix='nuclio-jupyter-archive-'), 'data')
+    calls = []
+    with patch(source_cache, max_size=0), http_server(Source) as url:
+        repo = url2repo(url + '/data.bin')
+        repo.download(target, progress=lambda *args: calls.append(args))
+        with open(target, 'rb') as fp:
+            assert fp.read() == Source.data, 'bad download'
+        assert len(calls) > 1, 'not chunked'
+        assert calls[-1] == (len(Source.data), len(Source.data))
+
+        # resume a partial download
+        with open(target, 'wb') as fp:
+            fp.write(Source.data[:1000])
+        Source.ranges = []
+        repo.download(target, resume=True)
+        assert Source.ranges == ['bytes=1000-'], 'not resumed'
+        with open(target, 'rb') as fp:
+            assert fp.read() == Source.data, 'bad resumed download'
+
+        # already complete
+        repo.download(target, resume=True)
+        with open(target, 'rb') as fp:
+            assert fp.read() == Source.data, 'bad complete download'
+
+    copy = target + '.copy'
+    url2repo(target).download(copy)
+    with open(copy, 'rb') as fp:
+        assert fp.read() == Source.data, 'bad file download'
+
+
+class Versioned(BaseHTTPRequestHandler):
+    """HTTP server with ETag validation"""
+    protocol_version = 'HTTP/1.1'
+    data = b''
+    statuses = []
+
+    def do_GET(self):
+        etag = '"{}"'.format(hash(self.data))
+        if self.headers.get('If-None-Match') == etag:
+            Versioned.statuses.append(304)
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        Versioned.statuses.append(200)
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(self.data)))
+        self.end_headers()
+        self.wfile.write(self.data)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_source_cache():
+    source_cache.clear()
+    Versioned.data, Versioned.statuses = b'print("v1")\n', []
+    target = path.join(mkdtemp(prefix='nuclio-jupyter-archive-'), 'code.py')
+    with http_server(Versioned) as url:
+        url += '/code.py'
+        assert url2repo(url).get() == 'print("v1")\n', 'bad get'
+        assert url2repo(url).get() == 'print("v1")\n', 'bad cached get'
+        url2repo(url).download(target)
+        with open(target, 'rb') as fp:
+            assert fp.read() == Versioned.data, 'bad cached download'
+        assert Versioned.statuses == [200, 304, 304], 'not validated'
+
+        Versioned.data = b'print("v2")\n'
+        assert url2repo(url).get() == 'print("v2")\n', 'stale cache'
+        assert Versioned.statuses[-1] == 200, 'changed source not fetched'
+
+        with patch(source_cache, max_size=0):
+            url2repo(url).get()
+        assert Versioned.statuses[-1] == 200, 'cache not disabled'
+
+
+def test_memory_repo():
+    repo = url2repo('memory://bucket/dir/obj.txt')
+    repo.put('hello')
+    assert url2repo('memory://bucket/dir/obj.txt').get() == 'hello'
+
+    files = data_files(1)
+    repo.upload(files[0])
+    target = files[0] + '.copy'
+    repo.download(target)
+    with open(files[0], 'rb') as src, open(target, 'rb') as dest:
+        assert src.read() == dest.read(), 'bad download'
+
+    with pytest.raises(OSError):
+        url2repo('memory://bucket/missing').get()
+
+
+def test_build_to_memory():
+    name, config, code = build_file(
+        '{}/handler.py'.format(here), name='mem', archive=True, project='p1',
+        tag='v1', output_dir='memory://store/')
+    url = config['spec']['build']['path']
+    assert url.startswith('memory://store/'), 'bad archive path'
+    data = MemoryRepo.objects[url[len('memory://'):]]
+    with zipfile.ZipFile(BytesIO(data)) as z:
+        assert 'function.yaml' in z.namelist(), 'bad archive'
+
+    zip_dir = mkdtemp(prefix='nuclio-jupyter-archive-')
+    build_file('{}/handler.py'.format(here), name='mem', archive=True,
+               project='p1', output_dir='file://' + zip_dir)
+    config = get_archive_config('mem', 'file://{}/p1/mem.zip'.format(zip_dir))
+    assert zipfile.is_zipfile(config['spec']['build']['path'][7:])
+
+
+class EchoRepo(ExternalRepo):
+    def __init__(self, urlobj):
+        self.urlobj = urlobj
+
+    def get(self):
+        return self.urlobj.path
+
+
+def test_register_repo():
+    with pytest.raises(ValueError):
+        url2repo('echo://host/path')
+    register_repo('echo', EchoRepo)
+    assert url2repo('echo://host/path').get() == '/path', 'not registered'
+    archive.repo_types.pop('echo')
+
+
+def test_upload_zip_manifest():
+    files = data_files()
+    zip_path = path.join(mkdtemp(prefix='nuclio-jupyter-archive-'), 'f1.zip')
+    assert upload_zip(zip_path, new_config(), 'print(1)', files)
+    assert path.isfile(zip_path + '.manifest.json'), 'no manifest'
+    assert not upload_zip(zip_path, new_config(), 'print(1)', files), \
+        'unchanged archive rebuilt'
+
+    copied = []
+
+    def copy_member(src, dest, name):
+        copied.append(name)
+        orig_copy_member(src, dest, name)
+
+    orig_copy_member = archive.copy_member
+    with patch(archive, copy_member=copy_member):
+        assert upload_zip(zip_path, new_config(), 'print(2)', files)
+    assert {f.lstrip('/') for f in files} <= set(copied), \
+        'unchanged files not reused'
+    with zipfile.ZipFile(zip_path) as z:
+        assert z.testzip() is None, 'bad archive'
+        assert z.read('handler.py') == b'print(2)', 'code not updated'
+        with open(files[0], 'rb') as fp:
+            assert z.read(files[0].lstrip('/')) == fp.read(), 'bad member'
+
+    url = 'memory://bucket/f1.zip'
+    assert upload_zip(url, new_config(), 'print(1)', files)
+    data = MemoryRepo.objects['bucket/f1.zip']
+    assert not upload_zip(url, new_config(), 'print(1)', files), \
+        'unchanged archive uploaded'
+    assert upload_zip(url, new_config(), 'print(2)', files)
+    assert MemoryRepo.objects['bucket/f1.zip'] != data, 'not uploaded'
+
+
+def test_file_hash_memo():
+    files = data_files(5)
+    members = [(arc_name(f), None, f) for f in files]
+    hashed = []
+
+    def file_hash(file_path):
+        hashed.append(file_path)
+        return orig_file_hash(file_path)
+
+    orig_file_hash = archive.file_hash
+    with patch(archive, file_hash=file_hash):
+        manifest = archive.archive_manifest(members, zipfile.ZIP_STORED, 0)
+        assert len(hashed) == len(files), 'files not hashed'
+        hashed.clear()
+        assert archive.archive_manifest(
+            members, zipfile.ZIP_STORED, 0) == manifest, 'bad manifest'
+        assert not hashed, 'hashes not memoized'
+
+        with open(files[0], 'ab') as fp:
+            fp.write(b'changed')
+        changed = archive.archive_manifest(members, zipfile.ZIP_STORED, 0)
+    assert hashed == [files[0]], 'changed file not hashed'
+    assert changed['members'][0] != manifest['members'][0], 'stale hash'
+    with open(files[0], 'rb') as fp:
+        assert changed['members'][0][1] == sha256(fp.read()).hexdigest()
+
+
+@pytest.mark.parametrize('compression', ['store', 'deflate', 'bzip2', 'lzma'])
+def test_build_zip_parallel(compression):
+    files = data_files(20)
+    serial = zip_bytes(files, compression=compression, deterministic=True,
+                       workers=1)
+    parallel = zip_bytes(files, compression=compression, deterministic=True,
+                         workers=4)
+    assert serial == parallel, 'parallel archive differs'
+    with zipfile.ZipFile(BytesIO(parallel)) as z:
+        assert z.testzip() is None, 'bad archive'
+
+
+def test_build_zip_dirs():
+    files = data_files(5)
+    dir_path = path.dirname(files[0])
+    names = {arc_name(f) for f in files}
+    for spec in ([dir_path], [path.join(dir_path, '*.txt')],
+                 [path.join(dir_path, '**', 'data-*')], files + [dir_path]):
+        with zipfile.ZipFile(BytesIO(zip_bytes(spec))) as z:
+            assert set(z.namelist()[2:]) == names, 'bad members'
+
+    with pytest.raises(Exception):
+        zip_bytes([path.join(dir_path, '*.none')])
+
+
+def test_archive_reader():
+    file_path = big_file(4 * 1024 ** 2)
+    out = BytesIO()
+    build_zip(out, new_config(), 'print(1)', [file_path],
+              compression='store')
+    Source.data = zip_path_data = out.getvalue()
+    name = arc_name(file_path)
+
+    zip_path = path.join(mkdtemp(prefix='nuclio-jupyter-archive-'), 'f.zip')
+    with open(zip_path, 'wb') as fp:
+        fp.write(zip_path_data)
+    with ArchiveReader(zip_path) as reader:
+        assert reader.namelist() == ['handler.py', 'function.yaml', name]
+        with open(file_path, 'rb') as fp:
+            assert reader.read(name) == fp.read(), 'bad binary member'
+        assert reader.config()['spec'] == {'build': {}}, 'bad config'
+
+    Source.sent = 0
+    with http_server(Source) as url:
+        with ArchiveReader(url + '/f.zip') as reader:
+            assert reader.config()['spec'] == {'build': {}}, 'bad config'
+            with reader.open(name) as fp, open(file_path, 'rb') as src:
+                assert fp.read(100) == src.read(100), 'bad member read'
+        assert Source.sent < len(Source.data) / 2, 'archive downloaded'
+
+        code, config = load_zip_config(url + '/f.zip')
+        assert code == 'print(1)', 'bad code'
@@ -0,0 +1,166 @@
+# Copyright 2018 Iguazio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import json
+from http.server import BaseHTTPRequestHandler
+from threading import Lock
+from time import time
+
+import pytest
+
+from conftest import http_server
+from nuclio.config import meta_keys
+from nuclio.utils import DeployError
+
+pytest.importorskip('aiohttp')
+from nuclio.async_deploy import AsyncDashboardClient  # noqa
+
+build_time = 0.3
+
+
+class Dashboard(BaseHTTPRequestHandler):
+    """Stub nuclio dashboard"""
+    protocol_version = 'HTTP/1.1'
+    lock = Lock()
+    functions = {}
+    projects = {'p1': {'metadata': {'name': 'p1'}, 'spec': {}}}
+    puts = 0
+
+    def reply(self, data, status=200):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def body(self):
+        size = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(size)) if size else {}
+
+    def function(self, name):
+        func = self.functions.get(name)
+        if func and func['status']['state'] == 'building':
+            if time() - func['status']['created'] > build_time:
+                func['status']['state'] = 'ready'
+                func['status']['httpPort'] = 30000 + len(self.functions)
+        return func
+
+    def do_GET(self):
+        path = self.path[len('/api/'):]
+        with self.lock:
+            if path == 'projects':
+                return self.reply(self.projects)
+            if path == 'external_ip_addresses':
+                return self.reply(
+                    {'externalIPAddresses': {'addresses': ['1.2.3.4']}})
+            if path == 'functions':
+                return self.reply(
+                    {name: self.function(name) for name in self.functions})
+            func = self.function(path[len('functions/'):])
+            if func is None:
+                return self.reply({'error': 'not found'}, 404)
+            return self.reply(func)
+
+    def do_POST(self):
+        path = self.path[len('/api/'):]
+        config = self.body()
+        with self.lock:
+            if path == 'projects':
+                name = config['metadata']['name']
+                self.projects[name] = config
+                return self.reply(config)
+            config['status'] = {'state': 'building', 'created': time()}
+            self.functions[config['metadata']['name']] = config
+            self.reply({}, 202)
+
+    def do_PUT(self):
+        with self.lock:
+            Dashboard.puts += 1
+        self.do_POST()
+
+    def do_DELETE(self):
+        name = self.body()['metadata']['name']
+        with self.lock:
+            func = self.functions.pop(name, None)
+        self.reply({}, 200 if func else 404)
+
+    def log_message(self, *args):
+        pass
+
+
+def new_config(name):
+    return {
+        'metadata': {'name': name},
+        'spec': {'handler': 'main:handler'},
+    }
+
+
+def run(url, func):
+    async def main():
+        async with AsyncDashboardClient(url) as client:
+            return await func(client)
+
+    return asyncio.run(main())
+
+
+def test_async_deploy_many():
+    count = 50
+    names = ['async-{}'.format(i) for i in range(count)]
+
+    async def deploy(client):
+        return await asyncio.gather(*[
+            client.deploy_config(new_config(name), project='p1', timeout=10)
+            for name in names])
+
+    with http_server(Dashboard) as url:
+        addresses = run(url, deploy)
+        assert len(addresses) == count, 'bad number of deploys'
+        assert all(addr.startswith('1.2.3.4:') for addr in addresses)
+
+        functions = run(url, lambda client: client.list_functions())
+        assert set(names) <= set(functions), 'functions not listed'
+        labels = functions[names[0]]['metadata']['labels']
+        assert labels[meta_keys.project] == 'p1', 'project not set'
+
+        state, address, _, _ = run(
+            url, lambda client: client.get_deploy_status(names[0]))
+        assert state == 'ready' and address, 'bad status'
+
+        for name in names:
+            run(url, lambda client: client.delete_func(name))
+        functions = run(url, lambda client: client.list_functions())
+        assert not set(names) & set(functions), 'functions not deleted'
+
+
+def test_async_deploy_if_changed():
+    async def deploy(client):
+        return await client.deploy_config(
+            new_config('async-changed'), project='p1', if_changed=True)
+
+    with http_server(Dashboard) as url:
+        addr = run(url, deploy)
+        puts = Dashboard.puts
+        assert run(url, deploy) == addr, 'different address'
+        assert Dashboard.puts == puts, 'unchanged function redeployed'
+
+
+def test_async_project():
+    with http_server(Dashboard) as url:
+        with pytest.raises(DeployError):
+            run(url, lambda client: client.find_or_create_project('p2'))
+        name = run(url, lambda client: client.find_or_create_project(
+            'p2', create_new=True))
+        assert name == 'p2', 'project not created'
@@ -1,4 +1,12 @@
-from nuclio.build import build_file
+import json
+from os import path
+from shutil import copyfile
+from tempfile import mkdtemp
+
+import yaml
+
+from nuclio.build import (build_file, build_notebook, build_many, build_cache,
+                          build_functions)
 from nuclio.config import ConfigSpec, meta_keys, get_in
 from conftest import here
 
@@ -55,3 +63,112 @@ def test_build_file_zip():
 
     assert name == 'hw', 'build failed, name doesnt match={}'.format(name)
     assert config.get('spec'), 'build failed, config={}'.format(config)
+
+
+def test_build_notebook_isolated():
+    filepath = '{}/handler.ipynb'.format(here)
+    for no_embed in (False, True):
+        config, code = build_notebook(filepath, no_embed, isolated=False)
+        iconfig, icode = build_notebook(filepath, no_embed, isolated=True)
+        assert config == iconfig, 'in-process config differs'
+        if no_embed:
+            assert code == icode, 'in-process code differs'
+
+
+def test_build_many():
+    out_dir = mkdtemp(prefix='nuclio-jupyter-build-')
+    py_file = path.join(out_dir, 'other.py')
+    copyfile('{}/handler.py'.format(here), py_file)
+    sources = [py_file, '{}/handler.ipynb'.format(here),
+               '{}/no-such-file.py'.format(here)]
+    results = list(build_many(sources, out_dir, workers=2, tag='v2'))
+
+    assert len(results) == 3, 'bad number of results'
+    errors = [r for r in results if r.error]
+    assert len(errors) == 1, 'expected one failure, got {}'.format(errors)
+    assert errors[0].source == sources[2], 'wrong failed source'
+    for result in results:
+        assert result.duration > 0, 'no duration for {}'.format(result)
+
+    assert path.isfile(path.join(out_dir, 'other', 'other.py')), 'no code'
+    config_path = path.join(out_dir, 'handler', 'function.yaml')
+    assert path.isfile(config_path), 'function.yaml not written'
+    with open(config_path) as fp:
+        config = yaml.safe_load(fp)
+    assert config['metadata']['labels'][meta_keys.tag] == 'v2', 'no tag'
+
+    # same output dir, not built
+    other_dir = mkdtemp(prefix='nuclio-jupyter-build-')
+    same_name = path.join(other_dir, 'other.py')
+    copyfile(py_file, same_name)
+    results = list(build_many([py_file, same_name], out_dir, workers=1))
+    assert len(results) == 2, 'bad number of results'
+    for result in results:
+        assert result.error and 'other' in result.error, 'no name conflict'
+
+
+def test_build_functions():
+    out_dir = mkdtemp(prefix='nuclio-jupyter-build-')
+    nb_path = path.join(out_dir, 'funcs.ipynb')
+    with open('{}/handler.ipynb'.format(here)) as fp:
+        nb = json.load(fp)
+    for name in ('func-a', 'func-b'):
+        nb['cells'] += [
+            {'cell_type': 'code', 'metadata': {}, 'outputs': [],
+             'execution_count': None, 'source': source}
+            for source in ['# nuclio: start-code ' + name,
+                           'def {}(context, event):\n    return 1'.format(
+                               name.replace('-', '_')),
+                           '# nuclio: end-code ' + name]]
+    with open(nb_path, 'w') as fp:
+        json.dump(nb, fp)
+
+    results = build_functions(nb_path, tag='v3', output_dir=out_dir)
+    names = [name for name, _, _ in results]
+    assert sorted(names) == ['func-a', 'func-b', 'funcs'], 'bad functions'
+    for name, config, code in results:
+        assert config['metadata']['name'] == name, 'bad name'
+        assert config['metadata']['labels'][meta_keys.tag] == 'v3', 'no tag'
+        with open(path.join(out_dir, name, 'function.yaml')) as fp:
+            assert yaml.safe_load(fp)['spec'] == config['spec'], 'not saved'
+    codes = {name: code for name, _, code in results}
+    assert 'def func_a(' in codes['func-a'], 'missing function code'
+    assert 'def func_b(' not in codes['func-a'], 'other function code'
+
+    results = list(build_many([nb_path], out_dir, workers=1,
+                              all_functions=True))
+    assert results[0].error is None, 'build failed'
+    assert sorted(results[0].name.split(',')) == sorted(names), 'bad names'
+
+
+def test_build_cache():
+    out_dir = mkdtemp(prefix='nuclio-jupyter-build-')
+    nb_path = path.join(out_dir, 'cached.ipynb')
+    with open('{}/handler.ipynb'.format(here)) as fp:
+        nb = json.load(fp)
+
+    def save_nb():
+        with open(nb_path, 'w') as fp:
+            json.dump(nb, fp)
+
+    save_nb()
+    hits, misses = build_cache.hits, build_cache.misses
+    _, config, code = build_file(nb_path)
+    assert build_cache.misses == misses + 1, 'first build not a miss'
+
+    nb['cells'].append({'cell_type': 'markdown', 'metadata': {},
+                        'source': '# only docs changed'})
+    save_nb()
+    _, cconfig, ccode = build_file(nb_path)
+    assert build_cache.hits == hits + 1, 'markdown change not a cache hit'
+    assert (cconfig, ccode) == (config, code), 'bad cached result'
+
+    build_file(nb_path, cache=False)
+    assert build_cache.hits == hits + 1, 'cache used with cache=False'
+
+    nb['cells'].append({'cell_type': 'code', 'metadata': {}, 'outputs': [],
+                        'execution_count': None, 'source': 'x = 1'})
+    save_nb()
+    _, _, ncode = build_file(nb_path)
+    assert build_cache.misses == misses + 2, 'code change not a cache miss'
+    assert 'x = 1' in ncode, 'code change not built'
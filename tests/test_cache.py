@@ -0,0 +1,73 @@
+# Copyright 2018 Iguazio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+from time import time
+
+from nuclio.cache import FileCache
+
+
+def test_file_cache():
+    cache = FileCache('test-cache', max_size=None)
+    cache.clear()
+    assert cache.get('k1') is None, 'found missing key'
+    cache.put('k1', b'data')
+    assert cache.get('k1') == b'data', 'bad data'
+    assert (cache.hits, cache.misses) == (1, 1), 'bad stats'
+
+    cache.put_json('k2', {'a': [1, 2]})
+    assert cache.get_json('k2') == {'a': [1, 2]}, 'bad json'
+
+
+def test_file_cache_lru():
+    cache = FileCache('test-lru', max_size=25)
+    cache.clear()
+    for i, key in enumerate(['a', 'b', 'c']):
+        cache.put(key, b'x' * 10)
+        # make access times distinct and ordered
+        os.utime(cache.path(key), (time() - 100 + i, time() - 100 + i))
+        cache.get('a')  # keep 'a' recently used
+
+    assert cache.get('a') is not None, 'recently used entry evicted'
+    assert cache.get('b') is None, 'least recently used entry not evicted'
+    assert cache.get('c') is not None, 'new entry evicted'
+
+
+def test_file_cache_age():
+    cache = FileCache('test-age', max_age=60)
+    cache.clear()
+    cache.put('old', b'old')
+    cache.put('new', b'new')
+    old_time = time() - 120
+    os.utime(cache.path('old'), (old_time, old_time))
+    assert cache.get('old') is None, 'expired entry returned'
+    assert cache.get('new') == b'new', 'valid entry missing'
+
+
+def test_file_cache_low_water():
+    cache = FileCache('test-low-water', max_size=100 * 10)
+    cache.clear()
+    scans = []
+    evict = cache.evict
+
+    def counted_evict(keep=None):
+        scans.append(keep)
+        evict(keep)
+
+    cache.evict = counted_evict
+    for i in range(300):
+        cache.put('k{}'.format(i), b'x' * 10)
+    # first put + every 20 puts after the cache is full
+    assert len(scans) <= 12, 'too many scans ({})'.format(len(scans))
+    assert len(os.listdir(cache.root)) <= 100, 'cache over size'
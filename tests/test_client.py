@@ -0,0 +1,76 @@
+# Copyright 2018 Iguazio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from http.server import BaseHTTPRequestHandler
+from time import sleep
+
+import pytest
+
+from conftest import http_server
+from nuclio.client import HTTPClient
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    failures = 0
+    ports = []
+
+    def do_GET(self):
+        Handler.ports.append(self.client_address[1])
+        if self.path == '/slow':
+            sleep(1)
+        status = 200
+        if self.path == '/flaky' and Handler.failures > 0:
+            Handler.failures -= 1
+            status = 503
+        body = b'ok' if status == 200 else b'retry'
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_client_retry():
+    Handler.failures = 2
+    client = HTTPClient(retries=3, backoff=0)
+    with http_server(Handler) as url:
+        resp = client.get(url + '/flaky')
+    assert resp.ok and resp.text == 'ok', 'not retried'
+    assert Handler.failures == 0, 'bad number of retries'
+
+    Handler.failures = 5
+    client = HTTPClient(retries=1, backoff=0)
+    with http_server(Handler) as url:
+        resp = client.get(url + '/flaky')
+    assert resp.status_code == 503, 'expected error after retries'
+
+
+def test_client_pool():
+    Handler.ports = []
+    client = HTTPClient()
+    with http_server(Handler) as url:
+        for _ in range(5):
+            assert client.get(url).ok
+    assert len(Handler.ports) == 5, 'bad number of calls'
+    assert len(set(Handler.ports)) == 1, 'connection not reused'
+
+
+def test_client_timeout():
+    client = HTTPClient(retries=0, timeout=0.2)
+    with http_server(Handler) as url:
+        with pytest.raises(OSError):
+            client.get(url + '/slow')
@@ -13,14 +13,17 @@
 # limitations under the License.
 
 import json
+from http.server import BaseHTTPRequestHandler
 from urllib.parse import urlparse
 from time import time
 
-from conftest import here, patch
+from conftest import here, patch, http_server
 import pytest
 
 from nuclio import deploy
-from nuclio.config import meta_keys, ConfigSpec, Volume
+from nuclio.archive import get_archive_config
+from nuclio.build import code2config
+from nuclio.config import meta_keys, ConfigSpec, Volume, update_in
 
 handler_nb = '{}/handler.ipynb'.format(here)
 
@@ -67,11 +70,19 @@ class Response:
 
 
 # TODO: Get CI env with dashboard
+def update_state(func):
+    if 'status' in func:
+        tdiff = time() - func['status']['created']
+        func['status']['state'] = 'ready' if tdiff > 2 else 'building'
+
+
 class mock_requests:
     @staticmethod
     def get(url, **kwargs):
         path = urlparse(url).path
         if path == api_prefix or path == api_prefix + '/':
+            for func in functions.values():
+                update_state(func)
             return Response(functions)
 
         if path == projects_prefix or path == projects_prefix + '/':
@@ -87,8 +98,7 @@ class mock_requests:
         if not func:
             return Response({'error': '{} not found'.format(name)}, ok=False)
 
-        tdiff = time() - func['status']['created']
-        func['status']['state'] = 'ready' if tdiff > 2 else 'building'
+        update_state(func)
         return Response(func)
 
     @staticmethod
@@ -102,10 +112,12 @@ class mock_requests:
         functions[name] = func
         return Response({'ok': True})
 
+    put = post
+
 
 @pytest.fixture
 def requests():
-    with patch(deploy, requests=mock_requests):
+    with patch(deploy, get_client=lambda: mock_requests):
         yield
 
 
@@ -171,3 +183,168 @@ def test_process_resp():
             assert state == resp['status']['state'], 'bad state'
 
     assert len(logger.logs) == len(logs), 'bad number of logs'
+
+
+def test_deploy_if_changed(requests):
+    code = 'def handler(context, event):\n    return "v1"\n'
+    kw = dict(name='if-changed', project='test-project', if_changed=True)
+    deploy.deploy_code(code, **kw)
+    created = functions['if-changed']['status']['created']
+
+    addr = deploy.deploy_code(code, **kw)
+    assert addr, 'no address for unchanged function'
+    func = functions['if-changed']
+    assert func['status']['created'] == created, 'unchanged was redeployed'
+
+    deploy.deploy_code(code.replace('v1', 'v2'), **kw)
+    func = functions['if-changed']
+    assert func['status']['created'] != created, 'changed not redeployed'
+
+
+def test_deploy_if_changed_archive(requests, tmp_path):
+    from nuclio.archive import manifest_suffix
+
+    # local archive paths can't be deployed, only hashed
+    path = str(tmp_path / 'code.zip')
+    kw = dict(name='if-changed-zip', project='test-project', if_changed=True)
+
+    def deploy_archive():
+        config, _ = code2config('def handler(context, event):\n    pass\n')
+        update_in(config, 'spec.build', {'codeEntryType': 'archive',
+                                         'path': path})
+        update_in(config, 'metadata.name', kw['name'])
+        deploy.deploy_config(config, **kw)
+        return functions[kw['name']]['status']['created']
+
+    # no manifest, can't tell if the code changed
+    created = deploy_archive()
+    assert deploy_archive() != created, 'unhashable code not deployed'
+
+    manifest = tmp_path / ('code.zip' + manifest_suffix)
+    manifest.write_text(json.dumps({'handler.py': 'v1'}))
+    created = deploy_archive()
+    assert deploy_archive() == created, 'unchanged archive redeployed'
+
+    manifest.write_text(json.dumps({'handler.py': 'v2'}))
+    assert deploy_archive() != created, 'changed archive not redeployed'
+
+
+class ManifestStore(BaseHTTPRequestHandler):
+    """Serves archive manifests to requests with the session key"""
+    manifest = {}
+    gets = 0
+
+    def do_GET(self):
+        ManifestStore.gets += 1
+        if self.headers.get('X-v3io-session-key') != 'key' or \
+                not self.path.endswith('.manifest.json'):
+            self.send_error(403)
+            return
+        body = json.dumps(self.manifest).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_deploy_if_changed_v3io(requests):
+    kw = dict(name='if-changed-v3io', project='test-project')
+
+    def deploy_archive(url, **extra):
+        config = get_archive_config(kw['name'], url)
+        deploy.deploy_config(config, **kw, **extra)
+        return functions[kw['name']]['status']['created']
+
+    with http_server(ManifestStore) as url:
+        url = url.replace('http://', 'v3io://:key@') + '/proj/f.zip'
+        ManifestStore.manifest = {'handler.py': 'v1'}
+        created = deploy_archive(url, if_changed=True)
+        assert deploy_archive(url, if_changed=True) == created, \
+            'unchanged archive redeployed'
+        ManifestStore.manifest = {'handler.py': 'v2'}
+        assert deploy_archive(url, if_changed=True) != created, \
+            'changed archive not redeployed'
+
+        gets = ManifestStore.gets
+        deploy_archive(url)
+        assert ManifestStore.gets == gets, 'manifest read without if_changed'
+
+
+def test_deploy_timeout(requests):
+    # functions in the mock are ready 2 seconds after creation
+    mock_requests.post(api_url, json={'metadata': {'name': 'slow'}})
+    start = time()
+    with pytest.raises(deploy.DeployError):
+        deploy.deploy_progress('http://localhost:8080/api', 'slow',
+                               timeout=0.5)
+    assert time() - start < 1.5, 'timeout not respected'
+
+
+def test_backoff():
+    backoff = deploy.Backoff(start=1, factor=2, limit=5, jitter=0.1)
+    delays = [backoff.next_delay() for _ in range(6)]
+    for delay, expected in zip(delays, [1, 2, 4, 5, 5, 5]):
+        assert expected * 0.9 <= delay <= expected * 1.1, 'bad delay'
+    backoff.reset()
+    assert backoff.next_delay() <= 1.1, 'reset failed'
+
+
+def test_deploy_many(requests):
+    configs = []
+    for i in range(3):
+        code = 'def handler(context, event):\n    return "{}"\n'.format(i)
+        config, _ = code2config(code)
+        update_in(config, 'metadata.name', 'many-{}'.format(i))
+        configs.append(config)
+
+    start = time()
+    results = deploy.deploy_many(configs, project='test-project', workers=2)
+    assert [r.name for r in results] == ['many-0', 'many-1', 'many-2']
+    for result in results:
+        assert result.state == 'ready', 'bad state {}'.format(result)
+        assert result.address.startswith('18.197.86.33:'), 'bad address'
+    # 2 functions at a time, each takes ~2 seconds in the mock
+    assert results[2].duration < time() - start - 1, 'not bounded'
+
+    config, _ = code2config('def handler(context, event):\n    pass\n')
+    update_in(config, 'metadata.name', 'many-slow')
+    result, = deploy.deploy_many([config], project='test-project',
+                                 timeout=0.5)
+    assert result.state == 'error' and 'timeout' in result.error
+
+
+def test_deploy_many_project_key(requests):
+    # projects may be listed by a key other than their name (e.g. uuid)
+    keyed = {'proj-uuid': {'metadata': {'name': 'keyed-project'},
+                           'spec': {}}}
+    listed = []
+
+    def get_functions(api_address, project=''):
+        listed.append(project)
+        if len(listed) == 1:
+            raise deploy.DeployError('error: cannot list functions')
+        return mock_requests.get(api_url).json()
+
+    config, _ = code2config('def handler(context, event):\n    pass\n')
+    update_in(config, 'metadata.name', 'many-keyed')
+    projects.update(keyed)
+    try:
+        with patch(deploy, get_functions=get_functions):
+            result, = deploy.deploy_many([config], project='keyed-project')
+    finally:
+        projects.pop('proj-uuid')
+    assert result.state == 'ready', 'bad state {}'.format(result)
+    assert set(listed) == {'proj-uuid'}, 'listed by project name'
+
+    # listing errors are reported per function (not raised)
+    def fail(api_address, project=''):
+        raise deploy.DeployError('error: cannot list functions')
+
+    update_in(config, 'metadata.name', 'many-unlisted')
+    with patch(deploy, get_functions=fail):
+        result, = deploy.deploy_many([config], project='test-project',
+                                     timeout=0.5)
+    assert result.state == 'error' and 'cannot list' in result.error
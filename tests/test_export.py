@@ -13,6 +13,7 @@
 # limitations under the License.
 
 from ast import literal_eval
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 from glob import glob
 from os import environ
@@ -23,7 +24,7 @@ from tempfile import mkdtemp
 import pytest
 import yaml
 
-from conftest import here
+from conftest import here, patch
 from nuclio import export
 from nuclio.utils import env_keys
 from nuclio.config import load_config, load_config_data
@@ -77,7 +78,7 @@ def export_notebook(nb, resources=None):
 @pytest.mark.parametrize(
     'case', cases_from_yml_file(f"{here}/convert_cases.yml")
 )
-def test_convert(case, clean_handlers):
+def test_convert(case):
     nb = gen_nb([case['in']])
     code, _ = export_notebook(nb)
     code = code[code.find('\n'):].strip()  # Trim first line
@@ -133,6 +134,26 @@ def test_env():
     assert env == [{'name': key, 'value': value}], 'bad env'
 
 
+def test_env_batch():
+    cells = ['%nuclio env VAR_{}={}'.format(i, i) for i in range(100)]
+    cells.insert(50, '%nuclio cmd pip install x')
+    cells.append('%nuclio env VAR_0=last')
+    calls = []
+
+    def set_env(config, lines):
+        calls.append(list(lines))
+        orig_set_env(config, lines)
+
+    orig_set_env = export.set_env
+    with patch(export, set_env=set_env):
+        _, config = export_notebook(gen_nb(cells))
+    # flushed before the cmd magic and at the end
+    assert len(calls) == 2, 'env lines not applied in batch'
+    env = config['spec']['env']
+    assert len(env) == 100, 'bad env'
+    assert env[0] == {'name': 'VAR_0', 'value': 'last'}, 'bad env order'
+
+
 def test_named_handler():
     name = 'lassie'
     code = '''%%nuclio handler {}
@@ -318,6 +339,53 @@ def test_named_multi_sections():
                                      'my-function')
 
 
+def test_export_functions():
+    cells = [
+        'a = 1',
+        '%nuclio env USER=daffy',
+        '# nuclio: start-code',
+        'b = 2',
+        '# nuclio: end-code',
+        '# nuclio: start-code my-function',
+        'c = 3',
+        '# nuclio: end-code my-function',
+        '# nuclio: end-code another-function',
+        'd = 4',
+    ]
+    nb = gen_nb(cells)
+    exp = export.NuclioExporter()
+    functions = exp.export_functions(nb)
+    assert set(functions) == {'', 'my-function', 'another-function'}, \
+        'bad functions'
+
+    for name, (config, code) in functions.items():
+        ctx = export.ExportContext(function_name=name)
+        nb_config, nb_code = exp.export_notebook(gen_nb(cells), context=ctx)
+        assert code == nb_code, 'code differs for {!r}'.format(name)
+        if name:
+            assert config['metadata']['name'] == name, 'bad name'
+            nb_config['metadata']['name'] = name
+        assert config == nb_config, 'config differs for {!r}'.format(name)
+
+    assert 'c = 3' in functions['my-function'][1], 'missing function code'
+    assert 'd = 4' not in functions['another-function'][1], 'code after end'
+
+
+def test_export_functions_error():
+    cells = [
+        '# nuclio: start-code my-function',
+        '# nuclio: start-code my-function',
+        'a = 1',
+    ]
+    exp = export.NuclioExporter()
+    with pytest.raises(export.MagicError):
+        exp.export_functions(gen_nb(cells))
+
+    # other functions are not affected
+    config, code = exp.export_notebook(gen_nb(cells))
+    assert 'a = 1' in code, 'missing code'
+
+
 def test_multiple_starts():
     cells = [
         'a = 1',
@@ -587,3 +655,88 @@ def validate_code_with_function_name(expected_cells,
     kw = {env_keys.function_name: function_name}
     with temp_env(kw):
         validate_code(expected_cells, expected_excluded_cells, cells)
+
+
+def test_concurrent_export():
+    notebooks = []
+    for i in range(8):
+        notebooks.append(gen_nb([
+            '%nuclio env INDEX={}'.format(i),
+            '%nuclio env_file {}/env.txt'.format(here),
+            '%nuclio cmd pip install pkg{}'.format(i),
+            '# nuclio: start-code fn{}\nx = {}'.format(i, i),
+            '%%nuclio handler\nx + 1  # nuclio: return',
+            '%%nuclio handler\nx + 2',
+            '# nuclio: end-code fn{}'.format(i),
+        ]))
+
+    def run_export(nb):
+        exp = export.NuclioExporter()
+        ctx = export.ExportContext(function_name='fn{}'.format(nb['id']))
+        return exp.from_notebook_node(nb, {}, context=ctx)[0]
+
+    for i, nb in enumerate(notebooks):
+        nb['id'] = i
+    expected = [run_export(nb) for nb in notebooks]
+
+    jobs = notebooks * 25
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        outputs = list(pool.map(run_export, jobs))
+
+    assert outputs == expected * 25, 'concurrent exports differ from serial'
+    code, config = load_config_data(expected[3])
+    assert 'def handler_1(' in code, 'bad handler names'
+    assert {'name': 'INDEX', 'value': '3'} in config['spec']['env']
+
+
+def test_cell_annotations():
+    assert export.cell_annotations('a = 1') == (False, None, None)
+    code = '# nuclio: end-code\n#mlrun:start-code  fn1\n# nuclio: start-code x'
+    assert export.cell_annotations(code) == (False, 'fn1', '')
+    code = '# nuclio: start-code fn# nuclio: ignore'
+    assert export.cell_annotations(code) == (True, None, None)
+
+
+def test_code_lines():
+    assert export.code_lines('a = 1\n\nb = 2\n') == ['a = 1', '', 'b = 2']
+    assert export.code_lines('# comment\n  \n') == [], 'comments not dropped'
+    code = '%nuclio env A=1\n!ls\n  # c\nx = !ls\n%time f()\n\ny = 1  # c\n'
+    assert export.code_lines(code) == ['x = !ls', '', 'y = 1  # c']
+    assert export.code_lines('!ls\n\n') == [], 'trailing empty line'
+    assert export.code_lines('!ls\n\n\n') == [''], 'blank lines'
+
+
+def test_convert_cell():
+    from nbconvert.filters import ipython2python
+
+    cells = [
+        'x = !ls\nprint(x)', '    a = 1\n    b = 2', '>>> 1 + 1', 'f?',
+        'def f():\n    return 1', ',f a b', 'a = 1\n%time f()\n# c',
+    ]
+    for code in cells:
+        expected = ipython2python('\n'.join(export.code_lines(code)))
+        assert export.convert_cell(code) == expected, 'bad {!r}'.format(code)
+    assert export.convert_cell('# only a comment') is None, 'comment code'
+
+
+def test_cell_memo():
+    cells = ['%nuclio env A=1', '%%nuclio handler\nx + 1']
+    cells += ['x{} = {}\n!ls'.format(i, i) for i in range(50)]
+    nb = gen_nb(cells)
+    exp = export.NuclioExporter()
+    config, code = exp.export_notebook(nb)
+
+    export.parse_cell.cache_clear()
+    export.convert_cell.cache_clear()
+    exp.export_notebook(nb)
+    nb['cells'][10]['source'] = 'changed = 1'
+    config2, code2 = exp.export_notebook(nb)
+    assert export.parse_cell.cache_info().misses == len(cells) + 1, \
+        'unchanged cells parsed again'
+    assert export.convert_cell.cache_info().misses == len(cells) + 1, \
+        'unchanged cells converted again'
+
+    # magics are applied on every export
+    assert config2 == config, 'config differs'
+    assert 'def handler(' in code2, 'no handler'
+    assert 'changed = 1' in code2 and 'x8 = 8' not in code2, 'stale code'
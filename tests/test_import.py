@@ -0,0 +1,52 @@
+# Copyright 2018 Iguazio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from os import path
+from subprocess import PIPE, run
+from sys import executable
+
+from conftest import here
+
+import pytest
+
+root_dir = path.dirname(here)
+heavy_modules = {'IPython', 'boto3', 'botocore', 'ipykernel', 'nbconvert',
+                 'nbformat', 'notebook', 'requests', 'yaml'}
+
+
+def imported(code):
+    """Top level packages imported by code, using python -X importtime"""
+    out = run([executable, '-X', 'importtime', '-c', code], cwd=root_dir,
+              stderr=PIPE, check=True)
+    names = set()
+    for line in out.stderr.decode('utf-8').splitlines():
+        if line.startswith('import time:') and line.count('|') == 2:
+            name = line.rsplit('|', 1)[1].strip()
+            names.add(name.split('.')[0])
+    return names
+
+
+@pytest.mark.parametrize('code, allowed', [
+    ('import nuclio', set()),
+    ('from nuclio import Context, Event, HttpTrigger', set()),
+    ('import nuclio.__main__', {'yaml'}),
+])
+def test_import_time(code, allowed):
+    loaded = imported(code) & heavy_modules
+    assert loaded <= allowed, 'heavy imports: {}'.format(sorted(loaded))
+
+
+def test_lazy_names():
+    code = 'import nuclio; nuclio.deploy_code, nuclio.ConfigSpec'
+    assert 'yaml' in imported(code), 'API not loaded on access'
@@ -0,0 +1,95 @@
+# Copyright 2018 Iguazio
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+from os import path
+from tempfile import mkdtemp
+
+import nbformat
+import pytest
+
+from conftest import here
+from nuclio.nbreader import read_notebook
+
+
+def nbformat_cells(nb_file):
+    nb = nbformat.read(nb_file, as_version=4)
+    cells = []
+    for cell in nb['cells']:
+        cell = dict(cell)
+        cell.pop('attachments', None)
+        if cell['cell_type'] == 'code':
+            cell['outputs'] = []
+        cells.append(cell)
+    return nb, cells
+
+
+def save_nb(nb, name='test.ipynb'):
+    nb_file = path.join(mkdtemp(prefix='nuclio-jupyter-nb-'), name)
+    with open(nb_file, 'w') as fp:
+        json.dump(nb, fp, indent=1)
+    return nb_file
+
+
+def test_read_notebook():
+    nb_file = '{}/handler.ipynb'.format(here)
+    nb = read_notebook(nb_file)
+    expected, cells = nbformat_cells(nb_file)
+    assert nb['cells'] == cells, 'cells differ'
+    assert nb['metadata'] == expected['metadata'], 'metadata differs'
+    assert nb['nbformat'] == 4, 'bad nbformat'
+
+
+def test_read_notebook_outputs():
+    output = {'output_type': 'display_data', 'metadata': {},
+              'data': {'image/png': 'iVBOR' * 10000,
+                       'text/plain': ['{"not": [json', '}]}\\"']}}
+    nb = {
+        'cells': [
+            {'cell_type': 'code', 'execution_count': 1, 'metadata': {},
+             'outputs': [output, output],
+             'source': ['s = "{[\\"quoted\\"]}"\n', 'print(s)  # ünï ✓']},
+            {'cell_type': 'markdown', 'metadata': {'tags': ['a']},
+             'attachments': {'x.png': {'image/png': 'iVBOR'}},
+             'source': 'text'},
+            {'cell_type': 'code', 'execution_count': None, 'metadata': {},
+             'outputs': [], 'source': ''},
+        ],
+        'metadata': {'kernelspec': {'name': 'python3'}},
+        'nbformat': 4, 'nbformat_minor': 2,
+    }
+    nb_file = save_nb(nb)
+    expected, cells = nbformat_cells(nb_file)
+    assert read_notebook(nb_file)['cells'] == cells, 'cells differ'
+
+    # compact JSON (no whitespace)
+    with open(nb_file, 'w') as fp:
+        json.dump(nb, fp, separators=(',', ':'), ensure_ascii=False)
+    assert read_notebook(nb_file)['cells'] == cells, 'cells differ'
+
+
+def test_read_notebook_fallback():
+    # v3 notebooks are converted by nbformat
+    nb = {'worksheets': [{'cells': [
+        {'cell_type': 'code', 'input': 'a = 1', 'outputs': [],
+         'language': 'python', 'metadata': {}}]}],
+        'metadata': {}, 'nbformat': 3, 'nbformat_minor': 0}
+    nb = read_notebook(save_nb(nb))
+    assert nb['cells'][0]['source'] == 'a = 1', 'v3 not converted'
+
+    nb_file = save_nb({})
+    with open(nb_file, 'w') as fp:
+        fp.write('{"cells": [')
+    with pytest.raises(ValueError):
+        read_notebook(nb_file)
@@ -12,7 +12,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from nuclio import config
+import json
+import logging
+
+import pytest
+import yaml
+
+from conftest import here, is_travis
+from nuclio import config, utils
 
 
 def test_update_in():
@@ -26,3 +33,101 @@ def test_update_in():
     assert obj['a']['b']['d'] == [3]
     config.update_in(obj, 'a.b.d', 4, append=True)
     assert obj['a']['b']['d'] == [3, 4]
+
+
+def test_update_env_vars():
+    cfg = config.new_config()
+    config.set_env(cfg, ['A=1', 'B=2', '# comment', 'C=3'])
+    config.set_env_dict(cfg, {'B': 20, 'D': 4})
+    config.update_env_var(cfg, 'A', '10')
+    assert cfg['spec']['env'] == [
+        {'name': 'A', 'value': '10'},
+        {'name': 'B', 'value': '20'},
+        {'name': 'C', 'value': '3'},
+        {'name': 'D', 'value': '4'},
+    ]
+
+    env = {'VAR_{}'.format(i): i for i in range(10000)}
+    config.set_env_dict(cfg, env)
+    config.set_env_dict(cfg, env)
+    assert len(cfg['spec']['env']) == 4 + len(env), 'duplicate vars'
+
+    # edited in place (same length) between calls
+    cfg = config.new_config()
+    config.update_env_var(cfg, 'A', '1')
+    config.update_env_var(cfg, 'B', '2')
+    cfg['spec']['env'][1] = {'name': 'C', 'value': 'x'}
+    config.update_env_var(cfg, 'C', 'y')
+    assert cfg['spec']['env'] == [
+        {'name': 'A', 'value': '1'},
+        {'name': 'C', 'value': 'y'},
+    ], 'bad in place update'
+
+
+def test_new_config():
+    cfg = config.new_config()
+    assert cfg == config._function_config, 'bad template copy'
+    config.update_in(cfg, 'spec.build.commands', 'pip install x', True)
+    config.update_in(cfg, 'metadata.labels.a', 'b')
+    new = config.new_config()
+    assert new['spec']['build']['commands'] == [], 'template changed'
+    assert new['metadata']['labels'] == {}, 'template changed'
+    assert config.get_in(cfg, 'metadata.labels.a') == 'b'
+
+
+def yaml_configs():
+    cfg = config.new_config()
+    config.set_env_dict(cfg, {
+        'A': 'x: y', 'B': 'multi\nline', 'C': "quote'd", 'D': '  lead',
+        'E': 'ünïcode', 'F': '', 'G': '123', 'H': 'true', 'I': 'a' * 200})
+    config.update_in(cfg, 'spec.triggers.http', {
+        'kind': 'http', 'maxWorkers': 8,
+        'attributes': {'ingresses': {'0': {'paths': ['/a', '/b']}}}})
+    config.update_in(cfg, 'spec.build.commands', ['pip install "x>=1"'],
+                     True)
+    with open('{}/deploy.json'.format(here)) as fp:
+        deployed = json.load(fp)  # function from the dashboard API
+    return [config.new_config(), cfg, deployed]
+
+
+def test_yaml_dump():
+    for cfg in yaml_configs():
+        text = utils.yaml_dump(cfg)
+        assert text == yaml.dump(cfg, default_flow_style=False), \
+            'different yaml format'
+        assert utils.yaml_load(text) == cfg, 'bad round trip'
+
+    # tuples are plain lists
+    assert utils.yaml_dump({'a': (1, 2)}) == 'a:\n- 1\n- 2\n'
+    # not plain data, python dumper
+    obj = {'a': complex(1, 2)}
+    assert utils.yaml_dump(obj) == yaml.dump(obj, default_flow_style=False)
+
+
+# CI installs libyaml, so the test doesn't silently skip there
+@pytest.mark.skipif(not yaml.__with_libyaml__ and not is_travis,
+                    reason='no libyaml')
+def test_yaml_dump_libyaml():
+    assert yaml.__with_libyaml__, 'no libyaml'
+    assert utils.SafeDumper is yaml.CSafeDumper, 'libyaml not used'
+    for cfg in yaml_configs():
+        text = yaml.dump(cfg, Dumper=yaml.SafeDumper,
+                         default_flow_style=False)
+        assert yaml.dump(cfg, Dumper=yaml.CSafeDumper,
+                         default_flow_style=False) == text, \
+            'different yaml format'
+        assert utils.yaml_dump(cfg) == text, 'different yaml format'
+
+
+def test_lazy_yaml():
+    rendered = []
+
+    class Config(dict):
+        def items(self):
+            rendered.append(True)
+            return super().items()
+
+    utils.logger.debug('Config:\n%s', utils.LazyYaml(Config(a=1)))
+    assert utils.logger.level > logging.DEBUG
+    assert not rendered, 'rendered when debug is off'
+    assert str(utils.LazyYaml({'a': 1})) == 'a: 1\n'